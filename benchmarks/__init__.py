@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# benchmarks package - performance measurements for trello_webhooks
+"""Benchmarks for the trello_webhooks callback pipeline.
+
+These are plain scripts, run from the project root, e.g.:
+
+    $ python -m benchmarks.batching
+
+They use the test_app test settings, with a throwaway SQLite database
+file (rather than an in-memory database, so that commits cost something),
+and require no network access.
+
+"""
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+def setup_django():
+    """Configure Django, and create a fresh database to run against.
+
+    Returns the path to the temporary directory containing the database,
+    which the caller should pass to `teardown_django` when it's done.
+
+    """
+    # test_app.settings insists on these, but we don't use them
+    for key in ('TRELLO_API_KEY', 'TRELLO_API_SECRET', 'CALLBACK_DOMAIN'):
+        os.environ.setdefault(key, '')
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_app.test_settings')
+
+    from django.conf import settings
+    tmp_dir = tempfile.mkdtemp(prefix='trello_webhooks_bench')
+    settings.DATABASES['default']['NAME'] = os.path.join(tmp_dir, 'bench.db')
+
+    import django
+    django.setup()
+    # the app logs every callback, which drowns out the results
+    logging.disable(logging.CRITICAL)
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0, interactive=False)
+    return tmp_dir
+
+
+def teardown_django(tmp_dir):
+    """Remove the temporary database created by setup_django."""
+    from django.db import connection
+    connection.close()
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def unique_payloads(payloads, count):
+    """Return `count` copies of the payloads, each with a new action id.
+
+    Callbacks for an action that has already been received are ignored,
+    so benchmarks that save the same payloads repeatedly need these.
+
+    """
+    ids = itertools.count(1)
+    results = []
+    for _ in range(count):
+        for payload in payloads:
+            action_id = json.loads(payload)['action']['id']
+            results.append(payload.replace(action_id, '%024x' % next(ids)))
+    return results
+
+
+def timed(func, *args, **kwargs):
+    """Call func, and return (elapsed seconds, return value)."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Compare callback throughput with and without write-behind batching.
+
+Queues a number of callbacks, and then times the `process_batch` worker
+function draining the queue - first saving each event individually, and
+then using a CallbackEventBuffer.
+
+    $ python -m benchmarks.batching [events] [buffer size]
+
+"""
+import sys
+
+from benchmarks import setup_django, teardown_django, timed, unique_payloads
+
+
+def drain(backend, buffer=None):
+    from trello_webhooks import ingest
+    while ingest.process_batch(backend, batch_size=100, buffer=buffer):
+        pass
+    if buffer is not None:
+        ingest.flush_buffer(backend, buffer, force=True)
+
+
+def run(events, buffer_size):
+    from trello_webhooks.buffer import CallbackEventBuffer
+    from trello_webhooks.ingest import DatabaseQueueBackend
+    from trello_webhooks.models import Webhook, CallbackEvent
+    from trello_webhooks.tests import get_sample_data
+
+    Webhook(auth_token='A', trello_model_id='123').save(sync=False)
+    body = get_sample_data('commentCard', 'text')
+    backend = DatabaseQueueBackend()
+    results = []
+    for label, buffer in (
+        ('unbatched', None),
+        ('batched (%i)' % buffer_size, CallbackEventBuffer(buffer_size, 60)),
+    ):
+        CallbackEvent.objects.all().delete()
+        for body in unique_payloads([body], events):
+            backend.enqueue('A', '123', body)
+        elapsed, _ = timed(drain, backend, buffer)
+        assert CallbackEvent.objects.count() == events
+        results.append((label, events / elapsed))
+    return results
+
+
+def main(argv):
+    events = int(argv[1]) if len(argv) > 1 else 2000
+    buffer_size = int(argv[2]) if len(argv) > 2 else 100
+    tmp_dir = setup_django()
+    try:
+        results = run(events, buffer_size)
+    finally:
+        teardown_django(tmp_dir)
+    print u"%i events" % events
+    for label, rate in results:
+        print u"%-16s %10.1f events/sec" % (label, rate)
+    print u"speedup: %.2fx" % (results[1][1] / results[0][1])
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark of the JSON codecs on the sample Trello payloads.
+
+Times `loads` and `dumps` for each installed codec (see trello_webhooks.codec)
+over every payload in trello_webhooks/tests/sample_data, and then the cost
+of loading CallbackEvents from the database with and without touching the
+(lazily parsed) payload.
+
+    $ python -m benchmarks.codec [iterations]
+
+"""
+import os
+import sys
+
+from benchmarks import setup_django, teardown_django, timed, unique_payloads
+
+
+def sample_payloads():
+    """Return the raw text of all of the sample payloads."""
+    from trello_webhooks.tests import get_sample_data
+    sample_dir = os.path.join(
+        os.path.dirname(os.path.dirname(__file__)),
+        'trello_webhooks', 'tests', 'sample_data'
+    )
+    return [
+        get_sample_data(f.split('.')[0], 'text')
+        for f in sorted(os.listdir(sample_dir))
+    ]
+
+
+def bench_codecs(payloads, iterations):
+    from django.core.exceptions import ImproperlyConfigured
+    from trello_webhooks import codec
+
+    results = []
+    for name in codec.CODECS:
+        try:
+            _, loads, dumps = codec.get_codec(name)
+        except ImproperlyConfigured:
+            results.append((name, None, None))
+            continue
+        parsed = [loads(p) for p in payloads]
+
+        def _loads():
+            for _ in range(iterations):
+                for p in payloads:
+                    loads(p)
+
+        def _dumps():
+            for _ in range(iterations):
+                for p in parsed:
+                    dumps(p)
+
+        count = float(iterations * len(payloads))
+        results.append((name, count / timed(_loads)[0], count / timed(_dumps)[0]))  # noqa
+    return results
+
+
+def bench_model(payloads, iterations):
+    from trello_webhooks.models import Webhook, CallbackEvent
+
+    webhook = Webhook(auth_token='A', trello_model_id='123').save(sync=False)
+    for p in unique_payloads(payloads, iterations):
+        webhook.add_callback(p)
+    count = CallbackEvent.objects.count()
+
+    def _load(touch_payload):
+        for event in CallbackEvent.objects.all():
+            if touch_payload:
+                event.event_payload['action']
+
+    return [
+        ('load events, payload not read', count / timed(_load, False)[0]),
+        ('load events, payload read', count / timed(_load, True)[0]),
+    ]
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 1000
+    tmp_dir = setup_django()
+    try:
+        payloads = sample_payloads()
+        codecs = bench_codecs(payloads, iterations)
+        model = bench_model(payloads, max(iterations / 10, 1))
+    finally:
+        teardown_django(tmp_dir)
+    print u"%i sample payloads, %i iterations" % (len(payloads), iterations)
+    print u"%-8s %14s %14s" % (u"codec", u"loads/sec", u"dumps/sec")
+    for name, loads_rate, dumps_rate in codecs:
+        if loads_rate is None:
+            print u"%-8s %14s %14s" % (name, u"n/a", u"n/a")
+        else:
+            print u"%-8s %14.1f %14.1f" % (name, loads_rate, dumps_rate)
+    for label, rate in model:
+        print u"%-32s %10.1f events/sec" % (label, rate)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
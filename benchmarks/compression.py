@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of payload compression on the sample Trello payloads.
+
+Reports the size reduction, and compress / decompress rates, for each
+installed algorithm (see trello_webhooks.compression) over every payload in
+trello_webhooks/tests/sample_data, and then the cost of saving events, and
+loading them and reading their payloads, with and without compression.
+
+    $ python -m benchmarks.compression [iterations]
+
+"""
+import sys
+
+import mock
+
+from benchmarks import setup_django, teardown_django, timed, unique_payloads
+from benchmarks.codec import sample_payloads
+
+
+def bench_algorithms(payloads, iterations):
+    from django.core.exceptions import ImproperlyConfigured
+    from trello_webhooks import compression
+
+    size = sum(len(p.encode('utf-8')) for p in payloads)
+    results = [('none', size, None, None)]
+    for name in compression.ALGORITHMS:
+        try:
+            compression.get_compressor(name)
+        except ImproperlyConfigured:
+            results.append((name, None, None, None))
+            continue
+        compressed = [compression.compress(p, name) for p in payloads]
+
+        def _compress():
+            for _ in range(iterations):
+                for p in payloads:
+                    compression.compress(p, name)
+
+        def _decompress():
+            for _ in range(iterations):
+                for c in compressed:
+                    compression.decompress(c)
+
+        count = float(iterations * len(payloads))
+        results.append((
+            name,
+            sum(len(c) for c in compressed),
+            count / timed(_compress)[0],
+            count / timed(_decompress)[0]
+        ))
+    return results
+
+
+def bench_model(webhook, payloads, iterations, algorithm):
+    from trello_webhooks.models import CallbackEvent
+
+    CallbackEvent.objects.all().delete()
+    payloads = unique_payloads(payloads, iterations)
+
+    def _save():
+        for p in payloads:
+            webhook.add_callback(p)
+
+    def _load():
+        for event in CallbackEvent.objects.all():
+            event.event_payload['action']
+
+    count = len(payloads)
+    with mock.patch('trello_webhooks.compression.ALGORITHM', algorithm):
+        save_time, _ = timed(_save)
+        load_time, _ = timed(_load)
+    return count / save_time, count / load_time
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 1000
+    tmp_dir = setup_django()
+    try:
+        from trello_webhooks.models import Webhook
+        payloads = [p.decode('utf-8') for p in sample_payloads()]
+        algorithms = bench_algorithms(payloads, iterations)
+        webhook = Webhook(auth_token='A', trello_model_id='123').save(sync=False)  # noqa
+        # None (no compression), and each installed algorithm
+        names = [None] + [a[0] for a in algorithms[1:] if a[1] is not None]
+        model = [
+            (name or 'none', bench_model(webhook, payloads, max(iterations / 10, 1), name))  # noqa
+            for name in names
+        ]
+    finally:
+        teardown_django(tmp_dir)
+    print u"%i sample payloads, %i iterations" % (len(payloads), iterations)
+    print u"%-6s %10s %7s %16s %16s" % (
+        u"algo", u"bytes", u"ratio", u"compress/sec", u"decompress/sec"
+    )
+    raw_size = algorithms[0][1]
+    for name, size, compress_rate, decompress_rate in algorithms:
+        if size is None:
+            print u"%-6s %10s" % (name, u"n/a")
+        elif compress_rate is None:
+            print u"%-6s %10i %6.1f%%" % (name, size, 100.0)
+        else:
+            print u"%-6s %10i %6.1f%% %16.1f %16.1f" % (
+                name, size, 100.0 * size / raw_size,
+                compress_rate, decompress_rate
+            )
+    for name, (save_rate, load_rate) in model:
+        print u"%-6s saved %10.1f events/sec, loaded + read %10.1f events/sec" % (  # noqa
+            name, save_rate, load_rate
+        )
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Trello callback payloads, for the benchmarks.
+
+The payloads are built from the samples in trello_webhooks/tests/sample_data
+(which are real Trello callbacks), with the action type changed, and the
+extra data that each type carries (checklist, label, attachment etc.) added,
+so that there is a payload for every event type that has a template. Every
+payload gets new action, card and list ids, names and text, drawn from a
+seeded random number generator - so the same seed always produces the same
+payloads, and benchmark runs are comparable.
+
+    >>> generator = PayloadGenerator(seed=1)
+    >>> text = generator.text('addLabelToCard')
+
+"""
+import copy
+import json
+import os
+import random
+
+SAMPLE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'trello_webhooks', 'tests', 'sample_data'
+)
+
+# the sample that each event type is built from, if it has none of its own
+DEFAULT_SAMPLE = 'commentCard'
+
+WORDS = (
+    u"alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo "
+    u"lima mike november oscar papa quebec romeo sierra tango uniform "
+    u"victor whiskey x-ray yankee zulu caf\xe9 na\xefve ☃"
+).split()
+
+COLORS = ('green', 'yellow', 'orange', 'red', 'purple', 'blue')
+
+
+def load_samples():
+    """Return {event_type: payload} for all of the sample payloads."""
+    samples = {}
+    for filename in sorted(os.listdir(SAMPLE_DIR)):
+        with open(os.path.join(SAMPLE_DIR, filename)) as f:
+            payload = json.load(f)
+        samples[payload['action']['type']] = payload
+    return samples
+
+
+def template_event_types():
+    """Return the (sorted) event types that have a trello_webhooks template.
+
+    NB this needs Django to have been set up.
+
+    """
+    from trello_webhooks.rendering import find_event_types
+    return sorted(find_event_types())
+
+
+class PayloadGenerator(object):
+    """Builds random, but reproducible, callback payloads."""
+
+    def __init__(self, seed=0, samples=None):
+        self.random = random.Random(seed)
+        self.samples = samples or load_samples()
+
+    def new_id(self):
+        return '%024x' % self.random.getrandbits(96)
+
+    def words(self, count):
+        return u" ".join(self.random.choice(WORDS) for _ in range(count))
+
+    def item(self, **kwargs):
+        """Return a new {id, name} dict, plus any extra kwargs."""
+        item = {'id': self.new_id(), 'name': self.words(3).capitalize()}
+        item.update(kwargs)
+        return item
+
+    def member(self):
+        name = self.words(2).title()
+        return {
+            'id': self.new_id(),
+            'fullName': name,
+            'initials': u"".join(w[0] for w in name.split()).upper(),
+            'username': name.replace(u" ", u"").lower(),
+        }
+
+    def payload(self, event_type):
+        """Return a new payload (dict) for an event type."""
+        payload = copy.deepcopy(
+            self.samples.get(event_type) or self.samples[DEFAULT_SAMPLE]
+        )
+        action = payload['action']
+        action['id'] = self.new_id()
+        action['type'] = event_type
+        action['memberCreator'] = self.member()
+        action['idMemberCreator'] = action['memberCreator']['id']
+        data = action['data']
+        if 'card' in data:
+            data['card'].update(id=self.new_id(), name=self.words(4).capitalize())  # noqa
+        if 'list' in data:
+            data['list'].update(id=self.new_id(), name=self.words(2).capitalize())  # noqa
+        if 'text' in data:
+            data['text'] = self.words(self.random.randint(1, 40))
+        self.add_data(event_type, action, data)
+        return payload
+
+    def add_data(self, event_type, action, data):
+        """Add the type-specific data used by the templates."""
+        if 'Attachment' in event_type:
+            data['attachment'] = self.item(url=u"https://example.com/%s" % self.new_id())  # noqa
+        if 'Checklist' in event_type or 'CheckItem' in event_type:
+            data['checklist'] = self.item()
+        if 'CheckItem' in event_type:
+            data['checkItem'] = self.item(
+                state=self.random.choice(('complete', 'incomplete'))
+            )
+        if 'Label' in event_type:
+            data['label'] = self.item(color=self.random.choice(COLORS))
+        if 'Member' in event_type:
+            action['member'] = self.member()
+        if event_type == 'deleteComment':
+            data['action'] = {'id': self.new_id()}
+        if event_type in ('updateCheckItem', 'updateLabel', 'updateList'):
+            data['old'] = {'name': self.words(3)}
+
+    def text(self, event_type):
+        """Return a new payload for an event type, as JSON text."""
+        return json.dumps(self.payload(event_type))
+
+    def texts(self, count, event_types):
+        """Return `count` payloads (as text), cycling through event_types."""
+        return [
+            self.text(event_types[i % len(event_types)])
+            for i in range(count)
+        ]
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite for the callback pipeline.
+
+Times each stage of handling a Trello callback, using synthetic payloads
+for every templated event type (see benchmarks.payloads):
+
+    api_callback          POST to the callback view, via the test client
+    add_callback          Webhook.add_callback
+    add_callback_metrics  ditto, with stage timings sent to a MemoryBackend
+    render                CallbackEvent.render, without the output cache
+    render_cached         CallbackEvent.render, from the output cache
+    admin_changelist      building and rendering a CallbackEvent admin page
+    sync_webhooks         the sync_webhooks command, against a fake Trello
+    sync_webhooks_workers ditto, with --workers 4
+
+Everything runs locally - Trello is replaced by the FakeTrello server from
+the tests. The test app's callback_received receiver is unregistered, so
+that only the app's own work is measured.
+
+    $ python -m benchmarks.pipeline [-n ITERATIONS] [-b NAME ...] [-o FILE]
+
+Results are printed as a table, and with `--output` are also written as
+JSON (the timings for each benchmark, plus the Python, Django and database
+versions they were taken with). To check for regressions, compare a run
+against saved results - the exit status is 1 if any benchmark's median time
+is more than `--threshold` percent slower than the baseline:
+
+    $ python -m benchmarks.pipeline -o before.json
+    ... change things ...
+    $ python -m benchmarks.pipeline -o after.json --compare before.json
+
+or compare two saved runs, without running anything:
+
+    $ python -m benchmarks.pipeline --input after.json --compare before.json
+
+"""
+from datetime import datetime
+import json
+from optparse import OptionParser
+import platform
+import subprocess
+import sys
+import timeit
+
+import mock
+
+from benchmarks import setup_django, teardown_django
+from benchmarks.payloads import PayloadGenerator, template_event_types
+
+# timer used for each individual operation
+clock = timeit.default_timer
+
+
+def measure(func, items):
+    """Call func for each item, and return the list of times (seconds)."""
+    times = []
+    for item in items:
+        start = clock()
+        func(item)
+        times.append(clock() - start)
+    return times
+
+
+def percentile(values, pct):
+    """Return the pct percentile of a sorted list (nearest rank)."""
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def summarise(times):
+    """Return the summary statistics for a list of times, in ms."""
+    times = sorted(times)
+    total = sum(times)
+    return {
+        'count': len(times),
+        'total_s': total,
+        'ops_per_sec': len(times) / total if total else None,
+        'mean_ms': 1000 * total / len(times),
+        'median_ms': 1000 * percentile(times, 50),
+        'p95_ms': 1000 * percentile(times, 95),
+        'min_ms': 1000 * times[0],
+        'max_ms': 1000 * times[-1],
+    }
+
+
+class Pipeline(object):
+    """The benchmarks, and the state (webhooks, payloads) they share."""
+
+    BENCHMARKS = (
+        'api_callback',
+        'add_callback',
+        'add_callback_metrics',
+        'render',
+        'render_cached',
+        'admin_changelist',
+        'sync_webhooks',
+        'sync_webhooks_workers',
+    )
+
+    def __init__(self, iterations, seed=0):
+        from trello_webhooks.models import Webhook
+        self.iterations = iterations
+        self.generator = PayloadGenerator(seed)
+        self.event_types = template_event_types()
+        self.webhook = Webhook(auth_token='A', trello_model_id='M').save(sync=False)  # noqa
+
+    def payloads(self, count=None):
+        return self.generator.texts(count or self.iterations, self.event_types)
+
+    def clear_events(self):
+        from trello_webhooks.models import CallbackEvent
+        CallbackEvent.objects.all().delete()
+
+    def save_events(self, count):
+        """Save `count` events, in bulk, and return them."""
+        from trello_webhooks.models import CallbackEvent
+        self.clear_events()
+        CallbackEvent.objects.bulk_create(
+            self.webhook.build_callback(text) for text in self.payloads(count)
+        )
+        return list(CallbackEvent.objects.order_by('id'))
+
+    def bench_api_callback(self):
+        from django.core.urlresolvers import reverse
+        from django.test import Client
+        client = Client()
+        url = reverse('trello_callback_url', kwargs={
+            'auth_token': self.webhook.auth_token,
+            'trello_model_id': self.webhook.trello_model_id,
+        })
+        self.clear_events()
+
+        def post(text):
+            response = client.post(url, data=text, content_type='application/json')  # noqa
+            assert response.status_code == 200, response.status_code
+
+        return measure(post, self.payloads())
+
+    def bench_add_callback(self):
+        self.clear_events()
+        return measure(self.webhook.add_callback, self.payloads())
+
+    def bench_add_callback_metrics(self):
+        from trello_webhooks import metrics
+        metrics.set_backend(metrics.MemoryBackend())
+        try:
+            return self.bench_add_callback()
+        finally:
+            metrics.set_backend(None)
+
+    def bench_render(self):
+        events = self.save_events(self.iterations)
+        with mock.patch('trello_webhooks.settings.RENDER_CACHE', None):
+            return measure(lambda e: e.render(), events)
+
+    def bench_render_cached(self):
+        events = self.save_events(self.iterations)
+        with mock.patch('trello_webhooks.settings.RENDER_CACHE', 'default'):
+            for event in events:
+                event.render()
+            return measure(lambda e: e.render(), events)
+
+    def bench_admin_changelist(self):
+        from django.contrib import admin
+        from django.contrib.admin.templatetags.admin_list import results
+        from django.test import RequestFactory
+        from trello_webhooks.admin import CallbackEventAdmin
+        from trello_webhooks.models import CallbackEvent
+
+        self.save_events(self.iterations * 10)
+        model_admin = CallbackEventAdmin(CallbackEvent, admin.site)
+        request = RequestFactory().get('/')
+        request.user = mock.Mock()
+
+        # as the admin's changelist_view, without the page template
+        def changelist(_):
+            ChangeList = model_admin.get_changelist(request)
+            cl = ChangeList(
+                request, CallbackEvent, model_admin.list_display,
+                model_admin.list_display_links, model_admin.list_filter,
+                model_admin.date_hierarchy, model_admin.search_fields,
+                model_admin.list_select_related, model_admin.list_per_page,
+                model_admin.list_max_show_all, model_admin.list_editable,
+                model_admin
+            )
+            cl.formset = None
+            return [list(row) for row in results(cl)]
+
+        return measure(changelist, range(max(self.iterations / 10, 1)))
+
+    def bench_sync_webhooks(self, workers=1):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        from trello_webhooks.models import Webhook
+        from trello_webhooks.tests.fake_trello import FakeTrello
+
+        Webhook.objects.exclude(id=self.webhook.id).delete()
+        with FakeTrello() as server:
+            # 10 tokens, each with 10 local webhooks, half of which Trello
+            # already has, and 2 that only Trello has
+            for token in range(10):
+                for model in range(12):
+                    auth_token, model_id = 'T%i' % token, 'M%i-%i' % (token, model)  # noqa
+                    if model < 10:
+                        Webhook(auth_token=auth_token, trello_model_id=model_id).save(sync=False)  # noqa
+                    if model >= 5:
+                        server.add_webhook(auth_token, model_id)
+
+            def sync(_):
+                call_command('sync_webhooks', workers=workers, stdout=StringIO())  # noqa
+
+            with mock.patch('trello_webhooks.settings.TRELLO_API_URL', server.url):  # noqa
+                return measure(sync, range(max(self.iterations / 100, 3)))
+
+    def bench_sync_webhooks_workers(self):
+        return self.bench_sync_webhooks(workers=4)
+
+    def run(self, names=None):
+        """Run the benchmarks, and return {name: summary}."""
+        results = {}
+        for name in names or self.BENCHMARKS:
+            times = getattr(self, 'bench_%s' % name)()
+            results[name] = summarise(times)
+            print >> sys.stderr, u"%s: done" % name
+        return results
+
+
+def environment(options):
+    """Return details of what the benchmarks were run on."""
+    import django
+    from django.db import connection
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.STDOUT
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'revision': revision,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+        'iterations': options.iterations,
+        'seed': options.seed,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Compare two sets of results, by median time.
+
+    Returns a list of (name, baseline_ms, current_ms, change_pct, status)
+    tuples, where status is 'regression' if the current time is more than
+    `threshold` percent slower, 'improvement' if it's more than `threshold`
+    percent faster, else 'ok' (or 'new' / 'missing').
+
+    """
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline:
+            rows.append((name, None, current[name]['median_ms'], None, 'new'))
+            continue
+        if name not in current:
+            rows.append((name, baseline[name]['median_ms'], None, None, 'missing'))  # noqa
+            continue
+        before = baseline[name]['median_ms']
+        after = current[name]['median_ms']
+        change = 100.0 * (after - before) / before if before else 0.0
+        if change > threshold:
+            status = 'regression'
+        elif change < -threshold:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, before, after, change, status))
+    return rows
+
+
+def print_results(results):
+    print u"%-22s %7s %12s %10s %10s %10s" % (
+        u"benchmark", u"count", u"ops/sec", u"mean ms", u"median ms", u"p95 ms"
+    )
+    for name in Pipeline.BENCHMARKS:
+        if name in results:
+            r = results[name]
+            print u"%-22s %7i %12.1f %10.3f %10.3f %10.3f" % (
+                name, r['count'], r['ops_per_sec'] or 0,
+                r['mean_ms'], r['median_ms'], r['p95_ms']
+            )
+
+
+def print_comparison(rows):
+    fmt = lambda v, f: u"-" if v is None else f % v  # noqa
+    print u"%-22s %12s %12s %9s  %s" % (
+        u"benchmark", u"before ms", u"after ms", u"change", u"status"
+    )
+    for name, before, after, change, status in rows:
+        print u"%-22s %12s %12s %9s  %s" % (
+            name, fmt(before, u"%.3f"), fmt(after, u"%.3f"),
+            fmt(change, u"%+.1f%%"), status
+        )
+
+
+def main(argv):
+    parser = OptionParser(usage=u"python -m benchmarks.pipeline [options]")
+    parser.add_option(
+        '-n', '--iterations', type='int', default=500,
+        help=u"Operations per benchmark (default 500, fewer for the slow ones)."  # noqa
+    )
+    parser.add_option(
+        '-b', '--benchmark', action='append', dest='benchmarks',
+        choices=Pipeline.BENCHMARKS,
+        help=u"Only run this benchmark (can be repeated)."
+    )
+    parser.add_option(
+        '--seed', type='int', default=0,
+        help=u"Seed for the payload generator (default 0)."
+    )
+    parser.add_option(
+        '-o', '--output',
+        help=u"Write the results, as JSON, to this file."
+    )
+    parser.add_option(
+        '-i', '--input',
+        help=u"Read the results from this file, instead of running the benchmarks."  # noqa
+    )
+    parser.add_option(
+        '-c', '--compare',
+        help=u"Compare the results with those in this file."
+    )
+    parser.add_option(
+        '-t', '--threshold', type='float', default=10.0,
+        help=u"Percent slowdown counted as a regression (default 10)."
+    )
+    options, _ = parser.parse_args(argv[1:])
+
+    if options.input:
+        with open(options.input) as f:
+            report = json.load(f)
+    else:
+        tmp_dir = setup_django()
+        try:
+            from trello_webhooks.dispatch import dispatcher
+            # measure the app, not the test app's (async) receiver
+            dispatcher.receivers.clear()
+            pipeline = Pipeline(options.iterations, options.seed)
+            report = {
+                'environment': environment(options),
+                'results': pipeline.run(options.benchmarks),
+            }
+        finally:
+            teardown_django(tmp_dir)
+        if options.output:
+            with open(options.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+    print_results(report['results'])
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        print
+        rows = compare(baseline['results'], report['results'], options.threshold)  # noqa
+        print_comparison(rows)
+        if any(row[-1] == 'regression' for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
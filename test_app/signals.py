@@ -3,9 +3,8 @@ import logging
 from os import path, listdir
 
 from django.conf import settings
-from django.dispatch import receiver
 
-from trello_webhooks.signals import callback_received
+from trello_webhooks.dispatch import async_receiver
 
 from test_app.hipchat import send_to_hipchat
 
@@ -28,17 +27,22 @@ def get_supported_events():
     return [t.split('.')[0] for t in listdir(app_template_path)]
 
 
-@receiver(callback_received, dispatch_uid="callback_received")
+# rendering and posting to HipChat is slow, so run it in the background
+@async_receiver(timeout=10)
 def on_callback_received(sender, **kwargs):
     # if a template exists for the event_type, then send the output
     # as a normal notification, in 'yellow'
     # if no template exists, send a notification in 'red'
     event = kwargs.pop('event')
-    html = event.render()
+    if event.has_template:
+        html, color = event.render(), "yellow"
+    else:
+        # no need to attempt the render, we know it will fail
+        html, color = u"Unsupported Trello event: %s" % event.event_type, "red"
     if settings.HIPCHAT_ENABLED:
         logger.debug(
             u"Message sent to HipChat [%s]: %r",
-            send_to_hipchat(html), event, event.webhook
+            send_to_hipchat(html, color=color), event, event.webhook
         )
     else:
         logger.debug(
@@ -13,6 +13,10 @@ DATABASES = {
 # the django apps aren't required for the tests,
 INSTALLED_APPS = ('trello_webhooks',)
 
+# event ids are reused between tests (as each test is rolled back), so the
+# rendered event cache is disabled - tests that use it enable it themselves.
+TRELLO_WEBHOOKS_RENDER_CACHE = None
+
 try:
     import django_nose  # noqa
     TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
@@ -1 +1,2 @@
 # trello_webhooks package
+default_app_config = 'trello_webhooks.apps.TrelloWebhooksConfig'
@@ -0,0 +1,151 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.activity - coalesced updates of Webhook.last_updated_at
+"""Debounced write-behind of Webhook.last_updated_at.
+
+By default every callback calls Webhook.touch(), which is an UPDATE on the
+webhook row. On a busy board that's the same row being written hundreds
+of times a minute, from every worker process.
+
+If TRELLO_WEBHOOKS_TOUCH_INTERVAL is set (to a number of seconds), then
+Webhook.record_activity() updates the timestamp in memory only, and the
+ActivityRecorder writes the latest timestamp for each webhook back to the
+database at most once per interval - all of the pending webhooks are
+updated together, in a single transaction.
+
+A background timer makes sure that pending timestamps are written within
+the interval even if no more callbacks arrive, so last_updated_at in the
+database (and hence the admin site) is never more than TOUCH_INTERVAL
+seconds behind. NB the recorder is per-process, so each process will
+write to the row at most once per interval.
+
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from trello_webhooks import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityRecorder(object):
+    """Collects webhook activity timestamps, and writes them in bulk."""
+
+    def __init__(self, interval=None, use_timer=True):
+        self.interval = settings.TOUCH_INTERVAL if interval is None else interval
+        # if False, pending timestamps are only written when record() or
+        # flush() is called - used in tests.
+        self.use_timer = use_timer
+        # webhook id: latest activity timestamp
+        self._pending = {}
+        self._last_flush = time.time()
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, webhook, timestamp=None):
+        """Record activity on the webhook at `timestamp` (default: now).
+
+        The webhook's in-memory last_updated_at is updated immediately,
+        the database is updated on the next flush. If the flush is due, it
+        happens here, but outside the lock (so that other threads aren't
+        held up by the UPDATEs), and errors are logged, not raised - the
+        timestamps are kept, and written by a later flush.
+
+        """
+        timestamp = timestamp or timezone.now()
+        webhook.last_updated_at = timestamp
+        with self._lock:
+            self._merge({webhook.pk: timestamp})
+            due = time.time() - self._last_flush >= self.interval
+            if not due:
+                self._start_timer()
+        if due:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(u"Error writing webhook activity timestamps")
+        return webhook
+
+    def _merge(self, timestamps):
+        """Add timestamps to those pending, keeping the latest for each
+        webhook. Must be called with the lock held."""
+        for pk, timestamp in timestamps.items():
+            current = self._pending.get(pk)
+            if current is None or timestamp > current:
+                self._pending[pk] = timestamp
+
+    def _start_timer(self):
+        if not self.use_timer or self._timer is not None:
+            return
+        delay = max(self.interval - (time.time() - self._last_flush), 0)
+        self._timer = threading.Timer(delay, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception(u"Error writing webhook activity timestamps")
+        finally:
+            # the timer thread has its own database connection
+            connection.close()
+
+    def flush(self):
+        """Write all pending timestamps to the database.
+
+        The UPDATE is filtered on last_updated_at so that a process that
+        is behind the times can never move a timestamp backwards. If it
+        fails, the timestamps are put back, to be written by the next
+        flush, and the error is raised.
+
+        Returns the number of webhooks updated.
+
+        """
+        # imported here as the models module imports this one
+        from trello_webhooks.models import Webhook
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.time()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                for pk, timestamp in pending.items():
+                    (
+                        Webhook.objects
+                        .filter(pk=pk, last_updated_at__lt=timestamp)
+                        .update(last_updated_at=timestamp)
+                    )
+        except Exception:
+            with self._lock:
+                self._merge(pending)
+                self._start_timer()
+            raise
+        logger.debug(u"Updated activity timestamps for %i webhooks", len(pending))  # noqa
+        return len(pending)
+
+
+# the process-wide recorder used by Webhook.record_activity
+activity_recorder = ActivityRecorder()
+
+
+@atexit.register
+def _flush_on_exit():
+    if len(activity_recorder) == 0:
+        return
+    try:
+        activity_recorder.flush()
+    except Exception:
+        logger.exception(u"Error writing webhook activity timestamps on exit")
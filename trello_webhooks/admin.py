@@ -1,23 +1,123 @@
 # -*- coding: utf-8 -*-
-import json
 import logging
 
 from django.conf import settings
+from django.conf.urls import patterns, url
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, SEARCH_VAR
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator, InvalidPage
 from django.core.urlresolvers import reverse
+from django.db import connections
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+)
+from django.utils.functional import cached_property
 from django.template.defaultfilters import date as date_format
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.template.defaultfilters import truncatewords, truncatechars
 
+from trello_webhooks import archive, codec, export, settings as app_settings
 from trello_webhooks.models import Webhook, CallbackEvent
 from trello_webhooks.forms import WebhookForm
+from trello_webhooks.rendering import template_registry
 
 logger = logging.getLogger(__name__)
 
 
+def estimated_count(queryset):
+    """Return the database's estimate of the number of rows in a table.
+
+    This is read from the database statistics, so is near-instant however
+    large the table is, but is only an estimate, and only applies to the
+    whole table (filters on the queryset are ignored). Returns None if the
+    database doesn't support estimates.
+
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE relname = %s", [table]
+        )
+    elif connection.vendor == 'mysql':
+        cursor.execute(
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s", [table]
+        )
+    else:
+        return None
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids COUNT(*) on very large, unfiltered, tables.
+
+    If the queryset is unfiltered, and the table is estimated to contain
+    more than ADMIN_COUNT_THRESHOLD rows, the estimate is used as the count.
+    Filtered querysets (and small tables) are counted exactly.
+
+    """
+    @cached_property
+    def count(self):
+        threshold = app_settings.ADMIN_COUNT_THRESHOLD
+        if threshold and not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate > threshold:
+                return estimate
+        return super(EstimatedCountPaginator, self).count
+
+
+class EstimatedCountChangeList(ChangeList):
+    """ChangeList that estimates the total (unfiltered) result count.
+
+    When filters are applied the stock ChangeList counts the whole table
+    in order to display "N results (M total)" - which on a very large table
+    is as slow as the unfiltered count. This is identical to the stock
+    get_results, except that the total uses EstimatedCountPaginator.
+
+    """
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)  # noqa
+        result_count = paginator.count
+
+        if self.get_filters_params() or self.params.get(SEARCH_VAR):
+            full_result_count = EstimatedCountPaginator(
+                self.root_queryset, self.list_per_page
+            ).count
+        else:
+            full_result_count = result_count
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.queryset._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
 class CallbackEventAdmin(admin.ModelAdmin):
 
+    # NB the changelist is designed to run in a fixed number of queries,
+    # however many rows are displayed - none of the list_display columns
+    # touch related objects or render templates - and without a COUNT(*)
+    # on the full table (see EstimatedCountPaginator).
+    paginator = EstimatedCountPaginator
+    list_select_related = ()
     list_display = (
         'timestamp',
         'webhook_',
@@ -30,7 +130,8 @@ class CallbackEventAdmin(admin.ModelAdmin):
     )
     list_filter = (
         'timestamp',
-        'event_type'
+        'event_type',
+        'trello_board_name',
     )
     fields = (
         'timestamp',
@@ -47,8 +148,61 @@ class CallbackEventAdmin(admin.ModelAdmin):
         'payload_',
     )
 
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return patterns(
+            '',
+            url(
+                r'^export/$',
+                self.admin_site.admin_view(self.export_view),
+                name='%s_%s_export' % info
+            ),
+        ) + super(CallbackEventAdmin, self).get_urls()
+
+    def export_view(self, request):
+        """Stream events as JSONL or CSV - see trello_webhooks.export.
+
+        Takes the same filters as the `export_callback_events` command, as
+        querystring params: `webhook` and `event_type` (both repeatable),
+        `since`, `until` and `format` ('jsonl' or 'csv').
+
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        format_ = request.GET.get('format', 'jsonl')
+        try:
+            if format_ not in export.FORMATS:
+                raise ValueError(u"Unknown format: '%s'" % format_)
+            since, until = [
+                export.parse_time(request.GET[key]) if request.GET.get(key) else None  # noqa
+                for key in ('since', 'until')
+            ]
+            webhooks = [int(w) for w in request.GET.getlist('webhook')]
+        except ValueError as ex:
+            return HttpResponse(unicode(ex), status=400)
+        queryset = export.filter_events(
+            webhooks=webhooks,
+            event_types=request.GET.getlist('event_type'),
+            since=since,
+            until=until
+        )
+        response = StreamingHttpResponse(
+            export.export(export.iter_events(queryset), format_),
+            content_type=export.CONTENT_TYPES[format_]
+        )
+        response['Content-Disposition'] = (
+            'attachment; filename="callback_events.%s"' % format_
+        )
+        logger.info(u"%s exported callback events from the admin site.", request.user)  # noqa
+        return response
+
     def webhook_(self, instance):
-        return instance.webhook.id
+        # webhook_id rather than webhook.id, to avoid fetching the webhook
+        return instance.webhook_id
+    webhook_.admin_order_field = 'webhook'
 
     def payload_(self, instance):
         """Returns a prettier version of the payload.
@@ -58,75 +212,36 @@ class CallbackEventAdmin(admin.ModelAdmin):
         until someone builds a custom syntax function.
 
         """
-        pretty = json.dumps(
-            instance.event_payload,
-            sort_keys=True,
-            indent=4,
-            separators=(',', ': ')
-        )
+        pretty = codec.dumps(instance.event_payload, pretty=True)
         return mark_safe("<code>%s</code>" % pretty.replace(" ", "&nbsp;"))
 
     def board_(self, instance):
         return truncatewords(instance.board_name, 3)
+    board_.admin_order_field = 'trello_board_name'
 
     def list_(self, instance):
         return truncatewords(instance.list_name, 3)
+    list_.admin_order_field = 'trello_list_name'
 
     def card_(self, instance):
         return truncatewords(instance.card_name, 3)
+    card_.admin_order_field = 'trello_card_name'
 
     def rendered(self, instance):
         return instance.render()
 
     def has_template(self, instance):
-        return instance.render() is not None
-
-
-class CallbackEventInline(admin.StackedInline):
-    model = CallbackEvent
-    extra = 0
-    fields = (
-        'timestamp_',
-        'action_taken_by',
-        'event_type',
-        'rendered'
-    )
-    readonly_fields = (
-        'timestamp_',
-        'event_type',
-        'action_taken_by',
-        'board_name',
-        'list_name',
-        'card_name',
-        'rendered'
-    )
-    ordering = ('-id',)
-
-    def action_taken_by(self, instance):
-        return instance.member.get('fullName')
-
-    def timestamp_(self, instance):
-        url = reverse(
-            'admin:%s_%s_change' % (
-                instance._meta.app_label,
-                instance._meta.module_name
-            ),
-            args=(instance.id,)
-        )
-        return format_html(
-            u'<a href="{}">{}</a>',
-            url, date_format(instance.timestamp, settings.DATETIME_FORMAT)
-        )
-
-    def rendered(self, instance):
-        return instance.render()
+        # looked up in the template registry - nothing is rendered
+        return instance.has_template
+    has_template.boolean = True
 
 
 class WebhookAdmin(admin.ModelAdmin):
 
-    # disable for now - may overload system by loading
-    # every callback on a single page.
-    # inlines = [CallbackEventInline]
+    # NB there is no CallbackEvent inline, as a webhook may have millions of
+    # events. Instead the change page (see the change_form.html template)
+    # loads the most recent events over AJAX, a page at a time, using the
+    # `events_view` and `event_view` endpoints below.
 
     list_display = (
         'auth_token_',
@@ -147,6 +262,94 @@ class WebhookAdmin(admin.ModelAdmin):
     def auth_token_(self, instance):
         return truncatechars(instance.auth_token, 12)
 
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return patterns(
+            '',
+            url(
+                r'^(\d+)/events/$',
+                self.admin_site.admin_view(self.events_view),
+                name='%s_%s_events' % info
+            ),
+            url(
+                r'^(\d+)/events/(\d+)/$',
+                self.admin_site.admin_view(self.event_view),
+                name='%s_%s_event' % info
+            ),
+        ) + super(WebhookAdmin, self).get_urls()
+
+    def events_view(self, request, object_id):
+        """Return a page of a webhook's events, most recent first, as JSON.
+
+        Pages are keyed on the event id - pass the `next` value from the
+        response as the `before` querystring param to get the next page.
+        Only the indexed columns are fetched; the events are rendered
+        separately, on request (see `event_view`).
+
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        try:
+            before = int(request.GET.get('before') or 0)
+            limit = int(request.GET.get('limit') or app_settings.ADMIN_EVENTS_PAGE_SIZE)  # noqa
+        except ValueError:
+            return HttpResponse(u"Invalid 'before' or 'limit'.", status=400)
+        # between 1 and 100 events a page
+        limit = max(1, min(limit, 100))
+
+        queryset = CallbackEvent.objects.filter(webhook_id=object_id).order_by('-id')  # noqa
+        if before:
+            queryset = queryset.filter(id__lt=before)
+        # fetch one extra row to find out if there is another page
+        rows = list(queryset.values_list(
+            'id',
+            'timestamp',
+            'event_type',
+            'trello_member_name',
+            'trello_board_name',
+            'trello_list_name',
+            'trello_card_name',
+        )[:limit + 1])
+
+        info = CallbackEvent._meta.app_label, CallbackEvent._meta.model_name
+        events = [{
+            'id': row[0],
+            'timestamp': date_format(row[1], settings.DATETIME_FORMAT),
+            'event_type': row[2],
+            'member_name': row[3],
+            'board_name': row[4],
+            'list_name': row[5],
+            'card_name': row[6],
+            'has_template': template_registry.has_template(row[2]),
+            'url': reverse('admin:%s_%s_change' % info, args=(row[0],)),
+        } for row in rows[:limit]]
+        return JsonResponse({
+            'events': events,
+            'next': events[-1]['id'] if len(rows) > limit else None
+        })
+
+    def event_view(self, request, object_id, event_id):
+        """Return the rendered HTML for a single event.
+
+        Events that have been archived (see archive.py) are fetched from the
+        archive files.
+
+        """
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        try:
+            event = CallbackEvent.objects.get(webhook_id=object_id, id=event_id)  # noqa
+        except CallbackEvent.DoesNotExist:
+            event = archive.fetch_event(event_id) if app_settings.ARCHIVE_ROOT else None  # noqa
+            if event is None or event.webhook_id != int(object_id):
+                raise Http404(u"No event %s for webhook %s" % (event_id, object_id))  # noqa
+        html = event.render()
+        if html is None:
+            html = format_html(
+                u"<i>No template for '{}' events.</i>", event.event_type
+            )
+        return HttpResponse(html)
+
     def sync(self, request, queryset):
         """Sync objects selected to Trello."""
         count = queryset.count()
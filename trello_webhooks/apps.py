@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class TrelloWebhooksConfig(AppConfig):
+
+    name = 'trello_webhooks'
+    verbose_name = "Trello Webhooks"
+
+    def ready(self):
+        # load all the event templates up front - see rendering.py
+        from trello_webhooks.rendering import template_registry
+        template_registry.preload()
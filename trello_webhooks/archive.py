@@ -0,0 +1,249 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.archive - cold storage for old callback events
+"""Move old CallbackEvents out of the database into compressed files.
+
+Events are written (by the `archive_callback_events` command) to gzipped
+JSONL files under ARCHIVE_ROOT, one file per day:
+
+    ARCHIVE_ROOT/2015/01/callback_events-2015-01-31.jsonl.gz
+
+Each file is a series of gzip members ("blocks") of up to ARCHIVE_BLOCK_SIZE
+events, so it can be read with any gzip tool (zcat etc.), but each block can
+also be decompressed on its own. Every block is indexed in the database
+(see models.ArchivedBlock) by its offset in the file and the range of event
+ids it contains, which is what allows `fetch_event` to return a single event
+by reading one block, rather than decompressing the whole file.
+
+Events are archived a chunk at a time: the chunk is written, the files are
+flushed to disk, every block is read back and checked, and only then are the
+block index entries saved and the events deleted, in the same transaction.
+If anything fails before that the files are truncated to their previous
+size, and the events are left in the database.
+
+"""
+import hashlib
+import logging
+import os
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from trello_webhooks import codec, settings
+from trello_webhooks.models import ArchivedBlock, CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+# the CallbackEvent fields stored (in addition to id, timestamp & payload)
+ARCHIVED_FIELDS = (
+    'webhook_id',
+    'event_type',
+    'trello_action_id',
+    'trello_board_id',
+    'trello_board_name',
+    'trello_list_id',
+    'trello_list_name',
+    'trello_card_id',
+    'trello_card_name',
+    'trello_member_id',
+    'trello_member_name',
+)
+# path of the archive file for a given timestamp, relative to ARCHIVE_ROOT
+FILENAME_FORMAT = os.path.join('%Y', '%m', 'callback_events-%Y-%m-%d.jsonl.gz')
+# zlib wbits value for reading / writing gzip (rather than zlib) streams
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ArchiveError(Exception):
+    """Raised if an archive block can't be written or read back intact."""
+    pass
+
+
+def archive_path(path):
+    """Return the absolute path of an archive file."""
+    if not settings.ARCHIVE_ROOT:
+        raise ImproperlyConfigured(u"TRELLO_WEBHOOKS_ARCHIVE_ROOT is not set.")
+    return os.path.join(settings.ARCHIVE_ROOT, path)
+
+
+def to_json(event):
+    """Serialise an event as a single line of JSON (unicode).
+
+    The id always comes first, so that lines can be matched by id without
+    parsing them, and the payload is copied in as it was stored, unless it
+    contains line breaks.
+
+    """
+    record = {f: getattr(event, f) for f in ARCHIVED_FIELDS}
+    record['timestamp'] = event.timestamp.isoformat()
+    payload = event._meta.get_field('event_payload').get_raw(event)
+    if payload is None or '\n' in payload or '\r' in payload:
+        payload = codec.dumps(event.event_payload)
+    return u'{"id":%i,%s,"event_payload":%s}' % (
+        event.id, codec.dumps(record)[1:-1], payload
+    )
+
+
+def from_json(line):
+    """Return an (unsaved) CallbackEvent from a line written by to_json."""
+    record = codec.loads(line)
+    record['timestamp'] = parse_datetime(record['timestamp'])
+    return CallbackEvent(**record)
+
+
+def line_prefix(event_id):
+    return ('{"id":%i,' % event_id).encode('utf-8')
+
+
+def compress(lines):
+    """Compress a list of (utf-8) lines into a single gzip member."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(b''.join(l + b'\n' for l in lines)) + compressor.flush()  # noqa
+
+
+def read_block(block):
+    """Return the lines (as bytes) in an archived block."""
+    with open(archive_path(block.path), 'rb') as f:
+        f.seek(block.offset)
+        data = f.read(block.length)
+    if hashlib.sha1(data).hexdigest() != block.checksum:
+        raise ArchiveError(u"Checksum mismatch reading %r" % block)
+    return zlib.decompress(data, GZIP_WBITS).splitlines()
+
+
+class ArchiveWriter(object):
+    """Writes a chunk of events to the archive files.
+
+    Events are buffered per file, and written a block at a time. Nothing
+    is saved to the database - call `verify` once the chunk has been written,
+    and save the blocks, or `rollback` to remove them from the files.
+
+    """
+    def __init__(self, block_size):
+        self.block_size = block_size
+        # relative path: [(event_id, line)] not yet written
+        self.buffers = {}
+        # relative path: open file, and its size before this chunk
+        self.files = {}
+        self.sizes = {}
+        # [(ArchivedBlock, [event ids])] written
+        self.blocks = []
+
+    def add(self, event):
+        path = event.timestamp.strftime(FILENAME_FORMAT)
+        buffer_ = self.buffers.setdefault(path, [])
+        buffer_.append((event.id, to_json(event).encode('utf-8')))
+        if len(buffer_) >= self.block_size:
+            self.write_block(path)
+
+    def open(self, path):
+        if path not in self.files:
+            full_path = archive_path(path)
+            if not os.path.isdir(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            f = open(full_path, 'ab')
+            f.seek(0, os.SEEK_END)
+            self.files[path] = f
+            self.sizes[path] = f.tell()
+        return self.files[path]
+
+    def write_block(self, path):
+        records = self.buffers.pop(path, None)
+        if not records:
+            return
+        f = self.open(path)
+        data = compress([line for _, line in records])
+        block = ArchivedBlock(
+            path=path,
+            offset=f.tell(),
+            length=len(data),
+            first_id=records[0][0],
+            last_id=records[-1][0],
+            event_count=len(records),
+            checksum=hashlib.sha1(data).hexdigest(),
+            archived_at=timezone.now()
+        )
+        f.write(data)
+        self.blocks.append((block, [event_id for event_id, _ in records]))
+
+    def flush(self):
+        """Write any buffered events, and sync the files to disk."""
+        for path in list(self.buffers):
+            self.write_block(path)
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+
+    def verify(self):
+        """Read back every block written, and check its contents."""
+        for block, ids in self.blocks:
+            lines = read_block(block)
+            intact = len(lines) == len(ids) and all(
+                line.startswith(line_prefix(event_id))
+                for line, event_id in zip(lines, ids)
+            )
+            if not intact:
+                raise ArchiveError(u"Unexpected contents in %r" % block)
+
+    def rollback(self):
+        """Remove everything written from the files."""
+        for path, f in self.files.items():
+            f.flush()
+            os.ftruncate(f.fileno(), self.sizes[path])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def archive_events(events, block_size=None):
+    """Archive events, and delete them from the database.
+
+    Args:
+        events: iterable of CallbackEvents, in id order - e.g. a chunk of a
+            queryset, using iterator().
+        block_size: maximum number of events per block, defaults to
+            ARCHIVE_BLOCK_SIZE.
+
+    Returns the list of ids archived.
+
+    """
+    writer = ArchiveWriter(block_size or settings.ARCHIVE_BLOCK_SIZE)
+    try:
+        for event in events:
+            writer.add(event)
+        writer.flush()
+        writer.verify()
+        ids = [i for _, block_ids in writer.blocks for i in block_ids]
+        with transaction.atomic():
+            ArchivedBlock.objects.bulk_create([b for b, _ in writer.blocks])
+            CallbackEvent.objects.filter(id__in=ids).delete()
+    except Exception:
+        writer.rollback()
+        raise
+    finally:
+        writer.close()
+    return ids
+
+
+def fetch_event(event_id):
+    """Return an archived event, as an unsaved CallbackEvent, or None.
+
+    Only the block(s) whose id range includes the event are read.
+
+    """
+    event_id = int(event_id)
+    prefix = line_prefix(event_id)
+    # the range can only overlap a few blocks, from neighbouring days
+    blocks = (
+        ArchivedBlock.objects
+        .filter(last_id__gte=event_id, first_id__lte=event_id)
+        .order_by('last_id')[:10]
+    )
+    for block in blocks:
+        for line in read_block(block):
+            if line.startswith(prefix):
+                return from_json(line.decode('utf-8'))
+    return None
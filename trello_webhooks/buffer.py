@@ -0,0 +1,172 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.buffer - write-behind batching of CallbackEvent inserts
+"""Buffered, bulk, creation of CallbackEvent objects.
+
+Saving each callback as it arrives costs an INSERT for the CallbackEvent
+and an UPDATE for the Webhook.touch() - two round-trips and two commits
+per event. The CallbackEventBuffer holds new events in memory and writes
+them out in a single transaction - one bulk INSERT for all the events, and
+one UPDATE per webhook - once it holds `max_size` events, or the oldest
+event has been held for `max_latency` seconds.
+
+The callback_received signal is only sent for an event once the
+transaction containing it has been committed.
+
+Redelivered callbacks (the same Trello action, for the same webhook) are
+ignored, as they are by Webhook.add_callback - duplicates within the
+buffer are dropped before the bulk INSERT, and if that INSERT fails
+because an event has already been saved then the events are saved one at
+a time instead (see CallbackEvent.save_if_new).
+
+The buffer does not flush itself - it's up to the calling code to check
+`should_flush` and call `flush`. Events held in memory are lost if the
+process dies, so the buffer is only used by the `process_callbacks` worker,
+where the source callbacks stay in the ingestion queue until they have
+been flushed. (See trello_webhooks.ingest.process_batch.)
+
+NB On Django < 1.10 bulk_create does not set the primary key of the objects
+that it creates, so after the bulk INSERT the ids are read back in a single
+query, on the (webhook, trello_action_id) unique index. Events with no
+action id can't be found that way, so they are saved one at a time.
+
+"""
+import logging
+import time
+
+from django.db import IntegrityError, transaction
+
+from trello_webhooks import metrics
+from trello_webhooks import settings
+from trello_webhooks import signals
+from trello_webhooks.models import Webhook, CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackEventBuffer(object):
+    """Holds unsaved CallbackEvents until they are flushed in bulk."""
+
+    def __init__(self, max_size=None, max_latency=None):
+        self.max_size = max_size or settings.BUFFER_SIZE or 100
+        self.max_latency = (
+            settings.BUFFER_MAX_LATENCY if max_latency is None else max_latency
+        )
+        # list of (event, tag) tuples
+        self._pending = []
+        # time.time() at which the oldest pending event was added
+        self._oldest = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def tags(self):
+        """The tags of all the events currently held in the buffer."""
+        return [tag for _, tag in self._pending]
+
+    def add(self, webhook, body_text, tag=None):
+        """Build a new CallbackEvent and add it to the buffer.
+
+        The tag is an opaque value that is returned from `flush` once the
+        event has been saved - the ingestion worker uses it to ack the
+        queued callback that the event was built from.
+
+        Returns the new (unsaved) CallbackEvent.
+
+        """
+        event = webhook.build_callback(body_text)
+        if not self._pending:
+            self._oldest = time.time()
+        self._pending.append((event, tag))
+        return event
+
+    def should_flush(self):
+        """Return True if the buffer is full, or the oldest event is due."""
+        if not self._pending:
+            return False
+        if len(self._pending) >= self.max_size:
+            return True
+        return time.time() - self._oldest >= self.max_latency
+
+    def flush(self):
+        """Save all pending events, touch their webhooks and send signals.
+
+        The buffer is emptied before anything is written, so if the write
+        fails the events are discarded, and the exception is raised - the
+        calling code should use `tags` beforehand if it needs to know
+        which events were lost.
+
+        Returns the list of tags for the events that were saved (or were
+        ignored as duplicates).
+
+        """
+        pending, self._pending, self._oldest = self._pending, [], None
+        if not pending:
+            return []
+        events = self._unique([event for event, _ in pending])
+        # one touch per webhook, no matter how many events it received
+        webhooks = {}
+        for event in events:
+            webhooks.setdefault(event.webhook_id, event.webhook)
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self._bulk_create(events)
+            except IntegrityError:
+                # some of the events have already been received - the
+                # bulk INSERT was rolled back, so save them one at a time
+                for event in events:
+                    event.id = None
+                events = [e for e in events if e.save_if_new()]
+            for webhook in webhooks.values():
+                webhook.record_activity()
+        logger.debug(
+            u"Flushed %i events for %i webhooks",
+            len(events), len(webhooks)
+        )
+        # the events are now committed, so tell the world. A failing
+        # receiver must not stop the remaining events being signalled.
+        for event in events:
+            try:
+                metrics.send(
+                    signals.callback_received, 'callback.receiver',
+                    sender=Webhook, event=event
+                )
+            except Exception:
+                logger.exception(u"Error handling callback_received for %r", event)  # noqa
+        return [tag for _, tag in pending]
+
+    def _bulk_create(self, events):
+        """Save new events in bulk, and set their ids."""
+        bulk = [e for e in events if e.trello_action_id is not None]
+        if bulk:
+            CallbackEvent.objects.bulk_create(bulk)
+            self._set_ids(bulk)
+        for event in events:
+            if event.trello_action_id is None:
+                event.save()
+
+    def _set_ids(self, events):
+        """Read back the ids of bulk created events, in one query."""
+        ids = dict(
+            ((webhook_id, action_id), pk) for webhook_id, action_id, pk in
+            CallbackEvent.objects.filter(
+                webhook_id__in=set(e.webhook_id for e in events),
+                trello_action_id__in=[e.trello_action_id for e in events]
+            ).values_list('webhook_id', 'trello_action_id', 'id')
+        )
+        for event in events:
+            event.id = ids[(event.webhook_id, event.trello_action_id)]
+
+    def _unique(self, events):
+        """Drop events for Trello actions already in the list."""
+        seen = set()
+        unique = []
+        for event in events:
+            key = (event.webhook_id, event.trello_action_id)
+            if event.trello_action_id is None or key not in seen:
+                seen.add(key)
+                unique.append(event)
+            else:
+                logger.info(u"Ignoring duplicate callback %r", event)
+        return unique
@@ -0,0 +1,159 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.cache - in-process cache of Webhook lookups
+"""In-process cache for resolving callback URLs to Webhook objects.
+
+Every callback from Trello requires a lookup of the Webhook by its
+(auth_token, trello_model_id) pair - the two parts of the callback URL.
+Webhooks are created and deleted very rarely, so we cache the result of
+that lookup in memory, in a bounded LRU cache with a TTL.
+
+Lookups for webhooks that don't exist are cached as well (for a shorter
+time - NEGATIVE_TTL), so that a flood of callbacks for a deleted webhook
+doesn't hit the database every time.
+
+Entries are invalidated when a Webhook is saved or deleted, via the
+post_save and post_delete signals. NB this only applies to the current
+process - other processes (e.g. other gunicorn workers) will pick up the
+change once the TTL expires. A Webhook.touch() does not invalidate the
+cache, as the cached object would not change in any meaningful way.
+
+Each lookup returns a copy of the cached Webhook, as the callback view
+changes it (last_updated_at), and passes it on to the signal receivers -
+which may change it too - so it must not be shared between threads.
+
+The cache can be disabled by setting TRELLO_WEBHOOKS_CACHE_SIZE to 0.
+
+"""
+from collections import OrderedDict
+import copy
+import logging
+import threading
+import time
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from trello_webhooks import settings
+from trello_webhooks.models import Webhook
+
+logger = logging.getLogger(__name__)
+
+
+def copy_webhook(webhook):
+    """Return a (shallow) copy of a Webhook, or None."""
+    if webhook is None:
+        return None
+    clone = copy.copy(webhook)
+    # the model state is changed by save(), so mustn't be shared either
+    clone._state = copy.copy(webhook._state)
+    return clone
+
+
+class WebhookCache(object):
+    """Bounded LRU + TTL cache for Webhook lookups."""
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None):
+        self.max_size = settings.CACHE_SIZE if max_size is None else max_size
+        self.ttl = settings.CACHE_TTL if ttl is None else ttl
+        self.negative_ttl = (
+            settings.CACHE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        )
+        # (auth_token, trello_model_id): (expires_at, Webhook or None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, auth_token, trello_model_id):
+        """Fetch a webhook from the database, returns None if not found."""
+        try:
+            return Webhook.objects.get(
+                auth_token=auth_token,
+                trello_model_id=trello_model_id
+            )
+        except Webhook.DoesNotExist:
+            return None
+
+    def get(self, auth_token, trello_model_id):
+        """Return the matching Webhook object, or None if it doesn't exist.
+
+        The object is a copy of the cached one, so it's safe to change.
+
+        """
+        if self.max_size <= 0:
+            return self._lookup(auth_token, trello_model_id)
+
+        key = (auth_token, trello_model_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # put it back at the end, as most recently used
+                self._entries[key] = entry
+                self.hits += 1
+                return copy_webhook(entry[1])
+            self.misses += 1
+
+        # NB the database lookup is done outside of the lock, so that
+        # one slow query doesn't block every other thread.
+        webhook = self._lookup(auth_token, trello_model_id)
+        ttl = self.ttl if webhook is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (now + ttl, copy_webhook(webhook))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return webhook
+
+    def invalidate(self, webhook):
+        """Remove any entries relating to the webhook from the cache.
+
+        This removes the entry for the webhook's current key (which may be
+        a negative entry from before it was created), and any entry that
+        contains the webhook under a previous key.
+
+        """
+        key = (webhook.auth_token, webhook.trello_model_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            stale = [
+                k for k, (_, w) in self._entries.items()
+                if w is not None and w.pk == webhook.pk
+            ]
+            for k in stale:
+                del self._entries[k]
+
+    def clear(self):
+        """Remove all entries, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dict containing the cache hit/miss counters."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'hit_rate': float(self.hits) / total if total else 0.0,
+        }
+
+
+# the process-wide cache used by the callback view
+webhook_cache = WebhookCache()
+
+
+@receiver(post_save, sender=Webhook, dispatch_uid="webhook_cache_post_save")
+def on_webhook_saved(sender, instance, update_fields=None, **kwargs):
+    # touch() only updates the timestamp, so don't throw away the entry
+    if update_fields and set(update_fields) == set(['last_updated_at']):
+        return
+    webhook_cache.invalidate(instance)
+
+
+@receiver(post_delete, sender=Webhook, dispatch_uid="webhook_cache_post_delete")
+def on_webhook_deleted(sender, instance, **kwargs):
+    webhook_cache.invalidate(instance)
@@ -0,0 +1,158 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.client - shared, pooled, Trello API clients
+"""Trello API clients that share a pool of keep-alive connections.
+
+The stock trello.TrelloClient makes each request using `requests.request`,
+which opens (and closes) a new connection - including the TLS handshake -
+for every API call. That's fine for the occasional call, but syncing
+thousands of webhooks means thousands of handshakes.
+
+PooledTrelloClient makes its requests through a single, process-wide,
+requests.Session, whose connection pool keeps connections to Trello open
+between calls (and between clients). The session is thread-safe, so the
+same clients can be used concurrently (e.g. by `sync_webhooks --workers`).
+
+Clients are cached - one per (api key, token) - so use `get_client` rather
+than creating them directly.
+
+Every request is scheduled by the rate limiter (see ratelimit.py), and any
+request that is rate limited anyway (429) is retried, after waiting for the
+Retry-After period, or an exponential backoff (with jitter), whichever is
+longer. If the request is still rate limited after RATE_LIMIT_RETRIES
+retries, RateLimited is raised.
+
+"""
+import json
+import logging
+import random
+import threading
+from time import sleep
+
+import requests
+import trello
+from requests.adapters import HTTPAdapter
+
+from trello_webhooks import settings
+from trello_webhooks.ratelimit import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+class RateLimited(trello.ResourceUnavailable):
+    """Raised when an API request is still rate limited after retrying."""
+    pass
+
+
+def backoff(attempt, retry_after=None):
+    """Return the delay (in seconds) before retrying a rate limited request.
+
+    This is an exponential backoff, with jitter (between half and all of
+    the delay), so that concurrent requests don't all retry at once - but
+    never less than the server's Retry-After.
+
+    """
+    delay = min(60, settings.RATE_LIMIT_BACKOFF * 2 ** attempt)
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0)
+
+
+def retry_after(response):
+    """Return the Retry-After header value (in seconds), if any."""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_session():
+    """Return the shared requests.Session used for all Trello API calls."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.HTTP_POOL_SIZE
+            )
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+class PooledTrelloClient(trello.TrelloClient):
+    """TrelloClient that uses the shared connection pool, with timeouts."""
+
+    def fetch_json(
+            self,
+            uri_path,
+            http_method='GET',
+            headers=None,
+            query_params=None,
+            post_args=None,
+            files=None):
+        """Fetch some JSON from Trello - as per trello.TrelloClient."""
+        headers = dict(headers or {})
+        # if files specified, we don't want any data
+        data = None if files else json.dumps(post_args or {})
+        if http_method in ("POST", "PUT", "DELETE") and not files:
+            headers['Content-Type'] = 'application/json; charset=utf-8'
+        headers['Accept'] = 'application/json'
+
+        url = settings.TRELLO_API_URL + uri_path.lstrip('/')
+        for attempt in range(settings.RATE_LIMIT_RETRIES + 1):
+            rate_limiter.acquire(self.resource_owner_key)
+            response = get_session().request(
+                http_method,
+                url,
+                params=query_params or {},
+                headers=headers,
+                data=data,
+                auth=self.oauth,
+                files=files,
+                timeout=settings.HTTP_TIMEOUT
+            )
+            if response.status_code != 429:
+                break
+            if attempt < settings.RATE_LIMIT_RETRIES:
+                delay = backoff(attempt, retry_after(response))
+                logger.warning(
+                    u"Trello API request rate limited, retrying in %.2fs: %s %s",  # noqa
+                    delay, http_method, url
+                )
+                sleep(delay)
+        else:
+            raise RateLimited("%s at %s" % (response.text, url), response)
+
+        if response.status_code == 401:
+            raise trello.Unauthorized("%s at %s" % (response.text, url), response)  # noqa
+        if response.status_code != 200:
+            raise trello.ResourceUnavailable("%s at %s" % (response.text, url), response)  # noqa
+        return response.json()
+
+
+def get_client(api_key=settings.TRELLO_API_KEY,
+               api_secret=settings.TRELLO_API_SECRET,
+               token=None):
+    """Return the (shared) PooledTrelloClient for a token."""
+    key = (api_key, api_secret, token)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = PooledTrelloClient(
+                api_key, api_secret=api_secret, token=token
+            )
+        return client
+
+
+def reset():
+    """Close the shared session, and discard all cached clients."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _clients.clear()
@@ -0,0 +1,99 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.codec - pluggable JSON encoding / decoding
+"""JSON codec used for all payload parsing and serialisation.
+
+Trello payloads are parsed when they arrive, stored as JSON text, parsed
+again when events are loaded, and dumped again for display in the admin
+site. All of that goes through the `loads` and `dumps` functions in this
+module, which use the fastest available JSON library.
+
+The TRELLO_WEBHOOKS_JSON_CODEC setting controls which library is used:
+
+    'auto' (default) - orjson if installed, else ujson, else json
+    'orjson', 'ujson', 'json' - use that library (it must be installed)
+
+Whichever library is used, `loads` accepts str / unicode / bytes, and
+`dumps` returns unicode.
+
+"""
+import json
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+from trello_webhooks import settings
+
+logger = logging.getLogger(__name__)
+
+# in order of preference, when the codec is 'auto'
+CODECS = ('orjson', 'ujson', 'json')
+
+
+def _json_codec():
+    def dumps(obj, pretty=False):
+        if pretty:
+            return json.dumps(obj, sort_keys=True, indent=4, separators=(',', ': '))  # noqa
+        return json.dumps(obj, separators=(',', ':'))
+    return json.loads, dumps
+
+
+def _ujson_codec():
+    import ujson
+
+    def dumps(obj, pretty=False):
+        if pretty:
+            return ujson.dumps(obj, sort_keys=True, indent=4, escape_forward_slashes=False)  # noqa
+        return ujson.dumps(obj, escape_forward_slashes=False)
+    return ujson.loads, dumps
+
+
+def _orjson_codec():
+    import orjson
+
+    def dumps(obj, pretty=False):
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2 if pretty else 0
+        return orjson.dumps(obj, option=option).decode('utf-8')
+    return orjson.loads, dumps
+
+
+def get_codec(name=None):
+    """Return (name, loads, dumps) for the named (or configured) codec."""
+    name = name or settings.JSON_CODEC
+    factories = {
+        'json': _json_codec,
+        'ujson': _ujson_codec,
+        'orjson': _orjson_codec,
+    }
+    if name == 'auto':
+        for candidate in CODECS:
+            try:
+                return (candidate,) + factories[candidate]()
+            except ImportError:
+                continue
+    if name not in factories:
+        raise ImproperlyConfigured(u"Unknown JSON codec: '%s'" % name)
+    try:
+        return (name,) + factories[name]()
+    except ImportError:
+        raise ImproperlyConfigured(u"JSON codec '%s' is not installed." % name)
+
+
+CODEC_NAME, _loads, _dumps = get_codec()
+logger.debug(u"Using '%s' JSON codec", CODEC_NAME)
+
+
+def loads(text):
+    """Parse JSON text (unicode or bytes) into Python objects."""
+    return _loads(text)
+
+
+def dumps(obj, pretty=False):
+    """Serialise an object as JSON, returned as unicode.
+
+    If `pretty` is True the output is indented, with sorted keys, for
+    display purposes.
+
+    """
+    # the py2 stdlib and ujson return (ascii) str, not unicode
+    return six.text_type(_dumps(obj, pretty=pretty))
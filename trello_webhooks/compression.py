@@ -0,0 +1,108 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.compression - optional compression of stored payloads
+"""Compression of CallbackEvent payloads - see fields.PayloadField.
+
+Trello payloads are verbose (every action repeats the member, board, list
+and card), and compress well. The TRELLO_WEBHOOKS_PAYLOAD_COMPRESSION setting
+controls whether, and how, new payloads are compressed before they are saved:
+
+    None (default) - payloads are stored as plain JSON text
+    'auto' - zstd if the `zstandard` package is installed, else zlib
+    'zstd', 'zlib' - use that algorithm (it must be installed)
+
+Every compressed value starts with a one byte tag identifying the algorithm,
+so existing values can be decompressed whatever the current setting.
+
+"""
+import logging
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+
+from trello_webhooks import settings
+
+logger = logging.getLogger(__name__)
+
+# in order of preference, when the setting is 'auto'
+ALGORITHMS = ('zstd', 'zlib')
+# the prefix on values compressed with each algorithm
+TAGS = {'zstd': b's', 'zlib': b'z'}
+
+
+def _zlib_compressor():
+    return (
+        lambda data: zlib.compress(data, 6),
+        zlib.decompress
+    )
+
+
+def _zstd_compressor():
+    import zstandard
+    # NB compressor objects are not thread-safe, so one is made per call
+    return (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data)
+    )
+
+
+FACTORIES = {
+    'zlib': _zlib_compressor,
+    'zstd': _zstd_compressor,
+}
+
+
+def get_compressor(name):
+    """Return (name, compress, decompress) for the named algorithm.
+
+    `name` may be 'auto', in which case the first installed algorithm in
+    ALGORITHMS is used.
+
+    """
+    if name == 'auto':
+        for candidate in ALGORITHMS:
+            try:
+                return (candidate,) + FACTORIES[candidate]()
+            except ImportError:
+                continue
+    if name not in FACTORIES:
+        raise ImproperlyConfigured(u"Unknown payload compression: '%s'" % name)  # noqa
+    try:
+        return (name,) + FACTORIES[name]()
+    except ImportError:
+        raise ImproperlyConfigured(u"Payload compression '%s' is not installed." % name)  # noqa
+
+
+# the algorithm used to compress new payloads, None if disabled
+if settings.PAYLOAD_COMPRESSION:
+    ALGORITHM = get_compressor(settings.PAYLOAD_COMPRESSION)[0]
+    logger.debug(u"Compressing payloads using '%s'", ALGORITHM)
+else:
+    ALGORITHM = None
+# (name, compress, decompress) by name, loaded as required
+_compressors = {}
+
+
+def _get_compressor(name):
+    if name not in _compressors:
+        _compressors[name] = get_compressor(name)
+    return _compressors[name]
+
+
+def compress(text, algorithm=None):
+    """Compress (unicode) text, using ALGORITHM unless otherwise specified."""
+    name, func, _ = _get_compressor(algorithm or ALGORITHM)
+    return TAGS[name] + func(text.encode('utf-8'))
+
+
+def decompress(data):
+    """Decompress a value returned by `compress`, returning unicode.
+
+    `data` may be bytes, or a buffer / memoryview as returned by some
+    database drivers.
+
+    """
+    data = data.tobytes() if isinstance(data, memoryview) else bytes(data)
+    names = [n for n, t in TAGS.items() if t == data[:1]]
+    if not names:
+        raise ValueError(u"Unknown compressed payload format.")
+    return _get_compressor(names[0])[2](data[1:]).decode('utf-8')
@@ -0,0 +1,293 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.dispatch - run callback_received receivers in the background
+"""Asynchronous callback_received receivers.
+
+Receivers connected to callback_received in the usual way are run in the
+callback view, whilst Trello waits for a response. Receivers that do slow
+things (render templates, call other services) can instead be registered
+as asynchronous:
+
+    from trello_webhooks.dispatch import async_receiver
+
+    @async_receiver(timeout=10, max_queue=500)
+    def on_callback_received(sender, event, **kwargs):
+        ...
+
+Each async receiver gets its own queue and pool of worker threads, so:
+
+* the callback view only has to queue the event, however slow the receiver
+* a slow, hung or failing receiver can't affect any other receiver - its
+  errors are logged, and it can only hold up its own queue
+* once a receiver has `max_queue` events queued or running, new events for
+  it are dropped (and logged), rather than using up ever more memory
+* a call that takes longer than `timeout` seconds is logged, and abandoned -
+  the worker moves on to the next event. (Python threads can't be killed,
+  so the call carries on in the background, but it still counts towards
+  the receiver's `max_queue` until it finishes.)
+
+Events are only queued once the transaction that saved them has committed.
+Django 1.7 has no commit hooks, so in autocommit mode (the callback view is
+excluded from ATOMIC_REQUESTS) events are queued straight away; inside an
+atomic block they are held until the end of the request, or the next event
+signalled outside an atomic block, and are dropped if they were rolled back.
+
+NB the worker threads are daemon threads, so anything still queued when the
+process exits is lost. Receivers are called with the usual `signal`,
+`sender` and `event` arguments, plus any others the signal was sent with.
+
+Replayed events (sent with `replay=True`, see replay.py) are not queued -
+the replay calls the async receivers itself, in its own thread, with
+`Dispatcher.call`, so that it knows when each event has been handled, and
+can count the receivers' errors.
+
+"""
+import logging
+import threading
+import time
+
+from django.core.signals import request_finished
+from django.db import connection, connections
+from django.utils.six.moves import queue
+
+from trello_webhooks import metrics, settings
+from trello_webhooks.signals import callback_received
+
+logger = logging.getLogger(__name__)
+
+# marker for AsyncReceiver options that weren't given
+DEFAULT = object()
+
+
+class AsyncReceiver(object):
+    """A callback_received receiver run on its own pool of threads.
+
+    Args:
+        func: the receiver function.
+        workers: the number of threads to run it on.
+        max_queue: the maximum number of events queued or running.
+        timeout: seconds after which a call is abandoned (None for never).
+
+    Any options not given use the ASYNC_RECEIVER_* settings.
+
+    """
+    def __init__(self, func, workers=DEFAULT, max_queue=DEFAULT, timeout=DEFAULT):  # noqa
+        if workers is DEFAULT:
+            workers = settings.ASYNC_RECEIVER_WORKERS
+        if max_queue is DEFAULT:
+            max_queue = settings.ASYNC_RECEIVER_QUEUE_SIZE
+        if timeout is DEFAULT:
+            timeout = settings.ASYNC_RECEIVER_TIMEOUT
+        self.func = func
+        self.name = '%s.%s' % (func.__module__, func.__name__)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # events queued or running (including abandoned calls)
+        self.in_flight = 0
+        self.stats = dict.fromkeys(
+            ('queued', 'completed', 'failed', 'timed_out', 'dropped'), 0
+        )
+        self._threads = []
+
+    def __repr__(self):
+        return u"<AsyncReceiver '%s'>" % self.name
+
+    def _count(self, stat, in_flight=0):
+        with self.lock:
+            self.stats[stat] += 1
+            self.in_flight += in_flight
+
+    def submit(self, sender, event, **kwargs):
+        """Queue an event, unless the queue is full. Returns True if queued.
+
+        Any kwargs are passed on to the receiver, along with the event.
+
+        """
+        with self.lock:
+            if self.in_flight >= self.max_queue:
+                self.stats['dropped'] += 1
+                full = True
+            else:
+                self.stats['queued'] += 1
+                self.in_flight += 1
+                full = False
+        if full:
+            logger.warning(u"%r queue is full, dropping %r", self, event)
+            return False
+        self._start()
+        self.queue.put((sender, event, kwargs))
+        return True
+
+    def _start(self):
+        if len(self._threads) == self.workers:
+            return
+        with self.lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name='%s-%i' % (self.name, len(self._threads))
+                )
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            sender, event, kwargs = self.queue.get()
+            try:
+                self._run(sender, event, kwargs)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, sender, event, kwargs):
+        if self.timeout is None:
+            return self._call(sender, event, kwargs)
+        thread = threading.Thread(target=self._call, args=(sender, event, kwargs))  # noqa
+        thread.daemon = True
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            self._count('timed_out')
+            logger.error(
+                u"%r timed out after %ss handling %r", self, self.timeout, event
+            )
+
+    def _call(self, sender, event, kwargs):
+        try:
+            with metrics.timer('callback.async.%s' % self.name):
+                self.func(signal=callback_received, sender=sender, event=event, **kwargs)  # noqa
+        except Exception:
+            self._count('failed', -1)
+            logger.exception(u"Error in %r handling %r", self, event)
+        else:
+            self._count('completed', -1)
+        finally:
+            # this thread's database connections are not reused
+            for conn in connections.all():
+                conn.close()
+
+    def join(self, timeout=None):
+        """Wait until the queue is empty (and every call has finished or
+        timed out), or for `timeout` seconds. Returns True if it's empty."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+class Dispatcher(object):
+    """Queues events for all of the registered async receivers."""
+
+    def __init__(self):
+        self.receivers = {}
+        # events signalled inside an atomic block, per thread
+        self._local = threading.local()
+
+    def register(self, func, **kwargs):
+        receiver = AsyncReceiver(func, **kwargs)
+        self.receivers[receiver.name] = receiver
+        return receiver
+
+    def unregister(self, func):
+        self.receivers.pop('%s.%s' % (func.__module__, func.__name__), None)
+
+    def stats(self):
+        return {name: dict(r.stats) for name, r in self.receivers.items()}
+
+    @property
+    def deferred(self):
+        if not hasattr(self._local, 'events'):
+            self._local.events = []
+        return self._local.events
+
+    def send(self, sender, event, **kwargs):
+        """Queue an event for every async receiver, once it's committed."""
+        if not self.receivers:
+            return
+        if connection.in_atomic_block:
+            self.deferred.append((sender, event, kwargs))
+            return
+        self.flush()
+        self._submit(sender, event, kwargs)
+
+    def call(self, sender, event, **kwargs):
+        """Call every async receiver now, in this thread.
+
+        Used to replay events. Errors are logged, and returned, as with
+        Signal.send_robust - a list of (receiver, response) tuples, where
+        the response is the exception if the receiver raised one.
+
+        """
+        responses = []
+        for receiver in self.receivers.values():
+            try:
+                response = receiver.func(
+                    signal=callback_received, sender=sender, event=event, **kwargs  # noqa
+                )
+            except Exception as ex:
+                logger.exception(u"Error in %r handling %r", receiver, event)
+                response = ex
+            responses.append((receiver.func, response))
+        return responses
+
+    def flush(self):
+        """Queue any events held back until their transaction committed."""
+        events, self._local.events = self.deferred, []
+        if not events:
+            return
+        from trello_webhooks.models import CallbackEvent
+        saved = set(
+            CallbackEvent.objects
+            .filter(id__in=[e.id for _, e, _ in events])
+            .values_list('id', flat=True)
+        )
+        for sender, event, kwargs in events:
+            if event.id in saved:
+                self._submit(sender, event, kwargs)
+            else:
+                logger.debug(u"Dropping %r, which was rolled back", event)
+
+    def _submit(self, sender, event, kwargs):
+        for receiver in self.receivers.values():
+            receiver.submit(sender, event, **kwargs)
+
+    def join(self, timeout=None):
+        """Wait for all of the receivers' queues to empty."""
+        return all(r.join(timeout) for r in self.receivers.values())
+
+
+dispatcher = Dispatcher()
+
+
+def async_receiver(func=None, **kwargs):
+    """Decorator registering an async callback_received receiver.
+
+    Takes the AsyncReceiver options (workers, max_queue, timeout) - any
+    not given use the ASYNC_RECEIVER_* settings. The function itself is
+    returned unchanged, so it can still be called directly.
+
+    """
+    def decorator(func):
+        dispatcher.register(func, **kwargs)
+        return func
+    return decorator(func) if func else decorator
+
+
+def on_callback_received(sender, event, replay=False, **kwargs):
+    # replayed events are passed to the async receivers by the replay itself
+    if not replay:
+        kwargs.pop('signal', None)
+        dispatcher.send(sender, event, **kwargs)
+
+
+def on_request_finished(sender, **kwargs):
+    if dispatcher.receivers and dispatcher.deferred:
+        dispatcher.flush()
+
+
+callback_received.connect(on_callback_received, dispatch_uid='trello_webhooks.dispatch')  # noqa
+request_finished.connect(on_request_finished, dispatch_uid='trello_webhooks.dispatch')  # noqa
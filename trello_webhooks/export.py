@@ -0,0 +1,135 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.export - bulk export of callback events
+"""Stream CallbackEvents out as JSONL or CSV, in constant memory.
+
+Used by the `export_callback_events` command, and the CallbackEvent admin
+export view, both of which take the same filters (webhook, event type and
+time range). Events are read in primary key order, a page at a time, each
+page being a separate (indexed) query - so there's never more than one page
+in memory, no long-running query or transaction, and the output is written
+as it's read, however many events there are.
+
+JSONL lines are in the same format as the archive files (see archive.py);
+CSV rows have the columns in CSV_COLUMNS, with the payload as JSON text.
+
+"""
+import csv
+from datetime import datetime, time
+
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from trello_webhooks.archive import to_json
+from trello_webhooks.models import CallbackEvent
+
+FORMATS = ('jsonl', 'csv')
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_COLUMNS = (
+    'id',
+    'webhook_id',
+    'timestamp',
+    'event_type',
+    'trello_action_id',
+    'trello_board_id',
+    'trello_board_name',
+    'trello_list_id',
+    'trello_list_name',
+    'trello_card_id',
+    'trello_card_name',
+    'trello_member_id',
+    'trello_member_name',
+    'event_payload',
+)
+
+
+def parse_time(value):
+    """Parse an ISO date or datetime, returning an aware datetime.
+
+    Dates are taken as midnight, and naive datetimes as being in the
+    current timezone. Raises ValueError if the value can't be parsed.
+
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(u"Invalid date / time: '%s'" % value)
+        parsed = datetime.combine(date, time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+def filter_events(webhooks=None, event_types=None, since=None, until=None):
+    """Return the events matching the export filters.
+
+    Args:
+        webhooks: list of webhook ids.
+        event_types: list of event types.
+        since: datetime, only events at or after this time.
+        until: datetime, only events before this time.
+
+    """
+    queryset = CallbackEvent.objects.all()
+    if webhooks:
+        queryset = queryset.filter(webhook_id__in=webhooks)
+    if event_types:
+        queryset = queryset.filter(event_type__in=event_types)
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lt=until)
+    return queryset
+
+
+def iter_events(queryset, page_size=1000):
+    """Yield the events in a queryset, in id order, a page at a time."""
+    queryset = queryset.order_by('id')
+    last_id = 0
+    while True:
+        count = 0
+        for event in queryset.filter(id__gt=last_id)[:page_size].iterator():
+            count += 1
+            last_id = event.id
+            yield event
+        if count < page_size:
+            break
+
+
+class Echo(object):
+    """File-like object that returns what is written - used for CSV."""
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    return six.text_type(value).encode('utf-8')
+
+
+def iter_csv(events):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    payload_field = CallbackEvent._meta.get_field('event_payload')
+    for event in events:
+        row = [getattr(event, column) for column in CSV_COLUMNS[:-1]]
+        row[2] = event.timestamp.isoformat()
+        payload = payload_field.get_raw(event)
+        row.append(payload if payload is not None else payload_field.value_to_string(event))  # noqa
+        yield writer.writerow([_csv_value(v) for v in row])
+
+
+def iter_jsonl(events):
+    for event in events:
+        yield to_json(event).encode('utf-8') + b'\n'
+
+
+def export(events, format_='jsonl'):
+    """Yield chunks of (utf-8 encoded) output for an iterable of events."""
+    if format_ not in FORMATS:
+        raise ValueError(u"Unknown export format: '%s'" % format_)
+    return iter_csv(events) if format_ == 'csv' else iter_jsonl(events)
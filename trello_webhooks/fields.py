@@ -0,0 +1,135 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.fields - custom model fields
+from django.db import models
+from django.utils import six
+
+from trello_webhooks import codec, compression
+
+
+class RawPayload(object):
+    """JSON text that is known to be valid, along with its parsed value.
+
+    Assigning one of these to a PayloadField means that the text is stored
+    verbatim, and the value does not need to be parsed again. This is used
+    when a callback is received, as we've already parsed it.
+
+    """
+    def __init__(self, text, value):
+        self.text = text
+        self.value = value
+
+
+class PayloadDescriptor(object):
+    """Attribute descriptor for PayloadField - decodes the JSON lazily.
+
+    The raw JSON text (from the database, or assigned as a string) is held
+    on the instance, and only parsed the first time the attribute is read.
+
+    """
+    def __init__(self, field):
+        self.field = field
+        self.raw_key = '_%s_raw' % field.attname
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        data = instance.__dict__
+        if self.field.attname not in data:
+            raw = self.field.get_raw(instance)
+            data[self.field.attname] = None if raw is None else codec.loads(raw)
+        return data[self.field.attname]
+
+    def __set__(self, instance, value):
+        data = instance.__dict__
+        if self.field.compressed_field:
+            # any compressed value belongs to the previous payload (when
+            # loading from the database it's set after this field)
+            data[self.field.compressed_field] = None
+        if isinstance(value, RawPayload):
+            data[self.raw_key] = value.text
+            data[self.field.attname] = value.value
+        elif isinstance(value, six.string_types):
+            data[self.raw_key] = value
+            data.pop(self.field.attname, None)
+        else:
+            data[self.raw_key] = None
+            data[self.field.attname] = value
+
+
+class PayloadField(models.TextField):
+    """Stores JSON as text, using the configured codec (see codec.py).
+
+    Unlike a normal JSON field, the value is not parsed when the object is
+    loaded from the database, but on first access, and if the value was
+    assigned as text (or loaded from the database) that text is written
+    back verbatim when the object is saved, rather than being re-serialised.
+
+    NB this means that changes made to the parsed value in place will
+    not be saved - assign a new value instead. (Payloads are meant to be
+    read-only in any case.)
+
+    If `compressed_field` is set it names a (nullable) BinaryField, declared
+    after this one, that is used to store the payload compressed when
+    PAYLOAD_COMPRESSION is set (see compression.py) - in which case this
+    field is saved as an empty string. Compressed payloads are decompressed
+    (and parsed) on first access.
+
+    """
+    description = "JSON payload"
+
+    def __init__(self, *args, **kwargs):
+        self.compressed_field = kwargs.pop('compressed_field', None)
+        if not kwargs.get('null', False):
+            kwargs['default'] = kwargs.get('default', dict)
+        super(PayloadField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(PayloadField, self).deconstruct()
+        if self.compressed_field:
+            kwargs['compressed_field'] = self.compressed_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(PayloadField, self).contribute_to_class(cls, name, *args, **kwargs)  # noqa
+        setattr(cls, self.name, PayloadDescriptor(self))
+
+    def get_raw(self, model_instance):
+        """Return the raw JSON text held on the instance, if any.
+
+        If the payload was loaded compressed it's decompressed (once) here.
+
+        """
+        data = model_instance.__dict__
+        raw_key = '_%s_raw' % self.attname
+        raw = data.get(raw_key)
+        if not raw and self.compressed_field and data.get(self.compressed_field):  # noqa
+            raw = data[raw_key] = compression.decompress(data[self.compressed_field])  # noqa
+        return raw
+
+    def pre_save(self, model_instance, add):
+        raw = self.get_raw(model_instance)
+        if raw is None:
+            raw = getattr(model_instance, self.attname)
+        if self.compressed_field:
+            # NB this relies on the compressed field coming after this one,
+            # so that its value is set here before it is saved.
+            compressed = None
+            if compression.ALGORITHM and raw is not None:
+                compressed = compression.compress(self.get_prep_value(raw))
+                raw = ''
+            model_instance.__dict__[self.compressed_field] = compressed
+        return raw
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, six.string_types):
+            return value
+        return codec.dumps(value)
+
+    def to_python(self, value):
+        if isinstance(value, six.string_types):
+            return codec.loads(value)
+        return value
+
+    def value_to_string(self, obj):
+        raw = self.get_raw(obj)
+        return raw if raw is not None else codec.dumps(self._get_val_from_obj(obj))  # noqa
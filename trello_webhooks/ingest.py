@@ -0,0 +1,250 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.ingest - asynchronous processing of Trello callbacks
+"""Asynchronous callback ingestion.
+
+By default the callback view does all of its work whilst Trello is waiting
+for a response - it looks up the webhook, parses the payload, saves a new
+CallbackEvent, touches the webhook and sends the callback_received signal.
+If that takes too long Trello will retry the callback, and eventually
+disable the webhook altogether.
+
+If the TRELLO_WEBHOOKS_ASYNC_INGESTION setting is True then the view does
+the bare minimum - it hands the raw request body, along with the routing
+keys from the URL, to an ingestion backend, and returns a 200. The rest of
+the pipeline is then run by the `process_callbacks` management command,
+which calls `process_batch` in a loop.
+
+The backend is pluggable (TRELLO_WEBHOOKS_INGESTION_BACKEND) - it must be
+a class that implements the methods of BaseIngestionBackend. The default
+backend stores the callbacks in a local database table (QueuedCallback).
+
+"""
+import datetime
+import logging
+import uuid
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+from django.utils.module_loading import import_string
+
+from trello_webhooks import settings
+from trello_webhooks.cache import webhook_cache
+from trello_webhooks.models import QueuedCallback
+
+logger = logging.getLogger(__name__)
+
+# the backend instance, created on first use by get_backend()
+_backend = None
+
+
+class QueuedItem(object):
+    """A single callback as returned from a backend's fetch method."""
+
+    def __init__(self, handle, auth_token, trello_model_id, body):
+        # backend-specific identifier used to ack / fail the item
+        self.handle = handle
+        self.auth_token = auth_token
+        self.trello_model_id = trello_model_id
+        self.body = body
+
+    def __repr__(self):
+        return (
+            u"<QueuedItem handle=%s, model='%s'>" %
+            (self.handle, self.trello_model_id)
+        )
+
+
+class BaseIngestionBackend(object):
+    """Interface that ingestion backends must implement."""
+
+    def enqueue(self, auth_token, trello_model_id, body):
+        """Store a raw callback for later processing.
+
+        This is called from the view, so it should be as fast as possible.
+
+        """
+        raise NotImplementedError()
+
+    def fetch(self, limit):
+        """Return up to `limit` QueuedItem objects, oldest first.
+
+        Items returned must not be handed out to any other worker until
+        they have been acked or failed (or some reasonable timeout has
+        passed, in case the worker died).
+
+        """
+        raise NotImplementedError()
+
+    def ack(self, item):
+        """Remove an item that has been processed from the queue."""
+        raise NotImplementedError()
+
+    def fail(self, item, exception):
+        """Return an item that could not be processed to the queue."""
+        raise NotImplementedError()
+
+
+class DatabaseQueueBackend(BaseIngestionBackend):
+    """Default backend - uses the QueuedCallback model as the queue.
+
+    Rows are claimed by setting a random lease_token along with a lease
+    expiry time, so that multiple workers can run side by side without
+    picking up the same rows, and without holding a transaction open
+    whilst the events are processed. If a worker dies its rows become
+    available again once the lease expires.
+
+    """
+
+    def enqueue(self, auth_token, trello_model_id, body):
+        return QueuedCallback(
+            auth_token=auth_token,
+            trello_model_id=trello_model_id,
+            body=force_text(body, errors='replace'),
+        ).save()
+
+    def _available(self, now):
+        return (
+            QueuedCallback.objects
+            .filter(attempts__lt=settings.INGESTION_MAX_ATTEMPTS)
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=now))
+        )
+
+    def fetch(self, limit):
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        ids = list(
+            self._available(now)
+            .order_by('id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        # the filter is repeated in the UPDATE so that if another worker
+        # has claimed any of these rows in the meantime we don't steal them.
+        (
+            self._available(now)
+            .filter(id__in=ids)
+            .update(
+                lease_token=token,
+                leased_until=now + datetime.timedelta(seconds=settings.INGESTION_LEASE)
+            )
+        )
+        return [
+            QueuedItem(q.id, q.auth_token, q.trello_model_id, q.body)
+            for q in QueuedCallback.objects.filter(lease_token=token).order_by('id')
+        ]
+
+    def ack(self, item):
+        QueuedCallback.objects.filter(id=item.handle).delete()
+
+    def fail(self, item, exception):
+        # bump the attempts count and release the lease
+        queued = QueuedCallback.objects.get(id=item.handle)
+        queued.attempts += 1
+        queued.lease_token = ''
+        queued.leased_until = None
+        queued.save(update_fields=['attempts', 'lease_token', 'leased_until'])
+        if queued.attempts >= settings.INGESTION_MAX_ATTEMPTS:
+            logger.error(
+                u"Giving up on queued callback after %i attempts: %r",
+                queued.attempts, queued
+            )
+
+
+def get_backend():
+    """Return the configured ingestion backend instance."""
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.INGESTION_BACKEND)()
+    return _backend
+
+
+def get_webhook(item):
+    """Return the Webhook that a queued item is routed to, or None."""
+    webhook = webhook_cache.get(item.auth_token, item.trello_model_id)
+    if webhook is None:
+        logger.warning(
+            u"No webhook found for %s:%s, dropping queued callback",
+            item.auth_token, item.trello_model_id
+        )
+    return webhook
+
+
+def process_item(item):
+    """Run the full callback pipeline for a single queued item.
+
+    This is the same code that the view runs in synchronous mode, so
+    unknown webhooks are logged and dropped (the view would have returned
+    a 404).
+
+    Returns the new CallbackEvent, or None if the webhook did not exist
+    (or the callback was a duplicate).
+
+    """
+    webhook = get_webhook(item)
+    return webhook.add_callback(item.body) if webhook else None
+
+
+def flush_buffer(backend, buffer, force=False):
+    """Flush a CallbackEventBuffer, and ack the items it contained.
+
+    Unless `force` is True the buffer is only flushed if it is full, or
+    its oldest event is due. If the flush fails then all of the items in
+    the buffer are failed, so that they will be retried.
+
+    """
+    if not (force or buffer.should_flush()):
+        return
+    items = buffer.tags
+    try:
+        flushed = buffer.flush()
+    except Exception as ex:
+        logger.exception(u"Error flushing %i buffered callbacks", len(items))
+        for item in items:
+            backend.fail(item, ex)
+    else:
+        for item in flushed:
+            backend.ack(item)
+
+
+def process_batch(backend=None, batch_size=100, buffer=None):
+    """Fetch a batch of queued callbacks from the backend and process them.
+
+    Each item is acked once it has been processed. If processing raises
+    an exception the item is failed (so that it can be retried), and we
+    move on to the next one.
+
+    If a CallbackEventBuffer is passed in then the events are added to
+    the buffer instead of being saved one at a time, and the items are
+    only acked once the buffer has been flushed (which may be on a later
+    call to this function - see flush_buffer).
+
+    Returns the number of items fetched from the queue.
+
+    """
+    backend = backend or get_backend()
+    items = backend.fetch(batch_size)
+    for item in items:
+        try:
+            if buffer is None:
+                process_item(item)
+            else:
+                webhook = get_webhook(item)
+                if webhook is None:
+                    backend.ack(item)
+                    continue
+                buffer.add(webhook, item.body, tag=item)
+        except Exception as ex:
+            logger.exception(u"Error processing queued callback %r", item)
+            backend.fail(item, ex)
+        else:
+            if buffer is None:
+                backend.ack(item)
+            else:
+                flush_buffer(backend, buffer)
+    if buffer is not None:
+        # flushes anything that has been waiting too long, even if
+        # nothing new came in.
+        flush_buffer(backend, buffer)
+    return len(items)
@@ -0,0 +1,94 @@
+# # -*- coding: utf-8 -*-
+# move old CallbackEvent rows into compressed archive files
+import logging
+from datetime import timedelta
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from trello_webhooks import archive, settings
+from trello_webhooks.models import CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Archive callback events older than a given number of days."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days',
+            type='int',
+            help=u"Archive events more than this many days old (required)."
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            default=1000,
+            help=u"Number of events to archive (and delete) per transaction."
+        ),
+        make_option(
+            '--block-size',
+            type='int',
+            help=u"Number of events per compressed block (default %i)." % settings.ARCHIVE_BLOCK_SIZE  # noqa
+        ),
+        make_option(
+            '--sleep',
+            type='float',
+            default=0,
+            help=u"Seconds to wait between chunks, to limit the load."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Archive old events a chunk at a time (see trello_webhooks.archive).
+
+        Events are read in primary key order, `--chunk-size` at a time,
+        using iterator() so that only one chunk is in memory, and are only
+        deleted once they have been written to disk and read back. The
+        highest id to archive is fixed up front, so the command never scans
+        newer events, and it can be interrupted and rerun at any time.
+
+        """
+        if options.get('days') is None:
+            raise CommandError(u"--days is required.")
+        if options['chunk_size'] < 1:
+            raise CommandError(u"--chunk-size must be at least 1.")
+        if not settings.ARCHIVE_ROOT:
+            raise CommandError(u"TRELLO_WEBHOOKS_ARCHIVE_ROOT is not set.")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = CallbackEvent.objects.filter(timestamp__lt=cutoff)
+        max_id = queryset.aggregate(max_id=Max('id'))['max_id']
+        if max_id is None:
+            logger.info(u"No events older than %s to archive.", cutoff)
+            return
+        queryset = queryset.filter(id__lte=max_id).order_by('id')
+
+        started_at = time.time()
+        last_id = 0
+        total = 0
+        while True:
+            events = (
+                queryset
+                .filter(id__gt=last_id)[:options['chunk_size']]
+                .iterator()
+            )
+            ids = archive.archive_events(events, options.get('block_size'))
+            if not ids:
+                break
+            # NB ids are grouped by archive file, so not in order
+            last_id = max(ids)
+            total += len(ids)
+            logger.info(
+                u"Archived %i events (up to id %i), %.0f rows/sec",
+                total, last_id, total / max(time.time() - started_at, 0.001)
+            )
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        logger.info(
+            u"Archiving complete, %i events older than %s archived to %s.",
+            total, cutoff, settings.ARCHIVE_ROOT
+        )
@@ -0,0 +1,82 @@
+# # -*- coding: utf-8 -*-
+# populate the trello_* columns on existing CallbackEvent rows
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from trello_webhooks.models import CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+# the columns set by CallbackEvent.update_trello_fields
+TRELLO_FIELDS = [
+    'trello_action_id',
+    'trello_board_id',
+    'trello_board_name',
+    'trello_list_id',
+    'trello_list_name',
+    'trello_card_id',
+    'trello_card_name',
+    'trello_member_id',
+    'trello_member_name',
+]
+
+
+class Command(BaseCommand):
+    help = "Extract Trello ids and names from existing CallbackEvent payloads."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            type='int',
+            default=500,
+            help=u"Number of events to update per transaction."
+        ),
+        make_option(
+            '--all',
+            action='store_true',
+            default=False,
+            help=u"Update all events, not just those without a trello_action_id."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Backfill the denormalised trello_* columns in chunks.
+
+        Events are read in primary key order, `--chunk-size` at a time, and
+        each chunk is updated in its own transaction, so the command can be
+        run against a live database, and restarted if it's interrupted.
+
+        By default only events without a trello_action_id are updated, as
+        all real Trello actions have one. Events for an action that the
+        webhook already has an event for (i.e. redelivered callbacks) keep
+        a NULL trello_action_id, as it must be unique per webhook.
+
+        """
+        chunk_size = options['chunk_size']
+        queryset = CallbackEvent.objects.order_by('id')
+        if not options['all']:
+            queryset = queryset.filter(trello_action_id__isnull=True)
+        last_id = 0
+        total = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                for event in chunk:
+                    event.update_trello_fields()
+                    fields = {f: getattr(event, f) for f in TRELLO_FIELDS}
+                    # NB not event.save(), as that resets the timestamp
+                    try:
+                        with transaction.atomic():
+                            CallbackEvent.objects.filter(id=event.id).update(**fields)  # noqa
+                    except IntegrityError:
+                        # a duplicate of an event that has the action id
+                        fields['trello_action_id'] = None
+                        CallbackEvent.objects.filter(id=event.id).update(**fields)  # noqa
+            last_id = chunk[-1].id
+            total += len(chunk)
+            logger.info(u"Updated %i events (up to id %i)", total, last_id)
+        logger.info(u"Backfill complete, %i events updated.", total)
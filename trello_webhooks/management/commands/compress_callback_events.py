@@ -0,0 +1,97 @@
+# # -*- coding: utf-8 -*-
+# compress (or decompress) the payloads of existing CallbackEvent rows
+import logging
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from trello_webhooks import compression
+from trello_webhooks.models import CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Compress the payloads of existing callback events."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--chunk-size',
+            type='int',
+            default=500,
+            help=u"Number of events to update per transaction."
+        ),
+        make_option(
+            '--decompress',
+            action='store_true',
+            default=False,
+            help=u"Convert compressed payloads back to plain JSON text."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Convert existing payloads in chunks.
+
+        New events are compressed as they are saved once
+        TRELLO_WEBHOOKS_PAYLOAD_COMPRESSION is set - this converts the
+        existing ones. Events are read in primary key order, `--chunk-size`
+        at a time (only the id and payload columns), and each chunk is
+        updated in its own transaction, so the command can be run against
+        a live database, and restarted if it's interrupted.
+
+        Use --decompress to convert them back (e.g. before turning
+        compression off, although compressed payloads can always be read).
+
+        """
+        decompress = options['decompress']
+        if not (decompress or compression.ALGORITHM):
+            raise CommandError(u"TRELLO_WEBHOOKS_PAYLOAD_COMPRESSION is not set.")  # noqa
+        if decompress:
+            queryset = (
+                CallbackEvent.objects
+                .filter(event_payload_compressed__isnull=False)
+                .values_list('id', 'event_payload_compressed')
+            )
+        else:
+            queryset = (
+                CallbackEvent.objects
+                .filter(event_payload_compressed__isnull=True)
+                .values_list('id', 'event_payload')
+            )
+        queryset = queryset.order_by('id')
+
+        started_at = time.time()
+        last_id = 0
+        total = 0
+        before = after = 0
+        while True:
+            chunk = list(queryset.filter(id__gt=last_id)[:options['chunk_size']])  # noqa
+            if not chunk:
+                break
+            with transaction.atomic():
+                for event_id, value in chunk:
+                    if decompress:
+                        payload = compression.decompress(value)
+                        compressed = None
+                        before += len(value)
+                        after += len(payload.encode('utf-8'))
+                    else:
+                        payload = ''
+                        compressed = compression.compress(value)
+                        before += len(value.encode('utf-8'))
+                        after += len(compressed)
+                    CallbackEvent.objects.filter(id=event_id).update(
+                        event_payload=payload,
+                        event_payload_compressed=compressed
+                    )
+            last_id = chunk[-1][0]
+            total += len(chunk)
+            logger.info(
+                u"Converted %i events (up to id %i), %.0f rows/sec",
+                total, last_id, total / max(time.time() - started_at, 0.001)
+            )
+        logger.info(
+            u"Conversion complete, %i events converted, payloads %i -> %i bytes.",  # noqa
+            total, before, after
+        )
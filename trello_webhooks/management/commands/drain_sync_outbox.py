@@ -0,0 +1,76 @@
+# # -*- coding: utf-8 -*-
+# sync webhooks with Trello, as recorded when SYNC_MODE is 'outbox'
+import logging
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trello_webhooks import outbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Sync webhooks with Trello, as recorded in the sync outbox."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            type='int',
+            default=100,
+            help=u"Number of pending syncs to process at a time."
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            default=1,
+            help=u"Number of concurrent Trello API requests (default 1)."
+        ),
+        make_option(
+            '--loop',
+            action='store_true',
+            default=False,
+            help=u"Keep polling the outbox instead of exiting when it's empty."
+        ),
+        make_option(
+            '--sleep',
+            type='float',
+            default=1.0,
+            help=u"Seconds to wait between polls of an empty outbox (--loop only)."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Drain the sync outbox.
+
+        Pending syncs are processed in batches (see trello_webhooks.outbox).
+        Without --loop the command exits as soon as there are no syncs due,
+        so it can be run from cron; with --loop it runs as a long-lived
+        worker.
+
+        """
+        workers = options.get('workers', 1)
+        if workers < 1:
+            raise CommandError(u"--workers must be at least 1.")
+        pool = ThreadPool(workers) if workers > 1 else None
+        succeeded = failed = 0
+        try:
+            while True:
+                ok, errors = outbox.drain(options['batch_size'], pool)
+                succeeded += ok
+                failed += errors
+                if ok or errors:
+                    logger.info(u"Processed %i pending syncs (%i failed)", ok + errors, errors)  # noqa
+                    continue
+                if not options['loop']:
+                    break
+                time.sleep(options['sleep'])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        logger.info(
+            u"Sync outbox is empty, %i syncs processed (%i failed attempts).",
+            succeeded, failed
+        )
@@ -0,0 +1,95 @@
+# # -*- coding: utf-8 -*-
+# export callback events as JSONL or CSV
+import logging
+from optparse import make_option
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from trello_webhooks import export
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Export callback events as JSONL or CSV."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--format',
+            choices=export.FORMATS,
+            default='jsonl',
+            help=u"Output format, 'jsonl' (default) or 'csv'."
+        ),
+        make_option(
+            '--output',
+            help=u"File to write to (default stdout)."
+        ),
+        make_option(
+            '--webhook',
+            type='int',
+            action='append',
+            dest='webhooks',
+            help=u"Only export events for this webhook id (can be repeated)."
+        ),
+        make_option(
+            '--event-type',
+            action='append',
+            dest='event_types',
+            help=u"Only export events of this type (can be repeated)."
+        ),
+        make_option(
+            '--since',
+            help=u"Only export events at or after this ISO date / time."
+        ),
+        make_option(
+            '--until',
+            help=u"Only export events before this ISO date / time."
+        ),
+        make_option(
+            '--page-size',
+            type='int',
+            default=1000,
+            help=u"Number of events to read from the database at a time."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Write the matching events, in id order, as they are read.
+
+        See trello_webhooks.export - memory use is bounded by --page-size,
+        however many events are exported.
+
+        """
+        try:
+            since = options.get('since') and export.parse_time(options['since'])  # noqa
+            until = options.get('until') and export.parse_time(options['until'])  # noqa
+        except ValueError as ex:
+            raise CommandError(unicode(ex))
+        if options['page_size'] < 1:
+            raise CommandError(u"--page-size must be at least 1.")
+        queryset = export.filter_events(
+            webhooks=options.get('webhooks'),
+            event_types=options.get('event_types'),
+            since=since,
+            until=until
+        )
+        events = export.iter_events(queryset, options['page_size'])
+        if options.get('output'):
+            output = open(options['output'], 'wb')
+        else:
+            # NB not self.stdout, which expects text, and adds line endings
+            output = options.get('stdout') or sys.stdout
+        chunks = export.export(self.counted(events), options['format'])
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options.get('output'):
+                output.close()
+        logger.info(u"Exported %i events.", self.count)
+
+    def counted(self, events):
+        self.count = 0
+        for event in events:
+            self.count += 1
+            yield event
@@ -0,0 +1,92 @@
+# # -*- coding: utf-8 -*-
+# process callbacks queued by the view when ASYNC_INGESTION is enabled
+import logging
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from trello_webhooks import ingest, settings
+from trello_webhooks.activity import activity_recorder
+from trello_webhooks.buffer import CallbackEventBuffer
+from trello_webhooks.cache import webhook_cache
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process Trello callbacks queued by the callback view."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--batch-size',
+            type='int',
+            default=100,
+            help=u"Number of queued callbacks to fetch at a time."
+        ),
+        make_option(
+            '--loop',
+            action='store_true',
+            default=False,
+            help=u"Keep polling the queue instead of exiting when it's empty."
+        ),
+        make_option(
+            '--sleep',
+            type='float',
+            default=1.0,
+            help=u"Seconds to wait between polls of an empty queue (--loop only)."
+        ),
+        make_option(
+            '--buffer-size',
+            type='int',
+            default=settings.BUFFER_SIZE,
+            help=u"Save events in bulk, up to this many at a time (0 to disable)."
+        ),
+        make_option(
+            '--max-latency',
+            type='float',
+            default=settings.BUFFER_MAX_LATENCY,
+            help=u"Maximum seconds an event can wait in the buffer."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Drain the ingestion queue.
+
+        Callbacks are fetched from the configured backend in batches, and
+        each one is processed exactly as the view would process it in
+        synchronous mode (save the CallbackEvent, touch the webhook and
+        send the callback_received signal).
+
+        Without --loop the command exits as soon as the queue is empty, so
+        it can be run from cron; with --loop it runs as a long-lived worker.
+
+        If --buffer-size is set the events are saved in bulk - see the
+        trello_webhooks.buffer module. Buffered events are saved when the
+        buffer is full, or the oldest event has waited --max-latency seconds
+        (or, at the latest, --sleep seconds after that if the queue is empty).
+
+        """
+        backend = ingest.get_backend()
+        buffer = None
+        if options['buffer_size'] > 0:
+            buffer = CallbackEventBuffer(
+                max_size=options['buffer_size'],
+                max_latency=options['max_latency']
+            )
+        total = 0
+        while True:
+            count = ingest.process_batch(backend, options['batch_size'], buffer)
+            total += count
+            if count > 0:
+                logger.info(u"Processed %i queued callbacks (%i in total)", count, total)  # noqa
+                continue
+            if not options['loop']:
+                break
+            if buffer is not None:
+                ingest.flush_buffer(backend, buffer)
+            time.sleep(options['sleep'])
+        if buffer is not None:
+            ingest.flush_buffer(backend, buffer, force=True)
+        activity_recorder.flush()
+        logger.info(u"Callback queue is empty, %i callbacks processed.", total)
+        logger.info(u"Webhook cache stats: %s", webhook_cache.stats())
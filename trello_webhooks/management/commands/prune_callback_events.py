@@ -0,0 +1,123 @@
+# # -*- coding: utf-8 -*-
+# delete old CallbackEvent rows, in small chunks
+import logging
+from datetime import timedelta
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from trello_webhooks.models import CallbackEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Delete callback events older than a given number of days."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days',
+            type='int',
+            help=u"Delete events more than this many days old (required)."
+        ),
+        make_option(
+            '--webhook',
+            type='int',
+            action='append',
+            dest='webhooks',
+            help=u"Only delete events for this webhook id (can be repeated)."
+        ),
+        make_option(
+            '--event-type',
+            action='append',
+            dest='event_types',
+            help=u"Only delete events of this type (can be repeated)."
+        ),
+        make_option(
+            '--chunk-size',
+            type='int',
+            default=1000,
+            help=u"Number of events to delete per transaction."
+        ),
+        make_option(
+            '--sleep',
+            type='float',
+            default=0,
+            help=u"Seconds to wait between chunks, to limit the load."
+        ),
+    )
+
+    def get_queryset(self, cutoff, webhooks=None, event_types=None):
+        """Return the events that are due to be deleted."""
+        queryset = CallbackEvent.objects.filter(timestamp__lt=cutoff)
+        if webhooks:
+            queryset = queryset.filter(webhook_id__in=webhooks)
+        if event_types:
+            queryset = queryset.filter(event_type__in=event_types)
+        return queryset
+
+    def handle(self, *args, **options):
+        """Delete old events in chunks of consecutive ids.
+
+        Each chunk is the next `--chunk-size` matching ids (in primary key
+        order), and is deleted in its own short transaction, with an optional
+        pause between chunks, so that the command can run against a live
+        database without holding locks for long or flooding replicas.
+
+        The highest id to delete is fixed up front, so the command never
+        scans (or chases) newer events, and as each chunk is deleted by id
+        the command can be interrupted and rerun at any time.
+
+        Retention can be set per webhook and / or per event type by running
+        the command with --webhook / --event-type, e.g.
+
+            prune_callback_events --days 30 --event-type updateCard
+            prune_callback_events --days 365
+
+        """
+        if options.get('days') is None:
+            raise CommandError(u"--days is required.")
+        if options['chunk_size'] < 1:
+            raise CommandError(u"--chunk-size must be at least 1.")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        queryset = self.get_queryset(
+            cutoff,
+            webhooks=options.get('webhooks'),
+            event_types=options.get('event_types')
+        )
+        max_id = queryset.aggregate(max_id=Max('id'))['max_id']
+        if max_id is None:
+            logger.info(u"No events older than %s to delete.", cutoff)
+            return
+        queryset = queryset.filter(id__lte=max_id).order_by('id')
+
+        started_at = time.time()
+        last_id = 0
+        total = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    queryset
+                    .filter(id__gt=last_id)
+                    .values_list('id', flat=True)[:options['chunk_size']]
+                )
+                if not ids:
+                    break
+                CallbackEvent.objects.filter(id__in=ids).delete()
+            last_id = ids[-1]
+            total += len(ids)
+            logger.info(
+                u"Deleted %i events (up to id %i), %.0f rows/sec",
+                total, last_id, total / max(time.time() - started_at, 0.001)
+            )
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.time() - started_at
+        logger.info(
+            u"Pruning complete, %i events older than %s deleted in %.1fs (%.0f rows/sec).",  # noqa
+            total, cutoff, elapsed, total / max(elapsed, 0.001)
+        )
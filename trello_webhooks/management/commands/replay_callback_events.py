@@ -0,0 +1,110 @@
+# # -*- coding: utf-8 -*-
+# re-send the callback_received signal for past events
+import logging
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from trello_webhooks import export, replay
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Replay past callback events through the callback_received signal."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--receiver',
+            help=u"Dotted path of a single receiver to replay events to "
+                 u"(default all receivers)."
+        ),
+        make_option(
+            '--webhook',
+            type='int',
+            action='append',
+            dest='webhooks',
+            help=u"Only replay events for this webhook id (can be repeated)."
+        ),
+        make_option(
+            '--event-type',
+            action='append',
+            dest='event_types',
+            help=u"Only replay events of this type (can be repeated)."
+        ),
+        make_option(
+            '--since',
+            help=u"Only replay events at or after this ISO date / time."
+        ),
+        make_option(
+            '--until',
+            help=u"Only replay events before this ISO date / time."
+        ),
+        make_option(
+            '--workers',
+            type='int',
+            default=1,
+            help=u"Number of events to replay concurrently (default 1)."
+        ),
+        make_option(
+            '--processes',
+            action='store_true',
+            default=False,
+            help=u"Use a pool of processes, rather than threads, for --workers."
+        ),
+        make_option(
+            '--page-size',
+            type='int',
+            default=500,
+            help=u"Number of events to read from the database at a time."
+        ),
+        make_option(
+            '--checkpoint',
+            help=u"File to record progress in, so that an interrupted replay "
+                 u"can be resumed by running the command again."
+        ),
+    )
+
+    def handle(self, *args, **options):
+        """Replay events, in id order - see trello_webhooks.replay."""
+        try:
+            since = options.get('since') and export.parse_time(options['since'])  # noqa
+            until = options.get('until') and export.parse_time(options['until'])  # noqa
+        except ValueError as ex:
+            raise CommandError(unicode(ex))
+        workers = options.get('workers', 1)
+        if workers < 1:
+            raise CommandError(u"--workers must be at least 1.")
+        if options['page_size'] < 1:
+            raise CommandError(u"--page-size must be at least 1.")
+        queryset = export.filter_events(
+            webhooks=options.get('webhooks'),
+            event_types=options.get('event_types'),
+            since=since,
+            until=until
+        )
+        pool = None
+        if workers > 1 and options['processes']:
+            # the forked processes mustn't share our database connection
+            connection.close()
+            pool = Pool(workers)
+        elif workers > 1:
+            pool = ThreadPool(workers)
+        try:
+            count, errors = replay.replay(
+                queryset,
+                receiver=options.get('receiver'),
+                pool=pool,
+                page_size=options['page_size'],
+                checkpoint=options.get('checkpoint')
+            )
+        except ImportError as ex:
+            raise CommandError(u"Invalid --receiver: %s" % ex)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        if errors:
+            logger.warning(u"%i errors replaying %i events.", errors, count)
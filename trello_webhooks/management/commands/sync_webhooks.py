@@ -1,17 +1,70 @@
 # # -*- coding: utf-8 -*-
 # sync webhooks down from Trello
 import logging
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from trello_webhooks.models import Webhook
+from trello_webhooks.reconcile import build_plan
 
 logger = logging.getLogger(__name__)
 
 
+def sync_webhook(webhook):
+    """Sync a single webhook to Trello - called from the worker threads.
+
+    This makes the HTTP request, and updates the webhook instance, but
+    does not touch the database - saving is done on the main thread.
+
+    Returns a (webhook, exception) tuple.
+
+    """
+    try:
+        return webhook.sync(), None
+    except Exception as ex:
+        return webhook, ex
+
+
+def fetch_remote_hooks(token):
+    """Fetch the remote webhooks for a token - called from the worker threads.
+
+    Returns a (token, hooks, exception) tuple.
+
+    """
+    try:
+        return token, Webhook.remote_objects.list_hooks(token), None
+    except Exception as ex:
+        return token, [], ex
+
+
 class Command(BaseCommand):
     args = u"<token token ...>"
     help = "Sync webhooks locally with those on Trello."
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            default=1,
+            help=u"Number of concurrent Trello API requests (default 1)."
+        ),
+        make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help=u"Print the sync plan, without making any changes."
+        ),
+        make_option(
+            '--reregister',
+            action='store_true',
+            dest='reregister',
+            default=False,
+            help=u"Re-register local webhooks that are no longer on Trello, "
+                 u"instead of deactivating them."
+        ),
+    )
 
     def handle(self, *args, **options):
         """Sync webhooks between local database and Trello.
@@ -29,47 +82,112 @@ class Command(BaseCommand):
 
         The logic works like this:
 
-        1. Sync all local webhooks to Trello
-        2. Fetch all remote webhooks, using all available tokens
-        3. Save any remote webhooks not already stored locally
+        1. Fetch all remote webhooks, using all available tokens
+        2. Compare them with the local webhooks, and plan what needs doing
+           (see trello_webhooks.reconcile)
+        3. Deactivate local webhooks that Trello no longer knows about (they
+           were deleted on Trello), unless --reregister is set
+        4. Sync local webhooks to Trello - with --reregister, this includes
+           re-registering any that Trello no longer knows about
+        5. Save any remote webhooks not already stored locally, in bulk
 
         At this point you should have the same webhooks locally and remotely.
         Any further edits (e.g. deletion) can be made from the admin site.
 
+        With --dry-run the plan is printed, and nothing is changed, locally
+        or on Trello (step 1, which is read-only, still calls Trello).
+
+        The Trello API calls in steps 1 and 4 can be made concurrently, using
+        the --workers option to set the size of the thread pool. All of the
+        database reads and writes are made on the main thread, and the result
+        is the same whatever the number of workers.
+
         """
-        local_webhooks = Webhook.objects.all()
-        for webhook in local_webhooks:
-            logger.info(u"Syncing local webhook (%r) to Trello", webhook)
-            webhook.sync()
-
-        # set of unique tokens that we know about from local webhooks,
-        # combined with those that were passed in from the command args
-        tokens = set([w.auth_token for w in local_webhooks] + [a for a in args])
-
-        # used to match webhooks when comparing with remote hooks
-        local_match = lambda h: h.id in [w.trello_id for w in local_webhooks]
-
-        if len(tokens) == 0:
-            logger.info(u"There are no user tokens with which to check Trello.")  # noqa
-            logger.info(u"Usage: sync_webhooks <token token ...>")  # noqa
-            return
-
-        logger.info(u"Checking %i Trello user tokens for missing local webhooks", len(tokens))  # noqa
-        for token in tokens:
-            for hook in Webhook.remote_objects.list_hooks(token):
-                if local_match(hook):
-                    logger.info(u"Remote webhook (%s) already exists locally", hook)  # noqa
+        workers = options.get('workers', 1)
+        dry_run = options.get('dry_run', False)
+        reregister = options.get('reregister', False)
+        if workers < 1:
+            raise CommandError(u"--workers must be at least 1.")
+        pool = ThreadPool(workers) if workers > 1 else None
+        imap = pool.imap if pool else lambda func, items: (func(i) for i in items)  # noqa
+        summary = {
+            'synced': 0,
+            'active': 0,
+            'sync_errors': 0,
+            'tokens': 0,
+            'token_errors': 0,
+            'remote': 0,
+            'created': 0,
+            'deactivated': 0,
+        }
+
+        try:
+            local_webhooks = list(Webhook.objects.all())
+
+            # set of unique tokens that we know about from local webhooks,
+            # combined with those that were passed in from the command args
+            tokens = set([w.auth_token for w in local_webhooks] + [a for a in args])  # noqa
+
+            if len(tokens) == 0:
+                logger.info(u"There are no user tokens with which to check Trello.")  # noqa
+                logger.info(u"Usage: sync_webhooks <token token ...>")  # noqa
+                return
+
+            logger.info(u"Checking %i Trello user tokens, using %i workers", len(tokens), workers)  # noqa
+            remote_hooks = {}
+            for token, hooks, ex in imap(fetch_remote_hooks, sorted(tokens)):
+                summary['tokens'] += 1
+                if ex is not None:
+                    logger.error(u"Error fetching remote webhooks for token '%s': %s", token, ex)  # noqa
+                    summary['token_errors'] += 1
+                    continue
+                remote_hooks[token] = hooks
+                summary['remote'] += len(hooks)
+
+            plan = build_plan(local_webhooks, remote_hooks)
+            if dry_run:
+                for line in plan.describe():
+                    self.stdout.write(line)
+                return
+
+            for webhook in plan.update:
+                if webhook.id in plan.adopt:
+                    webhook.trello_id = plan.adopt[webhook.id]
+            to_sync = list(plan.update)
+            for webhook in plan.orphans:
+                logger.info(u"Local webhook (%r) is not registered with Trello", webhook)  # noqa
+                webhook.trello_id = ''
+                if reregister:
+                    to_sync.append(webhook)
                 else:
-                    logger.info(u"Remote webhook (%s) does not exist locally", hook)  # noqa
-                    Webhook(
-                        trello_id=hook.id,
-                        trello_model_id=hook.id_model,
-                        description=hook.desc,
-                        auth_token=hook.token,
-                        is_active=hook.active
-                    ).save(sync=False)
-
-        local_webhooks = Webhook.objects.all()
-        logger.info(u"Sync complete. There are %i webhooks.", local_webhooks.count())
+                    webhook.is_active = False
+                    webhook.save(sync=False, update_fields=['trello_id', 'is_active'])  # noqa
+                    summary['deactivated'] += 1
+
+            for webhook, ex in imap(sync_webhook, to_sync):
+                if ex is not None:
+                    logger.error(u"Error syncing local webhook (%r) to Trello: %s", webhook, ex)  # noqa
+                    summary['sync_errors'] += 1
+                    continue
+                logger.info(u"Synced local webhook (%r) to Trello", webhook)
+                webhook.save(sync=False, update_fields=['trello_id', 'is_active', 'last_updated_at'])  # noqa
+                summary['synced'] += 1
+                summary['active'] += 1 if webhook.is_active else 0
+
+            Webhook.objects.bulk_create(plan.create)
+            summary['created'] = len(plan.create)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        logger.info(u"Sync complete. There are %i webhooks.", Webhook.objects.count())  # noqa
+        logger.info(
+            u"Synced %(synced)i local webhooks (%(active)i active, "
+            u"%(sync_errors)i errors); checked %(tokens)i tokens "
+            u"(%(token_errors)i errors), found %(remote)i remote webhooks, "
+            u"created %(created)i locally, deactivated %(deactivated)i.",
+            summary
+        )
         for webhook in Webhook.objects.all():
             logger.info(u"%s", webhook)
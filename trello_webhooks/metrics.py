@@ -0,0 +1,291 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.metrics - timing of each stage of the callback pipeline
+"""Timings for the callback pipeline, sent to a pluggable metrics backend.
+
+Each stage of handling a callback is timed, so that when callbacks slow
+down it's possible to see where the time is going:
+
+    callback.view                   the whole callback view (api_callback)
+    callback.lookup                 finding the webhook (see cache.py)
+    callback.parse                  parsing the payload, building the event
+    callback.insert                 saving the CallbackEvent
+    callback.touch                  updating the webhook's last_updated_at
+    callback.signal                 sending callback_received, in total
+    callback.receiver.<receiver>    each callback_received receiver
+    callback.async.<receiver>       each async receiver call (dispatch.py)
+    render.cache                    reading the rendered event cache
+    render.template                 rendering an event's template
+    trello.sync.<verb>              each Trello API call in _trello_sync
+
+where <receiver> is the receiver function's module and name. Timings are
+in milliseconds.
+
+The backend is set by TRELLO_WEBHOOKS_METRICS_BACKEND, the dotted path to
+a class that implements `timing(name, ms)` - see BaseMetricsBackend. There
+are three built in:
+
+    LoggingBackend  logs each timing (at DEBUG)
+    StatsdBackend   sends each timing to a StatsD server, over UDP
+    MemoryBackend   keeps a histogram of the timings in memory
+
+If the setting is None (the default), `timer` returns a shared object that
+does nothing, so the cost of the instrumentation is a function call per
+stage.
+
+"""
+import collections
+import functools
+import logging
+import socket
+import threading
+import time
+import timeit
+
+from django.utils.module_loading import import_string
+
+from trello_webhooks import settings
+
+logger = logging.getLogger(__name__)
+
+# the timer used for all measurements
+clock = timeit.default_timer
+
+# the backend instance - created on first use by get_backend()
+_backend = None
+_loaded = False
+
+
+class BaseMetricsBackend(object):
+    """Interface that metrics backends must implement."""
+
+    def timing(self, name, ms):
+        """Record that the stage `name` took `ms` milliseconds.
+
+        This is called inline, from the callback view, so it must be fast,
+        and should never raise an exception.
+
+        """
+        raise NotImplementedError()
+
+
+class LoggingBackend(BaseMetricsBackend):
+    """Logs each timing - useful in development."""
+
+    def timing(self, name, ms):
+        logger.debug(u"%s: %.3fms", name, ms)
+
+
+class StatsdBackend(BaseMetricsBackend):
+    """Sends each timing to a StatsD server, as a UDP packet.
+
+    The server address is set by TRELLO_WEBHOOKS_METRICS_STATSD_HOST and
+    _PORT, and each name is prefixed with TRELLO_WEBHOOKS_METRICS_PREFIX.
+    The host is looked up on first use, and errors (looking it up, or
+    sending the packets) are ignored - if the lookup fails, timings are
+    discarded, and it's retried after `RETRY_SECONDS`.
+
+    """
+    RETRY_SECONDS = 60
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.host = host or settings.METRICS_STATSD_HOST
+        self.port = port or settings.METRICS_STATSD_PORT
+        self.address = None
+        self._retry_at = 0
+        prefix = settings.METRICS_PREFIX if prefix is None else prefix
+        self.prefix = prefix + '.' if prefix else ''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def resolve(self):
+        """Return the server's (ip, port), or None if it can't be found."""
+        if self.address is None and time.time() >= self._retry_at:
+            try:
+                self.address = (socket.gethostbyname(self.host), self.port)
+            except socket.error:
+                logger.warning(u"Unable to resolve StatsD host %r", self.host)
+                self._retry_at = time.time() + self.RETRY_SECONDS
+        return self.address
+
+    def timing(self, name, ms):
+        address = self.resolve()
+        if address is None:
+            return
+        data = ('%s%s:%.3f|ms' % (self.prefix, name, ms)).encode('utf-8')
+        try:
+            self.socket.sendto(data, address)
+        except socket.error:
+            pass
+
+
+class Histogram(object):
+    """The count, total, min and max of a series of timings, plus a sample
+    of the most recent values (from which the percentiles are taken)."""
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, pct):
+        values = sorted(self.samples)
+        return values[int(round(pct / 100.0 * (len(values) - 1)))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class MemoryBackend(BaseMetricsBackend):
+    """Keeps a histogram of each stage's timings, in memory.
+
+    The histograms are per-process. Read them with `summary()`, e.g. from
+    a shell, or a view of your own.
+
+    """
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def timing(self, name, ms):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.max_samples)  # noqa
+            histogram.add(ms)
+
+    def summary(self):
+        """Return {name: {count, mean, min, max, p50, p95, p99}}."""
+        with self._lock:
+            return {name: h.summary() for name, h in self.histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+class Timer(object):
+    """Context manager that sends the time taken to a backend."""
+
+    __slots__ = ('backend', 'name', 'start')
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *args):
+        self.backend.timing(self.name, 1000 * (clock() - self.start))
+
+
+class NullTimer(object):
+    """Context manager that does nothing - used when metrics are off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def get_backend():
+    """Return the configured metrics backend instance, or None.
+
+    This is called from the callback view, so if the backend can't be
+    loaded the error is logged, and metrics are turned off, rather than
+    failing every callback.
+
+    """
+    global _backend, _loaded
+    if not _loaded:
+        backend = settings.METRICS_BACKEND
+        try:
+            _backend = import_string(backend)() if backend else None
+        except Exception:
+            logger.exception(u"Unable to load metrics backend %r", backend)
+            _backend = None
+        _loaded = True
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the metrics backend (None to turn metrics off)."""
+    global _backend, _loaded
+    _backend, _loaded = backend, True
+
+
+def timer(name):
+    """Return a context manager that times the code it wraps.
+
+        with metrics.timer('callback.insert'):
+            event.save()
+
+    """
+    backend = _backend if _loaded else get_backend()
+    if backend is None:
+        return NULL_TIMER
+    return Timer(backend, name)
+
+
+def timed(name):
+    """Decorator that times each call to a function."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def receiver_name(receiver):
+    """Return '<module>.<name>' for a signal receiver."""
+    return '%s.%s' % (
+        getattr(receiver, '__module__', None),
+        getattr(receiver, '__name__', receiver.__class__.__name__)
+    )
+
+
+def send(signal, prefix, sender, **named):
+    """Send a signal, timing each receiver as `<prefix>.<receiver>`.
+
+    This is the same as `signal.send` (which is what's called if metrics
+    are off) - receivers are called in the same order, and exceptions are
+    not caught.
+
+    """
+    backend = _backend if _loaded else get_backend()
+    if backend is None:
+        return signal.send(sender=sender, **named)
+    responses = []
+    if not signal.receivers:
+        return responses
+    for receiver in signal._live_receivers(sender):
+        with Timer(backend, '%s.%s' % (prefix, receiver_name(receiver))):
+            response = receiver(signal=signal, sender=sender, **named)
+        responses.append((receiver, response))
+    return responses
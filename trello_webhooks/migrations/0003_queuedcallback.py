@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0002_webhook_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedCallback',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('auth_token', models.CharField(max_length=64)),
+                ('trello_model_id', models.CharField(max_length=24)),
+                ('body', models.TextField()),
+                ('received_at', models.DateTimeField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('lease_token', models.CharField(max_length=32, blank=True)),
+                ('leased_until', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+
+
+def merge_duplicate_webhooks(apps, schema_editor):
+    """Merge webhooks with the same auth_token and trello_model_id.
+
+    The (auth_token, trello_model_id) pair was not unique before this
+    migration, so there may be duplicates. For each pair, the webhook that
+    is registered with Trello (has a trello_id) is kept - else the first
+    one - its events are moved over from the duplicates, and it gets the
+    latest last_updated_at. The duplicates are then deleted, locally only;
+    any that are still registered with Trello are removed by the next run
+    of sync_webhooks.
+
+    """
+    Webhook = apps.get_model('trello_webhooks', 'Webhook')
+    CallbackEvent = apps.get_model('trello_webhooks', 'CallbackEvent')
+    duplicates = (
+        Webhook.objects
+        .values('auth_token', 'trello_model_id')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        webhooks = list(
+            Webhook.objects
+            .filter(
+                auth_token=duplicate['auth_token'],
+                trello_model_id=duplicate['trello_model_id']
+            )
+            .order_by('id')
+        )
+        keep = next((w for w in webhooks if w.trello_id), webhooks[0])
+        others = [w.id for w in webhooks if w.id != keep.id]
+        CallbackEvent.objects.filter(webhook_id__in=others).update(webhook=keep)  # noqa
+        last_updated_at = max(w.last_updated_at for w in webhooks)
+        Webhook.objects.filter(id=keep.id).update(last_updated_at=last_updated_at)  # noqa
+        Webhook.objects.filter(id__in=others).delete()
+
+
+def keep_merged_webhooks(apps, schema_editor):
+    """The merged webhooks can't be split again, so there's nothing to do."""
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0003_queuedcallback'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='callbackevent',
+            name='event_type',
+            field=models.CharField(max_length=50, db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='callbackevent',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='queuedcallback',
+            name='lease_token',
+            field=models.CharField(db_index=True, max_length=32, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(
+            merge_duplicate_webhooks,
+            keep_merged_webhooks
+        ),
+        migrations.AlterUniqueTogether(
+            name='webhook',
+            unique_together=set([('auth_token', 'trello_model_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='callbackevent',
+            index_together=set([('webhook', 'timestamp')]),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0004_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_action_id',
+            field=models.CharField(default='', max_length=24, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_board_id',
+            field=models.CharField(default='', max_length=24, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_board_name',
+            field=models.CharField(default='', max_length=255, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_card_id',
+            field=models.CharField(default='', max_length=24, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_card_name',
+            field=models.CharField(default='', max_length=255, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_list_id',
+            field=models.CharField(default='', max_length=24, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_list_name',
+            field=models.CharField(default='', max_length=255, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_member_id',
+            field=models.CharField(default='', max_length=24, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='callbackevent',
+            name='trello_member_name',
+            field=models.CharField(default='', max_length=255, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import trello_webhooks.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0005_callbackevent_trello_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='callbackevent',
+            name='event_payload',
+            field=trello_webhooks.fields.PayloadField(default=dict),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0006_callbackevent_payloadfield'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='callbackevent',
+            index_together=set([('webhook', 'id'), ('webhook', 'timestamp')]),
+        ),
+    ]
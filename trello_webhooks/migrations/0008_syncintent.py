@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0007_callbackevent_webhook_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncIntent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('action', models.CharField(max_length=10, choices=[('sync', 'Sync'), ('delete', 'Delete')])),
+                ('auth_token', models.CharField(default='', max_length=64, blank=True)),
+                ('trello_id', models.CharField(default='', max_length=24, blank=True)),
+                ('requested_at', models.DateTimeField()),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True)),
+                ('last_error', models.TextField(default='', blank=True)),
+                ('webhook', models.OneToOneField(related_name='sync_intent', null=True, on_delete=django.db.models.deletion.SET_NULL, blank=True, to='trello_webhooks.Webhook')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0008_syncintent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBlock',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('path', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('first_id', models.IntegerField()),
+                ('last_id', models.IntegerField(db_index=True)),
+                ('event_count', models.PositiveIntegerField()),
+                ('checksum', models.CharField(max_length=40)),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import trello_webhooks.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0009_archivedblock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='callbackevent',
+            name='event_payload_compressed',
+            field=models.BinaryField(null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='callbackevent',
+            name='event_payload',
+            field=trello_webhooks.fields.PayloadField(default=dict, compressed_field='event_payload_compressed'),
+            preserve_default=True,
+        ),
+    ]
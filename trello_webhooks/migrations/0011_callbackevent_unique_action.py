@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count, Min
+
+
+def clear_duplicate_action_ids(apps, schema_editor):
+    """Set trello_action_id to NULL where it's blank, or a duplicate.
+
+    Redelivered callbacks were stored as separate events, so where a
+    webhook has more than one event for an action, only the first keeps
+    the action id (the events themselves are not touched).
+
+    """
+    CallbackEvent = apps.get_model('trello_webhooks', 'CallbackEvent')
+    CallbackEvent.objects.filter(trello_action_id='').update(trello_action_id=None)  # noqa
+    duplicates = (
+        CallbackEvent.objects
+        .exclude(trello_action_id=None)
+        .values('webhook_id', 'trello_action_id')
+        .annotate(count=Count('id'), first_id=Min('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        (
+            CallbackEvent.objects
+            .filter(
+                webhook_id=duplicate['webhook_id'],
+                trello_action_id=duplicate['trello_action_id'],
+                id__gt=duplicate['first_id']
+            )
+            .update(trello_action_id=None)
+        )
+
+
+def blank_null_action_ids(apps, schema_editor):
+    CallbackEvent = apps.get_model('trello_webhooks', 'CallbackEvent')
+    CallbackEvent.objects.filter(trello_action_id=None).update(trello_action_id='')  # noqa
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trello_webhooks', '0010_callbackevent_payload_compression'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='callbackevent',
+            name='trello_action_id',
+            field=models.CharField(default=None, max_length=24, null=True, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(
+            clear_duplicate_action_ids,
+            blank_null_action_ids
+        ),
+        migrations.AlterUniqueTogether(
+            name='callbackevent',
+            unique_together=set([('webhook', 'trello_action_id')]),
+        ),
+    ]
@@ -1,35 +1,44 @@
 # # -*- coding: utf-8 -*-
-import json
 import logging
 
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.template.base import TemplateDoesNotExist
-from django.template.loader import render_to_string
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
+from django.utils.encoding import force_text
 
-from jsonfield import JSONField
 import trello
 
+from trello_webhooks import client
+from trello_webhooks import codec
+from trello_webhooks import metrics
 from trello_webhooks import settings
 from trello_webhooks import signals
+from trello_webhooks.activity import activity_recorder
+from trello_webhooks.fields import PayloadField, RawPayload
+from trello_webhooks.rendering import (
+    render_event,
+    template_name,
+    template_registry
+)
 
 logger = logging.getLogger(__name__)
 
 
-# free-floating function to get a new trello.TrelloClient object
-# using the stored settings
+# free-floating function to get a trello.TrelloClient object
+# using the stored settings - clients are shared, one per token,
+# and use a pool of keep-alive connections (see client.py)
 def get_trello_client(api_key=settings.TRELLO_API_KEY,
                       api_secret=settings.TRELLO_API_SECRET,
                       token=None):  # noqa
-    return trello.TrelloClient(api_key, api_secret=api_secret, token=token)
+    return client.get_client(api_key, api_secret=api_secret, token=token)
 
 
 class TrelloWebhookManager(object):
     """Model manager used to interact with Trello API."""
 
-    def __init__(self):
-        self.client = get_trello_client()
+    @property
+    def client(self):
+        return get_trello_client()
 
     def list_hooks(self, auth_token):
         """Return all the hooks registered on Trello for a given auth_token.
@@ -39,7 +48,9 @@ class TrelloWebhookManager(object):
                 model as Webhook.auth_token
 
         """
-        return self.client.list_hooks(token=auth_token)
+        # use the token's own client, so that the request is authorised
+        # by, and rate limited against, the token
+        return get_trello_client(token=auth_token).list_hooks(token=auth_token)  # noqa
 
 
 class Webhook(models.Model):
@@ -70,11 +81,13 @@ class Webhook(models.Model):
     created_at = models.DateTimeField(blank=True)
     last_updated_at = models.DateTimeField(blank=True)
 
-    # this reflects the reality of the Trello API
-    unique_together = ('trello_model_id', 'auth_token')
-
     remote_objects = TrelloWebhookManager()
 
+    class Meta:
+        # this reflects the reality of the Trello API, and the unique index
+        # is what the callback view uses to look up the webhook.
+        unique_together = ('auth_token', 'trello_model_id')
+
     def __unicode__(self):
         if self.id:
             return u"Webhook %i: %s" % (self.id, self.callback_url)
@@ -132,41 +145,88 @@ class Webhook(models.Model):
         self.last_updated_at = timezone.now()
         return super(Webhook, self).save(update_fields=['last_updated_at'])
 
+    def record_activity(self, timestamp=None):
+        """Update last_updated_at when a callback is received.
+
+        If the TOUCH_INTERVAL setting is set then the database update is
+        deferred, and coalesced with any other updates in the interval (see
+        trello_webhooks.activity), else this is the same as touch().
+
+        """
+        if settings.TOUCH_INTERVAL > 0:
+            return activity_recorder.record(self, timestamp)
+        return self.touch()
+
     def save(self, *args, **kwargs):
         """Update timestamps, and sync with Trello on first save.
 
         If this is the first save (id=None), then we'll attempt to sync
         with Trello, unless the 'sync' kwarg is passed in and False.
 
+        If the SYNC_MODE setting is 'outbox' then the sync is deferred - a
+        SyncIntent is saved (in the same transaction as the webhook) and
+        the sync is made later by the `drain_sync_outbox` command.
+
         """
         # do not process side effects if we're doing a partial model update
-        if kwargs.pop('sync', True):
+        sync = kwargs.pop('sync', True)
+        deferred = sync and settings.SYNC_MODE == 'outbox'
+        if sync and not deferred:
             self.sync()
         self.last_updated_at = timezone.now()
         self.created_at = self.created_at or self.last_updated_at
-        super(Webhook, self).save(*args, **kwargs)
+        if deferred:
+            with transaction.atomic():
+                super(Webhook, self).save(*args, **kwargs)
+                SyncIntent.record_sync(self)
+        else:
+            super(Webhook, self).save(*args, **kwargs)
         return self
 
     def delete(self, *args, **kwargs):
-        """Delete the remote Trello webhook as well as the local instance."""
+        """Delete the remote Trello webhook as well as the local instance.
+
+        If the SYNC_MODE setting is 'outbox' then the remote delete is
+        deferred (see `save`).
+
+        """
         # the underlying SQL row has been deleted, but the object still exists,
         # so we can still reference self.
         # https://docs.djangoproject.com/en/1.7/ref/models/instances/#django.db.models.Model.delete  # noqa
+        if settings.SYNC_MODE == 'outbox':
+            with transaction.atomic():
+                SyncIntent.objects.filter(webhook=self).delete()
+                if self.has_trello_id:
+                    SyncIntent.record_delete(self.auth_token, self.trello_id)
+                super(Webhook, self).delete(*args, **kwargs)
+            return self
         if self.has_trello_id:
             self._delete_remote()
         super(Webhook, self).delete(*args, **kwargs)
         return self
 
-    def _trello_sync(self, verb):
-        """Calls Trello API, update from response JSON."""
+    def _trello_sync(self, verb, fail_silently=True):
+        """Calls Trello API, update from response JSON.
+
+        If `fail_silently` is False then errors that are worth retrying (rate
+        limiting, connection errors) are raised, rather than logged.
+
+        """
         try:
-            response = self.get_client().fetch_json(
-                self.trello_url,
-                http_method=verb,
-                post_args=self.post_args()
-            )
+            with metrics.timer('trello.sync.%s' % verb.lower()):
+                response = self.get_client().fetch_json(
+                    self.trello_url,
+                    http_method=verb,
+                    post_args=self.post_args()
+                )
             self.trello_id = response.get('id', '')
             self.is_active = response.get('active', True) and self.has_trello_id
+        except client.RateLimited, ex:
+            # the webhook is fine, Trello just isn't talking to us right now,
+            # so leave it as it is, to be synced again later.
+            if not fail_silently:
+                raise
+            logger.warning(u"Rate limited syncing webhook to trello: %s", ex)
         except trello.ResourceUnavailable, ex:
             logger.warning(u"Error syncing webhook to trello: %s", ex)
             # if we get a 404 then clear out the Trello Id
@@ -174,22 +234,22 @@ class Webhook(models.Model):
             self.is_active = False
         return self
 
-    def _update_remote(self):
+    def _update_remote(self, fail_silently=True):
         """Update the remote Trello entity."""
         assert self.has_trello_id, "You cannot PUT to Trello without a trello_id."
-        return self._trello_sync('PUT')
+        return self._trello_sync('PUT', fail_silently=fail_silently)
 
-    def _create_remote(self):
+    def _create_remote(self, fail_silently=True):
         """Create a new remote Trello entity."""
         assert not self.has_trello_id, "You cannot POST to Trello with a trello_id."
-        return self._trello_sync('POST')
+        return self._trello_sync('POST', fail_silently=fail_silently)
 
     def _delete_remote(self):
         """Delete a new remote Trello entity."""
         assert self.has_trello_id, "You cannot DELETE from Trello without a trello_id."
         return self._trello_sync('DELETE')
 
-    def sync(self):
+    def sync(self, fail_silently=True):
         """Synchronise webhook with Trello.
 
         If the object has a trello_id then we assume it's valid, and send
@@ -203,12 +263,33 @@ class Webhook(models.Model):
         Does not save the object, just updates the local trello_id property.
         Saving the local object is the calling code's responsibility.
 
+        If `fail_silently` is False, errors that are worth retrying are
+        raised - see `_trello_sync`.
+
         """
         if self.has_trello_id:
             # we have a Trello id, so PUT
-            return self._update_remote()
+            return self._update_remote(fail_silently=fail_silently)
         else:
-            return self._create_remote()
+            return self._create_remote(fail_silently=fail_silently)
+
+    def build_callback(self, body_text):
+        """Return a new, unsaved, CallbackEvent from the JSON body.
+
+        This is split out from add_callback so that events can be
+        created in bulk (see trello_webhooks.buffer).
+
+        """
+        # the body is parsed once, here, and then stored verbatim
+        body_text = force_text(body_text)
+        payload = codec.loads(body_text)
+        action = payload['action']['type']
+        return CallbackEvent(
+            webhook=self,
+            timestamp=timezone.now(),
+            event_type=action,
+            event_payload=RawPayload(body_text, payload)
+        ).update_trello_fields()
 
     def add_callback(self, body_text):
         """Add a new CallbackEvent instance and fire signal.
@@ -216,18 +297,35 @@ class Webhook(models.Model):
         This is called from the callback view, with the JSON body. It
         creates a new CallbackEvent.
 
-        Returns the new CallbackEvent instance.
+        Trello redelivers callbacks that it thinks have failed (e.g. if
+        we're slow to respond), so if this webhook has already received
+        the same Trello action the callback is ignored - nothing is saved,
+        and the signal is not sent. (See CallbackEvent.save_if_new.)
+
+        Each stage is timed (see trello_webhooks.metrics), including each
+        of the signal's receivers.
+
+        Returns the new CallbackEvent instance, or None if the callback
+        was a duplicate.
 
         """
-        payload = json.loads(body_text)
-        action = payload['action']['type']
-        event = CallbackEvent(
-            webhook=self,
-            event_type=action,
-            event_payload=body_text
-        ).save()
-        self.touch()
-        signals.callback_received.send(sender=self.__class__, event=event)
+        with metrics.timer('callback.parse'):
+            event = self.build_callback(body_text)
+        with metrics.timer('callback.insert'):
+            saved = event.save_if_new()
+        if not saved:
+            logger.info(
+                u"Ignoring duplicate callback for action '%s' on %r",
+                event.trello_action_id, self
+            )
+            return None
+        with metrics.timer('callback.touch'):
+            self.record_activity(event.timestamp)
+        with metrics.timer('callback.signal'):
+            metrics.send(
+                signals.callback_received, 'callback.receiver',
+                sender=self.__class__, event=event
+            )
         return event
 
 
@@ -236,11 +334,50 @@ class CallbackEvent(models.Model):
     # ref to the webhook that picked up the event
     webhook = models.ForeignKey(Webhook)
     # events are read-only so just a timestamp required
-    timestamp = models.DateTimeField()
+    timestamp = models.DateTimeField(db_index=True)
     # the Trello event type - moveCard, commentCard, etc.
-    event_type = models.CharField(max_length=50)
-    # the complete request payload, as JSON
-    event_payload = JSONField()
+    event_type = models.CharField(max_length=50, db_index=True)
+    # the complete request payload, as JSON - see fields.PayloadField
+    event_payload = PayloadField(compressed_field='event_payload_compressed')
+    # the payload, compressed, if PAYLOAD_COMPRESSION is set (in which case
+    # event_payload is empty) - NB this must come after event_payload
+    event_payload_compressed = models.BinaryField(
+        blank=True, null=True, editable=False
+    )
+    # the following are extracted from the payload when the event is
+    # created (see update_trello_fields), so that they can be displayed,
+    # filtered and sorted without having to load and parse the payload.
+    # NB the action id is NULL (not '') if the payload doesn't have one, as
+    # it's unique per webhook, and is used to ignore redelivered callbacks.
+    trello_action_id = models.CharField(
+        max_length=24, blank=True, null=True, default=None, db_index=True
+    )
+    trello_board_id = models.CharField(
+        max_length=24, blank=True, default='', db_index=True
+    )
+    trello_board_name = models.CharField(
+        max_length=255, blank=True, default='', db_index=True
+    )
+    trello_list_id = models.CharField(
+        max_length=24, blank=True, default='', db_index=True
+    )
+    trello_list_name = models.CharField(max_length=255, blank=True, default='')
+    trello_card_id = models.CharField(
+        max_length=24, blank=True, default='', db_index=True
+    )
+    trello_card_name = models.CharField(max_length=255, blank=True, default='')
+    trello_member_id = models.CharField(
+        max_length=24, blank=True, default='', db_index=True
+    )
+    trello_member_name = models.CharField(max_length=255, blank=True, default='')
+
+    class Meta:
+        # used to fetch the latest events for a given webhook, by time
+        # and by id (the webhook admin page pages through events by id).
+        index_together = [('webhook', 'timestamp'), ('webhook', 'id')]
+        # Trello sends each action once per webhook (which may be more
+        # than once - e.g. to a board webhook and a card webhook)
+        unique_together = ('webhook', 'trello_action_id')
 
     def __unicode__(self):
         if self.id:
@@ -264,11 +401,73 @@ class CallbackEvent(models.Model):
         )
 
     def save(self, *args, **kwargs):
-        """Update timestamp"""
+        """Update timestamp, and extract Trello fields from a new event."""
         self.timestamp = timezone.now()
+        if self.id is None:
+            self.update_trello_fields()
         super(CallbackEvent, self).save(*args, **kwargs)
         return self
 
+    def save_if_new(self):
+        """Save a new event, unless its Trello action is already saved.
+
+        This is an insert-or-ignore - the INSERT is attempted, and if it
+        violates the (webhook, trello_action_id) unique constraint then the
+        event is a duplicate, rather than checking for it first with a
+        SELECT. The INSERT is wrapped in a savepoint, so that a duplicate
+        doesn't break any surrounding transaction (outside of one this is
+        the transaction that save() would use anyway).
+
+        Returns True if the event was saved, False if it was a duplicate,
+        in which case it's left unsaved.
+
+        """
+        assert self.id is None, "save_if_new is only for new events."
+        self.update_trello_fields()
+        if self.trello_action_id is None:
+            self.save()
+            return True
+        try:
+            with transaction.atomic():
+                self.save()
+        except IntegrityError:
+            self.id = None
+            # only the failure path pays for the SELECT - anything other
+            # than a duplicate (e.g. a deleted webhook) is re-raised
+            duplicate = CallbackEvent.objects.filter(
+                webhook_id=self.webhook_id,
+                trello_action_id=self.trello_action_id
+            ).exists()
+            if not duplicate:
+                raise
+            return False
+        return True
+
+    def update_trello_fields(self):
+        """Copy the Trello ids and names out of the payload into columns.
+
+        This walks the payload once, and sets all of the trello_* fields.
+        It's called automatically when an event is created; for existing
+        events use the `backfill_callback_events` management command.
+
+        """
+        action = self.event_payload.get('action') or {}
+        data = action.get('data') or {}
+        member = action.get('memberCreator') or {}
+        board = data.get('board') or {}
+        list_ = data.get('list') or {}
+        card = data.get('card') or {}
+        self.trello_action_id = action.get('id') or None
+        self.trello_member_id = member.get('id') or ''
+        self.trello_member_name = (member.get('fullName') or '')[:255]
+        self.trello_board_id = board.get('id') or ''
+        self.trello_board_name = (board.get('name') or '')[:255]
+        self.trello_list_id = list_.get('id') or ''
+        self.trello_list_name = (list_.get('name') or '')[:255]
+        self.trello_card_id = card.get('id') or ''
+        self.trello_card_name = (card.get('name') or '')[:255]
+        return self
+
     @property
     def action_data(self):
         """Returns the 'data' node from the payload."""
@@ -297,27 +496,32 @@ class CallbackEvent(models.Model):
     @property
     def member_name(self):
         """Return member name if it exists (used in admin)."""
-        return self.member.get('fullName') if self.member else None
+        return self.trello_member_name or None
 
     @property
     def board_name(self):
         """Return board name if it exists (used in admin)."""
-        return self.board.get('name') if self.board else None
+        return self.trello_board_name or None
 
     @property
     def list_name(self):
         """Return list name if it exists (used in admin)."""
-        return self.list.get('name') if self.list else None
+        return self.trello_list_name or None
 
     @property
     def card_name(self):
         """Return card name if it exists (used in admin)."""
-        return self.card.get('name') if self.card else None
+        return self.trello_card_name or None
 
     @property
     def template(self):
         """Return full path to render template, based on event_type."""
-        return 'trello_webhooks/%s.html' % self.event_type
+        return template_name(self.event_type)
+
+    @property
+    def has_template(self):
+        """Return True if there is a template for this event_type."""
+        return template_registry.has_template(self.event_type)
 
     def render(self):
         """Render the event using an HTML template.
@@ -327,10 +531,11 @@ class CallbackEvent(models.Model):
 
         If the template does not exist (typically this would be because
         we capture a new event type that we haven't previously encountered),
-        a warning is logged, and None is returned. (We return None instead
-        of an empty string to make it clear that something has gone wrong -
-        an empty string _could_ be a realistic output, if someone has
-        overridden a template and spelled the context vars incorrectly.)
+        a warning is logged (the first time only), and None is returned.
+        (We return None instead of an empty string to make it clear that
+        something has gone wrong - an empty string _could_ be a realistic
+        output, if someone has overridden a template and spelled the
+        context vars incorrectly.)
 
         The event_payload is passed in to the template as the context.
 
@@ -338,12 +543,172 @@ class CallbackEvent(models.Model):
         to override these templates in your own project (see the template
         property for the full path to the template that is loaded).
 
+        Templates are compiled once, and the rendered output of saved
+        events is cached - see rendering.py.
+
         """
-        try:
-            return render_to_string(self.template, self.event_payload)
-        except TemplateDoesNotExist:
-            logger.warning(
-                u"Missing or misconfigured template: '%s'",
-                self.template
+        return render_event(self)
+
+
+class QueuedCallback(models.Model):
+    """Raw callback stored by the view when ASYNC_INGESTION is enabled.
+
+    This is deliberately as dumb as possible - it's just the request body
+    plus the routing keys from the URL, so that the view can store it with
+    a single INSERT and get back to Trello. It is converted into a real
+    CallbackEvent by trello_webhooks.ingest.process_batch, typically called
+    from the `process_callbacks` management command.
+
+    """
+    auth_token = models.CharField(max_length=64)
+    trello_model_id = models.CharField(max_length=24)
+    # the request body, verbatim
+    body = models.TextField()
+    received_at = models.DateTimeField()
+    # the number of times a worker has tried (and failed) to process this
+    attempts = models.PositiveIntegerField(default=0)
+    # workers claim rows by setting these - see DatabaseQueueBackend.fetch
+    lease_token = models.CharField(max_length=32, blank=True, db_index=True)
+    leased_until = models.DateTimeField(blank=True, null=True)
+
+    def __unicode__(self):
+        return (
+            u"QueuedCallback %s: received for '%s'" %
+            (self.id, self.trello_model_id)
+        )
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return (
+            u"<QueuedCallback id=%s, model='%s', attempts=%s>" %
+            (self.id, self.trello_model_id, self.attempts)
+        )
+
+    def save(self, *args, **kwargs):
+        """Set received_at timestamp on first save."""
+        self.received_at = self.received_at or timezone.now()
+        super(QueuedCallback, self).save(*args, **kwargs)
+        return self
+
+
+class SyncIntent(models.Model):
+    """A pending sync of a Webhook to Trello, when SYNC_MODE is 'outbox'.
+
+    Webhook.save() and Webhook.delete() record these, in the same transaction
+    as the change to the webhook itself, instead of calling Trello, and the
+    `drain_sync_outbox` command then makes the API calls (see outbox.py).
+
+    There is at most one pending 'sync' intent per webhook - saving a webhook
+    again before it has been synced just bumps `requested_at`. A 'delete'
+    intent has no webhook (it's been deleted), so stores the auth_token and
+    trello_id needed to delete the remote webhook.
+
+    """
+    SYNC = 'sync'
+    DELETE = 'delete'
+    ACTION_CHOICES = (
+        (SYNC, 'Sync'),
+        (DELETE, 'Delete'),
+    )
+    webhook = models.OneToOneField(
+        Webhook,
+        related_name='sync_intent',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    # only used by 'delete' intents
+    auth_token = models.CharField(max_length=64, blank=True, default='')
+    trello_id = models.CharField(max_length=24, blank=True, default='')
+    # time of the most recent request - used to detect changes made whilst
+    # the intent was being processed
+    requested_at = models.DateTimeField()
+    # failed attempts, and when to try next
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(db_index=True)
+    last_error = models.TextField(blank=True, default='')
+
+    def __unicode__(self):
+        return u"SyncIntent %s: %s %s" % (self.id, self.action, self.webhook_id or self.trello_id)  # noqa
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return (
+            u"<SyncIntent id=%s, action='%s', webhook=%s, attempts=%s>" %
+            (self.id, self.action, self.webhook_id, self.attempts)
+        )
+
+    @classmethod
+    def record_sync(cls, webhook):
+        """Record (or refresh) a pending sync for a webhook."""
+        now = timezone.now()
+        updated = cls.objects.filter(webhook=webhook).update(
+            requested_at=now,
+            next_attempt_at=now,
+            attempts=0,
+            last_error=''
+        )
+        if updated == 0:
+            cls.objects.create(
+                webhook=webhook,
+                action=cls.SYNC,
+                requested_at=now,
+                next_attempt_at=now
             )
-            return None
+
+    @classmethod
+    def record_delete(cls, auth_token, trello_id):
+        """Record a pending delete of a remote webhook."""
+        now = timezone.now()
+        return cls.objects.create(
+            action=cls.DELETE,
+            auth_token=auth_token,
+            trello_id=trello_id,
+            requested_at=now,
+            next_attempt_at=now
+        )
+
+
+class ArchivedBlock(models.Model):
+    """Index entry for a block of CallbackEvents in an archive file.
+
+    The `archive_callback_events` command moves old events out of the
+    database into gzipped JSONL files (see archive.py). Each file is written
+    as a series of independently compressed blocks (gzip members), and each
+    block gets one of these, recording where it is in the file and the range
+    of event ids it contains, so that a single event can be fetched by
+    reading and decompressing just its block.
+
+    NB a block only contains the events between first_id and last_id that
+    were archived to the same file - events are partitioned by date, so the
+    id ranges of blocks in different files can overlap.
+
+    """
+    # path of the archive file, relative to ARCHIVE_ROOT
+    path = models.CharField(max_length=255)
+    # position and size of the (compressed) block within the file
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    first_id = models.IntegerField()
+    last_id = models.IntegerField(db_index=True)
+    event_count = models.PositiveIntegerField()
+    # sha1 of the compressed block, checked when it is read
+    checksum = models.CharField(max_length=40)
+    archived_at = models.DateTimeField()
+
+    def __unicode__(self):
+        return u"ArchivedBlock %s: events %s-%s in %s" % (self.id, self.first_id, self.last_id, self.path)  # noqa
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return (
+            u"<ArchivedBlock id=%s, path='%s', first_id=%s, last_id=%s>" %
+            (self.id, self.path, self.first_id, self.last_id)
+        )
@@ -0,0 +1,138 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.outbox - deferred syncing of webhooks with Trello
+"""Process the SyncIntents recorded when SYNC_MODE is 'outbox'.
+
+In 'outbox' mode saving or deleting a Webhook doesn't call Trello - it
+records a SyncIntent, in the same transaction, and returns. The intents
+are then processed in batches by `drain` (see the `drain_sync_outbox`
+command):
+
+1. Fetch a batch of intents that are due
+2. Make the Trello API calls - concurrently, if a pool is supplied
+3. On the main thread, save the results (trello_id, is_active) to the
+   webhooks, and delete the intents - or, if the call failed with an
+   error worth retrying (rate limiting, connection errors), schedule
+   another attempt, with exponential backoff, up to SYNC_MAX_ATTEMPTS.
+
+If a webhook is saved again whilst its intent is being processed the
+intent is left in place (its `requested_at` will have changed) and it will
+be synced again in the next batch.
+
+NB intents are not leased, so only one `drain_sync_outbox` command should
+be run at a time (use --workers for concurrency).
+
+"""
+import logging
+from datetime import timedelta
+
+import trello
+from django.db import transaction
+from django.utils import timezone
+
+from trello_webhooks import client, settings
+from trello_webhooks.models import get_trello_client, SyncIntent, Webhook
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_due(batch_size):
+    """Return a list of the intents that are due to be processed."""
+    return list(
+        SyncIntent.objects
+        .filter(
+            next_attempt_at__lte=timezone.now(),
+            attempts__lt=settings.SYNC_MAX_ATTEMPTS
+        )
+        .select_related('webhook')
+        .order_by('next_attempt_at', 'id')[:batch_size]
+    )
+
+
+def delete_remote(auth_token, trello_id):
+    """Delete a remote webhook - a 404 means it's already gone."""
+    try:
+        get_trello_client(token=auth_token).fetch_json(
+            '/webhooks/%s' % trello_id,
+            http_method='DELETE'
+        )
+    except client.RateLimited:
+        raise
+    except trello.ResourceUnavailable, ex:
+        if ex._status != 404:
+            raise
+
+
+def apply_intent(intent):
+    """Make the Trello API call for an intent - called from worker threads.
+
+    This doesn't touch the database. Returns an (intent, exception) tuple.
+
+    """
+    try:
+        if intent.action == SyncIntent.DELETE:
+            delete_remote(intent.auth_token, intent.trello_id)
+        elif intent.webhook is not None:
+            intent.webhook.sync(fail_silently=False)
+        return intent, None
+    except Exception as ex:
+        return intent, ex
+
+
+def complete(intent):
+    """Save the result of a successful intent, and remove it."""
+    webhook = intent.webhook
+    with transaction.atomic():
+        if intent.action == SyncIntent.SYNC and webhook is not None:
+            updated = Webhook.objects.filter(id=webhook.id).update(
+                trello_id=webhook.trello_id,
+                is_active=webhook.is_active,
+                last_updated_at=timezone.now()
+            )
+            if updated == 0 and webhook.has_trello_id:
+                # deleted locally whilst we were registering it remotely
+                SyncIntent.record_delete(webhook.auth_token, webhook.trello_id)  # noqa
+        SyncIntent.objects.filter(
+            id=intent.id,
+            requested_at=intent.requested_at
+        ).delete()
+
+
+def retry(intent, ex):
+    """Schedule another attempt at a failed intent."""
+    attempts = intent.attempts + 1
+    if attempts >= settings.SYNC_MAX_ATTEMPTS:
+        logger.error(u"Giving up on %r after %i attempts: %s", intent, attempts, ex)  # noqa
+    else:
+        logger.warning(u"Error processing %r (attempt %i): %s", intent, attempts, ex)  # noqa
+    SyncIntent.objects.filter(
+        id=intent.id,
+        requested_at=intent.requested_at
+    ).update(
+        attempts=attempts,
+        next_attempt_at=timezone.now() + timedelta(seconds=client.backoff(attempts)),  # noqa
+        last_error=unicode(ex)[:1000]
+    )
+
+
+def drain(batch_size=100, pool=None):
+    """Process one batch of due intents.
+
+    Args:
+        batch_size: the maximum number of intents to process.
+        pool: optional multiprocessing.pool.ThreadPool, used to make the
+            Trello API calls concurrently.
+
+    Returns a (succeeded, failed) tuple of counts.
+
+    """
+    intents = fetch_due(batch_size)
+    imap = pool.imap if pool else lambda func, items: (func(i) for i in items)  # noqa
+    succeeded = failed = 0
+    for intent, ex in imap(apply_intent, intents):
+        if ex is None:
+            complete(intent)
+            succeeded += 1
+        else:
+            retry(intent, ex)
+            failed += 1
+    return succeeded, failed
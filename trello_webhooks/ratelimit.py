@@ -0,0 +1,104 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.ratelimit - keep Trello API calls within the rate limits
+"""Client-side rate limiting of Trello API calls.
+
+Trello limits the number of API requests per API key, and per user token
+(at the time of writing, 300 requests per 10 seconds per key, and 100 per
+10 seconds per token) and responds with a 429 to any requests over the
+limit. All of the API calls made by this app (see client.py) go through the
+process-wide `rate_limiter`, which delays requests so that neither limit is
+exceeded.
+
+Each limit is enforced using a token bucket. A bucket that holds `burst`
+tokens, and refills at `rate` tokens per second, allows at most
+`burst + rate * interval` requests in any interval - so for a limit of N
+requests per interval the bucket is sized so that total is N.
+
+NB the buckets are per-process - if you are running several processes that
+call Trello (e.g. several workers), the limits should be divided between
+them.
+
+"""
+import logging
+import threading
+import time
+
+from trello_webhooks import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket allowing at most `limit` requests in any `interval`."""
+
+    def __init__(self, limit, interval):
+        self.burst = max(1, limit // 10)
+        self.rate = float(limit - self.burst) / interval
+        assert self.rate > 0, u"Rate limit of %s per %ss is too low." % (limit, interval)  # noqa
+        self.tokens = float(self.burst)
+        self.updated_at = time.time()
+
+    def _refill(self, now):
+        elapsed = max(0, now - self.updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now):
+        """Return the time (in seconds) until a token is available."""
+        self._refill(now)
+        # allow for floating point error, else we may never get there
+        return 0 if self.tokens >= 0.999999 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class RateLimiter(object):
+    """Schedules API requests within the per-key and per-token limits.
+
+    Args:
+        key_limit: (requests, seconds) tuple, the limit for all requests,
+            or None for no limit.
+        token_limit: (requests, seconds) tuple, the limit for each token,
+            or None for no limit.
+
+    """
+    def __init__(self, key_limit, token_limit):
+        self.key_limit = key_limit
+        self.token_limit = token_limit
+        self.key_bucket = TokenBucket(*key_limit) if key_limit else None
+        self.token_buckets = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, token):
+        buckets = [self.key_bucket] if self.key_bucket else []
+        if self.token_limit and token:
+            bucket = self.token_buckets.get(token)
+            if bucket is None:
+                bucket = self.token_buckets[token] = TokenBucket(*self.token_limit)  # noqa
+            buckets.append(bucket)
+        return buckets
+
+    def acquire(self, token=None):
+        """Block until a request can be made, return the time waited.
+
+        The request is only counted once it is within both limits, so that
+        a request that's waiting on one limit doesn't use up the other.
+
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                buckets = self._buckets(token)
+                now = time.time()
+                wait = max([b.wait_time(now) for b in buckets] or [0])
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.consume()
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+
+# the process-wide limiter used by all Trello API calls
+rate_limiter = RateLimiter(settings.RATE_LIMIT_KEY, settings.RATE_LIMIT_TOKEN)
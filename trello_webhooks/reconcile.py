@@ -0,0 +1,139 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.reconcile - plan the sync between local and remote webhooks
+"""Reconciliation of local Webhook objects with the webhooks on Trello.
+
+This is used by the `sync_webhooks` management command, and is split into
+two stages - planning, which compares the local webhooks with the remote
+webhooks (as returned by `list_hooks`) and works out what needs to be done,
+without changing anything, and applying the plan (see the command).
+
+The plan contains:
+
+    create - remote webhooks that do not exist locally, as new (unsaved)
+        Webhook objects, to be saved locally in bulk.
+    update - local webhooks that are to be synced to Trello (PUT if they
+        have a trello_id, else POST). This includes local webhooks that
+        match a remote webhook on (token, model id) but not on trello_id,
+        which are 'adopted' - given the remote trello_id, and PUT.
+    orphans - local webhooks with a trello_id that Trello doesn't know
+        about (according to the list of webhooks for their token) - they
+        have been deleted on Trello, by a user or because Trello disabled
+        them. By default these are deactivated locally (trello_id cleared,
+        is_active False), as they would be by a PUT that got a 404; the
+        command's --reregister option POSTs them to Trello instead.
+
+Local webhooks whose token could not be listed are always in `update`, as
+we don't know whether they exist on Trello or not.
+
+All of the matching uses dict / set lookups, so planning is linear in the
+number of webhooks.
+
+"""
+import logging
+
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class SyncPlan(object):
+    """The actions required to reconcile local and remote webhooks."""
+
+    def __init__(self):
+        self.create = []
+        self.update = []
+        self.orphans = []
+        # webhook.id: remote trello_id, for update webhooks that are adopted
+        self.adopt = {}
+
+    def __len__(self):
+        return len(self.create) + len(self.update) + len(self.orphans)
+
+    def summary(self):
+        """Return the number of actions of each type, as a dict."""
+        return {
+            'create': len(self.create),
+            'update': len(self.update),
+            'adopt': len(self.adopt),
+            'orphans': len(self.orphans),
+        }
+
+    def describe(self):
+        """Return a list of human-readable lines describing the plan."""
+        lines = [
+            u"%(create)i to create locally, %(update)i to sync to Trello "
+            u"(%(adopt)i adopted), %(orphans)i no longer on Trello" %
+            self.summary()
+        ]
+        for webhook in self.create:
+            lines.append(u"create: %r" % webhook)
+        for webhook in self.update:
+            if webhook.id in self.adopt:
+                lines.append(u"adopt:  %r -> trello_id='%s'" % (webhook, self.adopt[webhook.id]))  # noqa
+            else:
+                lines.append(u"%s:    %r" % ('put' if webhook.has_trello_id else 'post', webhook))  # noqa
+        for webhook in self.orphans:
+            lines.append(u"orphan: %r" % webhook)
+        return lines
+
+
+def build_plan(local_webhooks, remote_hooks):
+    """Compare local and remote webhooks and return a SyncPlan.
+
+    Args:
+        local_webhooks: list of all local Webhook objects.
+        remote_hooks: dict of {token: [trello.WebHook, ...]}, for all of the
+            tokens that were listed successfully.
+
+    Nothing is changed - local or remote - by planning.
+
+    """
+    from trello_webhooks.models import Webhook
+
+    plan = SyncPlan()
+    by_trello_id = dict((w.trello_id, w) for w in local_webhooks if w.has_trello_id)  # noqa
+    by_key = dict(((w.auth_token, w.trello_model_id), w) for w in local_webhooks)  # noqa
+    remote_ids = set()
+    now = timezone.now()
+
+    for token in sorted(remote_hooks):
+        for hook in remote_hooks[token]:
+            remote_ids.add(hook.id)
+            if hook.id in by_trello_id:
+                logger.debug(u"Remote webhook (%s) already exists locally", hook)  # noqa
+                continue
+            local = by_key.get((hook.token, hook.id_model))
+            if local is None:
+                logger.debug(u"Remote webhook (%s) does not exist locally", hook)  # noqa
+                webhook = Webhook(
+                    trello_id=hook.id,
+                    trello_model_id=hook.id_model,
+                    description=hook.desc,
+                    auth_token=hook.token,
+                    is_active=hook.active,
+                    created_at=now,
+                    last_updated_at=now,
+                )
+                by_key[(hook.token, hook.id_model)] = webhook
+                plan.create.append(webhook)
+            elif local.id is None:
+                # Trello allows several hooks on the same model for a token
+                # (with different callback urls), but we only store one
+                logger.warning(u"Ignoring duplicate remote webhook (%s)", hook)  # noqa
+            else:
+                logger.debug(u"Remote webhook (%s) matches local webhook (%r)", hook, local)  # noqa
+                plan.adopt[local.id] = hook.id
+
+    for webhook in local_webhooks:
+        orphaned = (
+            webhook.auth_token in remote_hooks and
+            webhook.has_trello_id and
+            webhook.trello_id not in remote_ids and
+            webhook.id not in plan.adopt
+        )
+        if orphaned:
+            plan.orphans.append(webhook)
+        else:
+            plan.update.append(webhook)
+
+    return plan
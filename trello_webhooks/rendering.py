@@ -0,0 +1,172 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.rendering - registry of compiled event templates
+"""Registry mapping event types to compiled templates.
+
+Each CallbackEvent is rendered using the template 'trello_webhooks/<event_type>.html'.
+Looking that template up means searching every template directory on each
+call, and for event types that have no template (of which there are many)
+the search fails, raises TemplateDoesNotExist, and logs a warning - every
+time.
+
+The TemplateRegistry does each lookup once, and remembers the result -
+either the compiled Template object, or the fact that the template does
+not exist - so that rendering an event, or checking whether it can be
+rendered, never has to go back to the template loaders. Missing templates
+are only logged the first time they are looked up.
+
+The registry is populated at startup (see apps.TrelloWebhooksConfig) with
+all of the trello_webhooks templates that can be found in the template
+directories, and any other event types are looked up on first use. If you
+add or change templates at runtime call `template_registry.refresh()`.
+
+The registry also has a `version` - a hash of the names, sizes and mtimes
+of all of the files in the trello_webhooks template directories (including
+the partials) - which changes whenever any template changes. It's used to
+key the rendered HTML cache (see `render_event`), so that cached output is
+discarded when the templates change.
+
+"""
+import glob
+import hashlib
+import logging
+import os
+import threading
+
+from django.conf import settings as django_settings
+from django.core.cache import caches
+from django.template import Context
+from django.template.base import TemplateDoesNotExist
+from django.template.loader import get_template
+
+from trello_webhooks import metrics, settings
+
+logger = logging.getLogger(__name__)
+
+# marker stored in the registry for event types with no template
+MISSING = object()
+
+
+def template_name(event_type):
+    """Return the template path used to render an event type."""
+    return 'trello_webhooks/%s.html' % event_type
+
+
+def template_dirs():
+    """Return all of the trello_webhooks template directories."""
+    from django.template.loaders.app_directories import app_template_dirs
+    dirs = list(django_settings.TEMPLATE_DIRS) + list(app_template_dirs)
+    return [
+        os.path.join(d, 'trello_webhooks') for d in dirs
+        if os.path.isdir(os.path.join(d, 'trello_webhooks'))
+    ]
+
+
+def find_event_types():
+    """Return the event types of all the templates in the template dirs."""
+    event_types = set()
+    for template_dir in template_dirs():
+        for path in glob.glob(os.path.join(template_dir, '*.html')):
+            event_types.add(os.path.splitext(os.path.basename(path))[0])
+    return event_types
+
+
+def templates_version():
+    """Return a hash that changes whenever any of the templates change."""
+    version = hashlib.md5()
+    for template_dir in template_dirs():
+        for root, _, files in sorted(os.walk(template_dir)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                version.update(
+                    (u"%s:%s:%s;" % (path, stat.st_size, stat.st_mtime)).encode('utf-8')  # noqa
+                )
+    return version.hexdigest()[:12]
+
+
+class TemplateRegistry(object):
+    """Cache of event_type: Template (or MISSING)."""
+
+    def __init__(self):
+        self._templates = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def _load(self, event_type):
+        try:
+            return get_template(template_name(event_type))
+        except TemplateDoesNotExist:
+            logger.warning(
+                u"Missing or misconfigured template: '%s'",
+                template_name(event_type)
+            )
+            return MISSING
+
+    def get(self, event_type):
+        """Return the compiled Template for an event type, or None."""
+        template = self._templates.get(event_type)
+        if template is None:
+            template = self._load(event_type)
+            with self._lock:
+                self._templates[event_type] = template
+        return None if template is MISSING else template
+
+    def has_template(self, event_type):
+        """Return True if the event type has a template."""
+        return self.get(event_type) is not None
+
+    def preload(self, event_types=None):
+        """Load the templates for the event types given (default: all)."""
+        for event_type in (event_types or find_event_types()):
+            self.get(event_type)
+        logger.debug(u"Loaded %i event templates", len(self._templates))
+
+    @property
+    def version(self):
+        """Hash of the template files, as at the last (re)load."""
+        if self._version is None:
+            self._version = templates_version()
+        return self._version
+
+    def refresh(self):
+        """Discard everything, and reload all the templates."""
+        with self._lock:
+            self._templates = {}
+            self._version = None
+        self.preload()
+
+
+# the process-wide registry used by CallbackEvent.render
+template_registry = TemplateRegistry()
+
+
+def render_event(event):
+    """Render a CallbackEvent using its template, caching the output.
+
+    Events never change, so once an event has been rendered the output is
+    stored using Django's cache framework (the TRELLO_WEBHOOKS_RENDER_CACHE
+    setting is the name of the cache to use, None to disable caching), keyed
+    on the event id and the template registry version.
+
+    Returns None if there is no template for the event type.
+
+    """
+    template = template_registry.get(event.event_type)
+    if template is None:
+        return None
+    if event.id is None or settings.RENDER_CACHE is None:
+        with metrics.timer('render.template'):
+            return template.render(Context(event.event_payload))
+
+    cache = caches[settings.RENDER_CACHE]
+    key = 'trello_webhooks:rendered:%s:%s' % (template_registry.version, event.id)  # noqa
+    with metrics.timer('render.cache'):
+        html = cache.get(key)
+    if html is None:
+        with metrics.timer('render.template'):
+            html = template.render(Context(event.event_payload))
+        cache.set(key, html, settings.RENDER_CACHE_TIMEOUT)
+    return html
@@ -0,0 +1,146 @@
+# # -*- coding: utf-8 -*-
+# trello_webhooks.replay - re-send callback_received for past events
+"""Replay stored CallbackEvents through the callback_received signal.
+
+Used by the `replay_callback_events` command, e.g. to run a new (or fixed)
+receiver over past events. Events are selected with the same filters as
+the export (see export.py), read in id order a page at a time, and sent
+either to a single named receiver, or to every receiver connected to the
+signal, optionally on a pool of threads or processes. Each page is
+dispatched (and finished) before the next one is read.
+
+Receivers are called with `replay=True` as well as the `event`, so that
+they can tell a replayed event from a new one. Async receivers (see
+dispatch.py) are called directly, like any other receiver, rather than
+queued - so an event has been handled by every receiver before the replay
+moves on (and checkpoints past it), and their errors are counted.
+
+Progress can be checkpointed to a file - the id of the last event that has
+been replayed (along with all of the events before it) is written after
+each page, and a replay started with the same checkpoint file carries on
+from there. The file is removed once the replay is complete.
+
+"""
+import functools
+import json
+import logging
+import os
+import time
+
+from django.utils.module_loading import import_string
+
+from trello_webhooks import signals
+from trello_webhooks.dispatch import dispatcher
+from trello_webhooks.models import Webhook
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(event, receiver=None):
+    """Send callback_received for an event - called from the pool.
+
+    Args:
+        event: the CallbackEvent to replay.
+        receiver: dotted path to a single receiver function to call, else
+            the event is sent to all of the signal's receivers.
+
+    Errors are logged, and don't stop the replay. Returns an
+    (event_id, errors) tuple, where errors is the number of receivers
+    that raised an exception.
+
+    """
+    if receiver is not None:
+        try:
+            import_string(receiver)(
+                signal=signals.callback_received,
+                sender=Webhook,
+                event=event,
+                replay=True
+            )
+            return event.id, 0
+        except Exception:
+            logger.exception(u"Error replaying %r to %s", event, receiver)
+            return event.id, 1
+    errors = 0
+    responses = signals.callback_received.send_robust(
+        sender=Webhook, event=event, replay=True
+    )
+    responses += dispatcher.call(Webhook, event, replay=True)
+    for func, response in responses:
+        if isinstance(response, Exception):
+            logger.error(u"Error replaying %r to %r: %r", event, func, response)  # noqa
+            errors += 1
+    return event.id, errors
+
+
+def read_checkpoint(path):
+    """Return the last id recorded in a checkpoint file, or 0."""
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['last_id']
+
+
+def write_checkpoint(path, last_id, count):
+    """Record progress, atomically (the file is written, then renamed)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_id': last_id, 'count': count}, f)
+    os.rename(tmp_path, path)
+
+
+def replay(queryset, receiver=None, pool=None, page_size=500, checkpoint=None):  # noqa
+    """Replay the events in a queryset, in id order.
+
+    Args:
+        queryset: the CallbackEvents to replay (see export.filter_events).
+        receiver: dotted path to the receiver to call, else the events are
+            sent to all of the signal's receivers.
+        pool: optional multiprocessing (or ThreadPool) pool, to dispatch
+            the events concurrently.
+        page_size: the number of events read (and dispatched) at a time.
+        checkpoint: optional path to a checkpoint file.
+
+    Returns a (count, errors) tuple.
+
+    """
+    if receiver is not None:
+        # fail now, rather than once per event
+        import_string(receiver)
+    last_id = read_checkpoint(checkpoint)
+    if last_id:
+        logger.info(u"Resuming replay after event %i", last_id)
+    func = functools.partial(dispatch, receiver=receiver)
+    if pool:
+        # batch the events sent to each worker, to cut the overhead
+        imap = lambda f, items: pool.imap(f, items, chunksize=10)  # noqa
+    else:
+        imap = lambda f, items: (f(i) for i in items)  # noqa
+
+    started_at = time.time()
+    count = errors = 0
+    queryset = queryset.order_by('id')
+    while True:
+        # NB each page is read here, and finished before the next one is
+        # read, so that only one page is ever in memory
+        page = list(queryset.filter(id__gt=last_id)[:page_size])
+        if not page:
+            break
+        for _, event_errors in imap(func, page):
+            errors += event_errors
+        count += len(page)
+        last_id = page[-1].id
+        if checkpoint:
+            write_checkpoint(checkpoint, last_id, count)
+        logger.info(
+            u"Replayed %i events (up to id %i), %.0f events/sec",
+            count, last_id, count / max(time.time() - started_at, 0.001)
+        )
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    elapsed = time.time() - started_at
+    logger.info(
+        u"Replay complete, %i events replayed in %.1fs (%.0f events/sec), %i errors.",  # noqa
+        count, elapsed, count / max(elapsed, 0.001), errors
+    )
+    return count, errors
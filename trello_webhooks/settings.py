@@ -5,3 +5,88 @@ from django.conf import settings
 TRELLO_API_KEY = settings.TRELLO_API_KEY
 TRELLO_API_SECRET = settings.TRELLO_API_SECRET
 CALLBACK_DOMAIN = settings.CALLBACK_DOMAIN
+
+# optional settings, all of which have sensible defaults
+
+# if True then the callback view stores the raw request body and returns
+# immediately, leaving the processing of the event (parsing, saving,
+# signalling) to the `process_callbacks` management command.
+ASYNC_INGESTION = getattr(settings, 'TRELLO_WEBHOOKS_ASYNC_INGESTION', False)
+# dotted path to the class used to queue callbacks when ASYNC_INGESTION is on
+INGESTION_BACKEND = getattr(
+    settings,
+    'TRELLO_WEBHOOKS_INGESTION_BACKEND',
+    'trello_webhooks.ingest.DatabaseQueueBackend'
+)
+# how long (in seconds) a worker may hold a queued callback before another
+# worker is allowed to pick it up, and how many times we try before giving up
+INGESTION_LEASE = getattr(settings, 'TRELLO_WEBHOOKS_INGESTION_LEASE', 300)
+INGESTION_MAX_ATTEMPTS = getattr(settings, 'TRELLO_WEBHOOKS_INGESTION_MAX_ATTEMPTS', 5)
+# the process_callbacks command can buffer events and save them in bulk;
+# BUFFER_SIZE is the maximum number of events to hold (0 disables buffering)
+# and BUFFER_MAX_LATENCY the maximum time (in seconds) to hold any one event.
+BUFFER_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_BUFFER_SIZE', 0)
+BUFFER_MAX_LATENCY = getattr(settings, 'TRELLO_WEBHOOKS_BUFFER_MAX_LATENCY', 1.0)
+# the callback view caches Webhook lookups in memory - CACHE_SIZE is the
+# maximum number of webhooks to cache (0 disables the cache), CACHE_TTL the
+# number of seconds to cache them for, and CACHE_NEGATIVE_TTL the number of
+# seconds to remember that a webhook does _not_ exist.
+CACHE_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_CACHE_SIZE', 1000)
+CACHE_TTL = getattr(settings, 'TRELLO_WEBHOOKS_CACHE_TTL', 300)
+CACHE_NEGATIVE_TTL = getattr(settings, 'TRELLO_WEBHOOKS_CACHE_NEGATIVE_TTL', 5)
+# if > 0, webhook last_updated_at timestamps are written to the database at
+# most once every TOUCH_INTERVAL seconds, instead of on every callback.
+TOUCH_INTERVAL = getattr(settings, 'TRELLO_WEBHOOKS_TOUCH_INTERVAL', 0)
+# the JSON library used to parse and serialise payloads - one of 'auto',
+# 'orjson', 'ujson' or 'json' - see trello_webhooks.codec.
+JSON_CODEC = getattr(settings, 'TRELLO_WEBHOOKS_JSON_CODEC', 'auto')
+# the name of the Django cache used to store rendered events (None to
+# disable), and the time (in seconds) to keep them for.
+RENDER_CACHE = getattr(settings, 'TRELLO_WEBHOOKS_RENDER_CACHE', 'default')
+RENDER_CACHE_TIMEOUT = getattr(settings, 'TRELLO_WEBHOOKS_RENDER_CACHE_TIMEOUT', 60 * 60 * 24 * 7)  # noqa
+# the admin changelists use the database's (cheap, approximate) row count
+# estimate instead of COUNT(*) for tables estimated to have more than
+# ADMIN_COUNT_THRESHOLD rows (0 always uses exact counts).
+ADMIN_COUNT_THRESHOLD = getattr(settings, 'TRELLO_WEBHOOKS_ADMIN_COUNT_THRESHOLD', 100000)  # noqa
+# the number of callback events loaded at a time on the webhook admin page.
+ADMIN_EVENTS_PAGE_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_ADMIN_EVENTS_PAGE_SIZE', 20)  # noqa
+# the Trello API root url, the maximum number of connections to keep open to
+# it, and the timeout (in seconds) for each API request.
+TRELLO_API_URL = getattr(settings, 'TRELLO_WEBHOOKS_API_URL', 'https://api.trello.com/1/')  # noqa
+HTTP_POOL_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_HTTP_POOL_SIZE', 10)
+HTTP_TIMEOUT = getattr(settings, 'TRELLO_WEBHOOKS_HTTP_TIMEOUT', 10)
+# Trello API rate limits, as (requests, seconds), per API key and per user
+# token (None to disable), and the number of times to retry a request that
+# is rate limited (429), with exponential backoff from RATE_LIMIT_BACKOFF
+# seconds (or the Retry-After header, if longer).
+RATE_LIMIT_KEY = getattr(settings, 'TRELLO_WEBHOOKS_RATE_LIMIT_KEY', (300, 10))
+RATE_LIMIT_TOKEN = getattr(settings, 'TRELLO_WEBHOOKS_RATE_LIMIT_TOKEN', (100, 10))  # noqa
+RATE_LIMIT_RETRIES = getattr(settings, 'TRELLO_WEBHOOKS_RATE_LIMIT_RETRIES', 5)
+RATE_LIMIT_BACKOFF = getattr(settings, 'TRELLO_WEBHOOKS_RATE_LIMIT_BACKOFF', 1.0)  # noqa
+# 'inline' (default) syncs webhooks with Trello as they are saved / deleted,
+# 'outbox' records the sync in the database, for the `drain_sync_outbox`
+# command to make later. SYNC_MAX_ATTEMPTS is the number of times the command
+# will try each sync before giving up.
+SYNC_MODE = getattr(settings, 'TRELLO_WEBHOOKS_SYNC_MODE', 'inline')
+SYNC_MAX_ATTEMPTS = getattr(settings, 'TRELLO_WEBHOOKS_SYNC_MAX_ATTEMPTS', 5)
+# the directory that old callback events are archived to (see archive.py),
+# and the number of events in each compressed block of an archive file.
+ARCHIVE_ROOT = getattr(settings, 'TRELLO_WEBHOOKS_ARCHIVE_ROOT', None)
+ARCHIVE_BLOCK_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_ARCHIVE_BLOCK_SIZE', 100)  # noqa
+# if set, new event payloads are stored compressed - one of 'auto', 'zstd' or
+# 'zlib' - see trello_webhooks.compression.
+PAYLOAD_COMPRESSION = getattr(settings, 'TRELLO_WEBHOOKS_PAYLOAD_COMPRESSION', None)  # noqa
+# defaults for receivers registered with dispatch.async_receiver - the number
+# of threads each receiver runs on, the maximum number of events it may have
+# queued (further events are dropped), and the number of seconds after which
+# a call is abandoned.
+ASYNC_RECEIVER_WORKERS = getattr(settings, 'TRELLO_WEBHOOKS_ASYNC_RECEIVER_WORKERS', 1)  # noqa
+ASYNC_RECEIVER_QUEUE_SIZE = getattr(settings, 'TRELLO_WEBHOOKS_ASYNC_RECEIVER_QUEUE_SIZE', 1000)  # noqa
+ASYNC_RECEIVER_TIMEOUT = getattr(settings, 'TRELLO_WEBHOOKS_ASYNC_RECEIVER_TIMEOUT', 30)  # noqa
+# dotted path to the metrics backend class that stage timings are sent to
+# (None, the default, turns them off) - see trello_webhooks.metrics - and the
+# StatsD server address and metric name prefix used by the StatsdBackend.
+METRICS_BACKEND = getattr(settings, 'TRELLO_WEBHOOKS_METRICS_BACKEND', None)
+METRICS_STATSD_HOST = getattr(settings, 'TRELLO_WEBHOOKS_METRICS_STATSD_HOST', 'localhost')  # noqa
+METRICS_STATSD_PORT = getattr(settings, 'TRELLO_WEBHOOKS_METRICS_STATSD_PORT', 8125)  # noqa
+METRICS_PREFIX = getattr(settings, 'TRELLO_WEBHOOKS_METRICS_PREFIX', 'trello_webhooks')  # noqa
@@ -1,7 +1,11 @@
 # trello_webhooks.tests package
+import itertools
 import json
 from os import path
 
+# used to generate unique Trello action ids
+_action_ids = itertools.count(1)
+
 
 def get_sample_data(action, format_):
     """Return test JSON payload as 'json' or 'text' object.
@@ -18,3 +22,19 @@ def get_sample_data(action, format_):
     )
     with open(_path, 'r') as f:
         return f.read() if format_ == 'text' else json.load(f)
+
+
+def new_sample_data(action, format_):
+    """Return test JSON payload, as get_sample_data, with a new action id.
+
+    Callbacks for the same Trello action are ignored as duplicates, so use
+    this to create more than one event from the same sample payload.
+
+    """
+    payload = get_sample_data(action, 'json')
+    action_id = payload['action']['id']
+    new_id = '%024x' % next(_action_ids)
+    if format_ == 'text':
+        return get_sample_data(action, 'text').replace(action_id, new_id)
+    payload['action']['id'] = new_id
+    return payload
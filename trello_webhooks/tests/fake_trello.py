@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""A fake Trello API server, run in a background thread, for tests.
+
+It supports the webhook calls made by this app - listing webhooks for a
+token, and creating, updating and deleting webhooks - and records every
+request (method, path, token, time) along with the number of connections
+that were opened, so that tests can check how the API is being used.
+
+It can also enforce rate limits, per API key and per token, and will respond
+with a 429 to any request over the limit (these are counted).
+
+Usage:
+
+    with FakeTrello() as server:
+        with mock.patch('trello_webhooks.settings.TRELLO_API_URL', server.url):  # noqa
+            ...
+        self.assertEqual(server.connections, 1)
+
+"""
+import json
+import re
+import threading
+import time
+
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib.parse import urlparse, parse_qs
+
+# OAuth1 header param containing the user token
+TOKEN_PATTERN = re.compile(r'oauth_token="([^"]*)"')
+
+
+class FakeTrelloHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # HTTP/1.1 so that connections are kept alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body, headers=None):
+        content = json.dumps(body) if not isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def token(self):
+        match = TOKEN_PATTERN.search(self.headers.get('Authorization', ''))
+        if match:
+            return match.group(1)
+        return parse_qs(urlparse(self.path).query).get('token', [None])[0]
+
+    def handle_request(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        path = urlparse(self.path).path.rstrip('/')
+        token = self.token()
+        now = self.server.record(method, path, token)
+
+        status, content, headers = self.server.check_limits(token, now)
+        if status is None:
+            status, content = self.server.api(method, path, token, body)
+        self.respond(status, content, headers)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+class FakeTrello(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Fake Trello API server - see module docstring."""
+
+    daemon_threads = True
+
+    def __init__(self, key_limit=None, token_limit=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeTrelloHandler)  # noqa
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        # (requests, seconds) limits, enforced over a sliding window
+        self.key_limit = key_limit
+        self.token_limit = token_limit
+        # number of requests rejected with a 429
+        self.rate_limited = 0
+        # Retry-After values - the next len(retry_after) requests get a 429
+        self.retry_after = []
+        # trello_id: {id, idModel, callbackURL, description, active, token}
+        self.webhooks = {}
+        self._next_id = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i/1/' % self.server_address[1]
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def record(self, method, path, token):
+        now = time.time()
+        with self.lock:
+            self.requests.append((method, path, token, now))
+        return now
+
+    def _over_limit(self, limit, now, token=None):
+        if limit is None:
+            return False
+        count, interval = limit
+        with self.lock:
+            recent = [
+                r for r in self.requests
+                if now - interval < r[3] <= now and (token is None or r[2] == token)  # noqa
+            ]
+        return len(recent) > count
+
+    def check_limits(self, token, now):
+        """Return (status, body, headers) to reject a request, else Nones."""
+        with self.lock:
+            forced = self.retry_after.pop(0) if self.retry_after else None
+        over = (
+            self._over_limit(self.key_limit, now) or
+            self._over_limit(self.token_limit, now, token)
+        )
+        if forced is None and not over:
+            return None, None, None
+        with self.lock:
+            self.rate_limited += 1
+        return 429, "API rate limit exceeded", {'Retry-After': str(forced or 1)}  # noqa
+
+    def add_webhook(self, token, id_model, active=True):
+        """Add a webhook directly, and return its id."""
+        with self.lock:
+            self._next_id += 1
+            trello_id = 'T%i' % self._next_id
+            self.webhooks[trello_id] = {
+                'id': trello_id,
+                'idModel': id_model,
+                'callbackURL': 'http://example.com/%s' % id_model,
+                'description': '',
+                'active': active,
+                'token': token,
+            }
+        return trello_id
+
+    def api(self, method, path, token, body):
+        """Handle a request, return (status, body)."""
+        args = json.loads(body) if body else {}
+        parts = path.split('/')[2:]  # strip '/1'
+        if method == 'GET' and len(parts) == 3 and parts[0] == 'tokens':
+            hooks = [h for h in self.webhooks.values() if h['token'] == parts[1]]  # noqa
+            return 200, sorted(hooks, key=lambda h: h['id'])
+        if parts[:1] != ['webhooks']:
+            return 404, "Not found"
+        if method == 'POST' and len(parts) == 1:
+            trello_id = self.add_webhook(token, args.get('idModel'))
+            return 200, self.webhooks[trello_id]
+        hook = self.webhooks.get(parts[1] if len(parts) == 2 else None)
+        if hook is None:
+            return 404, "Not found"
+        if method == 'PUT':
+            hook.update(description=args.get('description', ''))
+            return 200, hook
+        if method == 'DELETE':
+            del self.webhooks[hook['id']]
+            return 200, {}
+        return 404, "Not found"
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from trello_webhooks.activity import ActivityRecorder
+from trello_webhooks.models import Webhook
+from trello_webhooks.tests import get_sample_data
+
+
+class ActivityRecorderTests(TestCase):
+
+    def setUp(self):
+        self.recorder = ActivityRecorder(interval=60, use_timer=False)
+        self.webhook = Webhook().save(sync=False)
+        self.created_at = self.webhook.created_at
+
+    def reload(self):
+        return Webhook.objects.get(id=self.webhook.id).last_updated_at
+
+    def test_record(self):
+        with self.assertNumQueries(0):
+            self.recorder.record(self.webhook)
+            self.recorder.record(self.webhook)
+        self.assertTrue(self.webhook.last_updated_at > self.created_at)
+        self.assertEqual(len(self.recorder), 1)
+        self.assertEqual(self.reload(), self.created_at)
+
+    def test_flush(self):
+        other = Webhook(trello_model_id='2').save(sync=False)
+        self.recorder.record(self.webhook)
+        self.recorder.record(other)
+        self.assertEqual(self.recorder.flush(), 2)
+        self.assertEqual(len(self.recorder), 0)
+        self.assertEqual(self.reload(), self.webhook.last_updated_at)
+        self.assertEqual(self.recorder.flush(), 0)
+
+    def test_flush_keeps_latest(self):
+        later = self.created_at + datetime.timedelta(seconds=10)
+        self.recorder.record(self.webhook, later)
+        self.recorder.record(self.webhook, self.created_at + datetime.timedelta(seconds=5))  # noqa
+        self.recorder.flush()
+        self.assertEqual(self.reload(), later)
+
+    def test_flush_never_goes_backwards(self):
+        earlier = self.created_at - datetime.timedelta(seconds=10)
+        self.recorder.record(self.webhook, earlier)
+        self.recorder.flush()
+        self.assertEqual(self.reload(), self.created_at)
+
+    def test_record_flushes_when_due(self):
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 0):
+            recorder = ActivityRecorder(interval=60, use_timer=False)
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 30):
+            recorder.record(self.webhook)
+        self.assertEqual(len(recorder), 1)
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 61):
+            recorder.record(self.webhook)
+        self.assertEqual(len(recorder), 0)
+        self.assertEqual(self.reload(), self.webhook.last_updated_at)
+
+    def test_record_flush_errors(self):
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 0):
+            recorder = ActivityRecorder(interval=60, use_timer=False)
+        later = self.created_at + datetime.timedelta(seconds=10)
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 30):
+            recorder.record(self.webhook, later)
+        with mock.patch('trello_webhooks.activity.time.time', lambda: 61):
+            with mock.patch('trello_webhooks.models.Webhook.objects.filter', side_effect=DatabaseError):  # noqa
+                # the error is logged, not raised
+                recorder.record(self.webhook, self.created_at + datetime.timedelta(seconds=5))  # noqa
+        # and the latest timestamp is kept for the next flush
+        self.assertEqual(recorder._pending, {self.webhook.pk: later})
+        self.assertEqual(recorder.flush(), 1)
+        self.assertEqual(self.reload(), later)
+
+    def test_add_callback(self):
+        recorder = ActivityRecorder(interval=60, use_timer=False)
+        body = json.dumps(get_sample_data('commentCard', 'json'))
+        with mock.patch('trello_webhooks.settings.TOUCH_INTERVAL', 60):
+            with mock.patch('trello_webhooks.models.activity_recorder', recorder):  # noqa
+                event = self.webhook.add_callback(body)
+        self.assertEqual(self.webhook.last_updated_at, event.timestamp)
+        self.assertEqual(len(recorder), 1)
+        self.assertEqual(self.reload(), self.created_at)
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
-from django.test import TestCase
+import json
+import mock
 
-from trello_webhooks.admin import CallbackEventAdmin
+from django.contrib import admin
+from django.contrib.admin.templatetags.admin_list import results
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from trello_webhooks.admin import (
+    CallbackEventAdmin,
+    EstimatedCountPaginator,
+    WebhookAdmin,
+    estimated_count
+)
 from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.tests import new_sample_data
 
 
 class CallbackEventAdminTests(TestCase):
@@ -30,3 +45,146 @@ class CallbackEventAdminTests(TestCase):
         self.assertIsNotNone(self.admin.rendered(self.event))
         self.event.event_type = "X"
         self.assertIsNone(self.admin.rendered(self.event))
+
+
+class CallbackEventChangeListTests(TestCase):
+
+    def setUp(self):
+        webhook = Webhook(auth_token="ABC").save(sync=False)
+        for event_type in ('commentCard', 'createCard', 'X') * 10:
+            CallbackEvent(
+                webhook=webhook,
+                event_type=event_type,
+                event_payload=new_sample_data('commentCard', 'json')
+            ).save()
+        self.admin = CallbackEventAdmin(CallbackEvent, admin.site)
+
+    def get_rows(self, per_page):
+        """Build the changelist, and every cell in it, as the admin would."""
+        self.admin.list_per_page = per_page
+        request = RequestFactory().get('/')
+        request.user = mock.Mock()
+        ChangeList = self.admin.get_changelist(request)
+        cl = ChangeList(
+            request, CallbackEvent, self.admin.list_display,
+            self.admin.list_display_links, self.admin.list_filter,
+            self.admin.date_hierarchy, self.admin.search_fields,
+            self.admin.list_select_related, self.admin.list_per_page,
+            self.admin.list_max_show_all, self.admin.list_editable,
+            self.admin
+        )
+        cl.formset = None
+        return [list(row) for row in results(cl)]
+
+    def count_queries(self, per_page):
+        with CaptureQueriesContext(connection) as context:
+            rows = self.get_rows(per_page)
+        self.assertEqual(len(rows), per_page)
+        return len(context.captured_queries)
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self.count_queries(5), self.count_queries(25))
+
+    @mock.patch('trello_webhooks.admin.estimated_count', lambda qs: 10 ** 7)
+    def test_estimated_count(self):
+        queryset = CallbackEvent.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 10 ** 7)
+        # filtered querysets are always counted
+        queryset = queryset.filter(event_type='X')
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 10)
+
+    @mock.patch('trello_webhooks.admin.estimated_count', lambda qs: 20)
+    def test_estimated_count_below_threshold(self):
+        queryset = CallbackEvent.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 30)
+
+    def test_estimated_count_unsupported(self):
+        # sqlite has no estimate, so we fall back to COUNT(*)
+        self.assertIsNone(estimated_count(CallbackEvent.objects.all()))
+        queryset = CallbackEvent.objects.all()
+        self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 30)
+
+
+class WebhookAdminEventsTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook(auth_token="ABC").save(sync=False)
+        self.events = [
+            CallbackEvent(
+                webhook=self.webhook,
+                event_type=event_type,
+                event_payload=new_sample_data('commentCard', 'json')
+            ).save()
+            for event_type in ('commentCard', 'X') * 5
+        ]
+        # events for another webhook should never appear
+        CallbackEvent(webhook=Webhook().save(sync=False)).save()
+        self.admin = WebhookAdmin(Webhook, admin.site)
+        self.factory = RequestFactory()
+
+    def get_events(self, **params):
+        request = self.factory.get('/', params)
+        request.user = mock.Mock()
+        response = self.admin.events_view(request, str(self.webhook.id))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_events_view(self):
+        data = self.get_events(limit=4)
+        self.assertEqual(
+            [e['id'] for e in data['events']],
+            [e.id for e in reversed(self.events)][:4]
+        )
+        self.assertEqual(data['next'], data['events'][-1]['id'])
+        self.assertFalse(data['events'][0]['has_template'])
+        self.assertTrue(data['events'][1]['has_template'])
+
+    def test_events_view_paging(self):
+        ids, before = [], None
+        while True:
+            data = self.get_events(limit=3, before=before or '')
+            ids += [e['id'] for e in data['events']]
+            before = data['next']
+            if before is None:
+                break
+        self.assertEqual(ids, [e.id for e in reversed(self.events)])
+
+    def test_events_view_query_count(self):
+        with self.assertNumQueries(1):
+            self.get_events(limit=2)
+        with self.assertNumQueries(1):
+            self.get_events(limit=10)
+
+    def test_events_view_limit(self):
+        # limits outside 1-100 are clamped
+        for limit, count in ((0, 1), (-1, 1), (1000, len(self.events))):
+            data = self.get_events(limit=limit)
+            self.assertEqual(len(data['events']), count, limit)
+
+    def test_events_view_invalid(self):
+        request = self.factory.get('/', {'before': 'X'})
+        request.user = mock.Mock()
+        response = self.admin.events_view(request, str(self.webhook.id))
+        self.assertEqual(response.status_code, 400)
+
+    def test_events_view_permission(self):
+        request = self.factory.get('/')
+        request.user = mock.Mock()
+        request.user.has_perm.return_value = False
+        self.assertRaises(
+            PermissionDenied,
+            self.admin.events_view, request, str(self.webhook.id)
+        )
+
+    def test_event_view(self):
+        request = self.factory.get('/')
+        request.user = mock.Mock()
+        event = self.events[0]
+        response = self.admin.event_view(request, self.webhook.id, event.id)
+        self.assertEqual(response.content.decode('utf-8'), event.render())
+        response = self.admin.event_view(request, self.webhook.id, self.events[1].id)  # noqa
+        self.assertIn("No template", response.content)
+        self.assertRaises(
+            Http404,
+            self.admin.event_view, request, self.webhook.id + 1, event.id
+        )
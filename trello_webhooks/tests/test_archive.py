@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import Http404
+from django.test import TestCase, RequestFactory
+from django.utils import timezone
+
+from trello_webhooks import archive
+from trello_webhooks.admin import WebhookAdmin
+from trello_webhooks.models import ArchivedBlock, CallbackEvent, Webhook
+from trello_webhooks.tests import new_sample_data
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        patcher = mock.patch('trello_webhooks.settings.ARCHIVE_ROOT', self.root)  # noqa
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.webhook = Webhook(auth_token='A').save(sync=False)
+        now = timezone.now()
+        # 5 events on each of 3 days, interleaved so that a chunk spans files
+        self.events = []
+        self.payloads = {}
+        for i in range(15):
+            payload = new_sample_data('commentCard', 'text')
+            event = CallbackEvent(
+                webhook=self.webhook,
+                event_type='commentCard',
+                event_payload=payload
+            ).save()
+            self.payloads[event.id] = payload
+            event.timestamp = now - timedelta(days=10 + i % 3)
+            CallbackEvent.objects.filter(id=event.id).update(timestamp=event.timestamp)  # noqa
+            self.events.append(event)
+        self.recent = CallbackEvent(
+            webhook=self.webhook,
+            event_type='createCard',
+            event_payload={}
+        ).save()
+
+    def archive_files(self):
+        return sorted(
+            os.path.join(path, f)
+            for path, _, files in os.walk(self.root) for f in files
+        )
+
+    def test_archive(self):
+        call_command('archive_callback_events', days=5, chunk_size=4, block_size=2)  # noqa
+        self.assertEqual(list(CallbackEvent.objects.all()), [self.recent])
+        files = self.archive_files()
+        self.assertEqual(len(files), 3)
+        # each file is an ordinary (multi-member) gzipped JSONL file
+        ids = []
+        for path in files:
+            lines = gzip.open(path).read().splitlines()
+            ids += [json.loads(line)['id'] for line in lines]
+        self.assertEqual(sorted(ids), [e.id for e in self.events])
+        self.assertEqual(
+            sum(ArchivedBlock.objects.values_list('event_count', flat=True)), 15  # noqa
+        )
+
+    def test_fetch_event(self):
+        call_command('archive_callback_events', days=5, chunk_size=4, block_size=2)  # noqa
+        for original in self.events:
+            event = archive.fetch_event(original.id)
+            self.assertEqual(event.id, original.id)
+            self.assertEqual(event.webhook_id, self.webhook.id)
+            self.assertEqual(event.timestamp, original.timestamp)
+            self.assertEqual(event.event_type, 'commentCard')
+            self.assertEqual(event.event_payload, json.loads(self.payloads[event.id]))  # noqa
+            self.assertEqual(event.trello_action_id, original.trello_action_id)
+        self.assertIsNone(archive.fetch_event(self.recent.id))
+
+    def test_fetch_event_reads_matching_blocks(self):
+        call_command('archive_callback_events', days=5, block_size=2)
+        event = self.events[7]
+        with mock.patch('trello_webhooks.archive.read_block', wraps=archive.read_block) as read_block:  # noqa
+            self.assertEqual(archive.fetch_event(event.id).id, event.id)
+        # the fixture interleaves days, so the blocks in different files
+        # overlap, but only those whose range includes the id are read
+        self.assertLess(read_block.call_count, ArchivedBlock.objects.count())
+        for args, _ in read_block.call_args_list:
+            self.assertLessEqual(args[0].first_id, event.id)
+            self.assertGreaterEqual(args[0].last_id, event.id)
+
+    def test_archive_appends(self):
+        call_command('archive_callback_events', days=11)
+        self.assertEqual(CallbackEvent.objects.count(), 6)
+        call_command('archive_callback_events', days=5)
+        self.assertEqual(CallbackEvent.objects.count(), 1)
+        for original in self.events:
+            self.assertEqual(archive.fetch_event(original.id).id, original.id)
+
+    def test_archive_failure_rolls_back(self):
+        with mock.patch('trello_webhooks.archive.ArchiveWriter.verify', side_effect=archive.ArchiveError):  # noqa
+            self.assertRaises(
+                archive.ArchiveError,
+                call_command, 'archive_callback_events', days=5
+            )
+        # nothing deleted, nothing indexed, and the files are empty
+        self.assertEqual(CallbackEvent.objects.count(), 16)
+        self.assertEqual(ArchivedBlock.objects.count(), 0)
+        for path in self.archive_files():
+            self.assertEqual(os.path.getsize(path), 0)
+
+    def test_archive_invalid(self):
+        self.assertRaises(CommandError, call_command, 'archive_callback_events')  # noqa
+        with mock.patch('trello_webhooks.settings.ARCHIVE_ROOT', None):
+            self.assertRaises(CommandError, call_command, 'archive_callback_events', days=5)  # noqa
+
+    def test_admin_event_view(self):
+        call_command('archive_callback_events', days=5)
+        request = RequestFactory().get('/')
+        request.user = mock.Mock()
+        webhook_admin = WebhookAdmin(Webhook, admin.site)
+        event = self.events[0]
+        response = webhook_admin.event_view(request, str(self.webhook.id), str(event.id))  # noqa
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(json.loads(self.payloads[event.id])['action']['data']['text'], response.content)  # noqa
+        self.assertRaises(
+            Http404,
+            webhook_admin.event_view, request, str(self.webhook.id + 1), str(event.id)  # noqa
+        )
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import json
+import mock
+
+from django.test import TestCase
+
+from trello_webhooks import ingest
+from trello_webhooks.buffer import CallbackEventBuffer
+from trello_webhooks.cache import webhook_cache
+from trello_webhooks.models import Webhook, CallbackEvent, QueuedCallback
+from trello_webhooks.signals import callback_received
+from trello_webhooks.tests import get_sample_data, new_sample_data
+
+
+class CallbackEventBufferTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook(auth_token='A', trello_model_id='123').save(sync=False)  # noqa
+        self.body = get_sample_data('commentCard', 'text')
+
+    def test_add(self):
+        buffer = CallbackEventBuffer(max_size=10, max_latency=60)
+        event = buffer.add(self.webhook, self.body, tag='x')
+        self.assertEqual(event.event_type, 'commentCard')
+        self.assertIsNotNone(event.timestamp)
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.tags, ['x'])
+        # nothing is saved until we flush
+        self.assertEqual(CallbackEvent.objects.count(), 0)
+
+    def test_should_flush_size(self):
+        buffer = CallbackEventBuffer(max_size=2, max_latency=60)
+        self.assertFalse(buffer.should_flush())
+        buffer.add(self.webhook, self.body)
+        self.assertFalse(buffer.should_flush())
+        buffer.add(self.webhook, self.body)
+        self.assertTrue(buffer.should_flush())
+
+    def test_should_flush_latency(self):
+        buffer = CallbackEventBuffer(max_size=10, max_latency=5)
+        with mock.patch('trello_webhooks.buffer.time.time', lambda: 100):
+            buffer.add(self.webhook, self.body)
+        with mock.patch('trello_webhooks.buffer.time.time', lambda: 104):
+            self.assertFalse(buffer.should_flush())
+        with mock.patch('trello_webhooks.buffer.time.time', lambda: 105):
+            self.assertTrue(buffer.should_flush())
+
+    def test_flush(self):
+        received = []
+
+        def receiver(sender, event, **kwargs):
+            # the event must already be in the database
+            received.append(CallbackEvent.objects.filter(id=event.id).count())
+
+        callback_received.connect(receiver, dispatch_uid='test_flush')
+        try:
+            buffer = CallbackEventBuffer(max_size=10, max_latency=60)
+            buffer.add(self.webhook, new_sample_data('commentCard', 'text'), tag=1)  # noqa
+            buffer.add(self.webhook, new_sample_data('commentCard', 'text'), tag=2)  # noqa
+            # no action id, so this one is saved on its own
+            buffer.add(self.webhook, json.dumps({'action': {'type': 'X'}}), tag=3)  # noqa
+            last_updated_at = self.webhook.last_updated_at
+            self.assertEqual(buffer.flush(), [1, 2, 3])
+        finally:
+            callback_received.disconnect(dispatch_uid='test_flush')
+        self.assertEqual(CallbackEvent.objects.count(), 3)
+        # each event was sent with its id
+        self.assertEqual(received, [1, 1, 1])
+        self.assertEqual(len(buffer), 0)
+        self.assertTrue(
+            Webhook.objects.get().last_updated_at > last_updated_at
+        )
+        # flushing an empty buffer is a no-op
+        self.assertEqual(buffer.flush(), [])
+
+    def test_flush_duplicates(self):
+        received = []
+
+        def receiver(sender, event, **kwargs):
+            received.append(event.trello_action_id)
+
+        saved = new_sample_data('commentCard', 'text')
+        self.webhook.add_callback(saved)
+        callback_received.connect(receiver, dispatch_uid='test_flush')
+        try:
+            buffer = CallbackEventBuffer(max_size=10, max_latency=60)
+            # a redelivery of an event that's already been saved ...
+            buffer.add(self.webhook, saved, tag=1)
+            # ... and one that's in the buffer twice
+            body = new_sample_data('commentCard', 'text')
+            buffer.add(self.webhook, body, tag=2)
+            buffer.add(self.webhook, body, tag=3)
+            # all of the callbacks have been dealt with
+            self.assertEqual(buffer.flush(), [1, 2, 3])
+        finally:
+            callback_received.disconnect(dispatch_uid='test_flush')
+        self.assertEqual(CallbackEvent.objects.count(), 2)
+        self.assertEqual(received, [json.loads(body)['action']['id']])
+
+
+class BufferedProcessBatchTests(TestCase):
+
+    def setUp(self):
+        webhook_cache.clear()
+        self.backend = ingest.DatabaseQueueBackend()
+        Webhook(auth_token='A', trello_model_id='123').save(sync=False)
+        self.body = json.dumps(get_sample_data('commentCard', 'json'))
+
+    def test_items_acked_on_flush(self):
+        buffer = CallbackEventBuffer(max_size=3, max_latency=60)
+        for _ in range(2):
+            self.backend.enqueue('A', '123', new_sample_data('commentCard', 'text'))  # noqa
+        ingest.process_batch(self.backend, buffer=buffer)
+        # not full, so still queued
+        self.assertEqual(CallbackEvent.objects.count(), 0)
+        self.assertEqual(QueuedCallback.objects.count(), 2)
+        self.backend.enqueue('A', '123', new_sample_data('commentCard', 'text'))  # noqa
+        ingest.process_batch(self.backend, buffer=buffer)
+        self.assertEqual(CallbackEvent.objects.count(), 3)
+        self.assertEqual(QueuedCallback.objects.count(), 0)
+
+    def test_force_flush(self):
+        buffer = CallbackEventBuffer(max_size=3, max_latency=60)
+        self.backend.enqueue('A', '123', self.body)
+        ingest.process_batch(self.backend, buffer=buffer)
+        ingest.flush_buffer(self.backend, buffer, force=True)
+        self.assertEqual(CallbackEvent.objects.count(), 1)
+        self.assertEqual(QueuedCallback.objects.count(), 0)
+
+    def test_flush_error(self):
+        buffer = CallbackEventBuffer(max_size=1, max_latency=60)
+        self.backend.enqueue('A', '123', self.body)
+        with mock.patch.object(CallbackEvent.objects, 'bulk_create', side_effect=Exception()):  # noqa
+            ingest.process_batch(self.backend, buffer=buffer)
+        # returned to the queue for another go
+        self.assertEqual(QueuedCallback.objects.get().attempts, 1)
+        self.assertEqual(len(buffer), 0)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.test import TestCase
+
+from trello_webhooks.cache import WebhookCache, webhook_cache
+from trello_webhooks.models import Webhook
+
+
+class WebhookCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = WebhookCache(max_size=2, ttl=60, negative_ttl=5)
+        self.webhook = Webhook(auth_token='A', trello_model_id='1').save(sync=False)  # noqa
+
+    def test_get(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.get('A', '1'), self.webhook)
+            self.assertEqual(self.cache.get('A', '1'), self.webhook)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_get_copy(self):
+        # changes to a returned webhook don't affect the cached one
+        webhook = self.cache.get('A', '1')
+        webhook.description = 'changed'
+        cached = self.cache.get('A', '1')
+        self.assertEqual(cached.description, '')
+        self.assertIsNot(cached, self.cache.get('A', '1'))
+        self.assertIsNot(cached._state, webhook._state)
+
+    def test_get_negative(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.cache.get('A', '2'))
+            self.assertIsNone(self.cache.get('A', '2'))
+
+    def test_ttl(self):
+        with mock.patch('trello_webhooks.cache.time.time', lambda: 100):
+            self.cache.get('A', '1')
+            self.cache.get('A', '2')
+        with mock.patch('trello_webhooks.cache.time.time', lambda: 106):
+            # negative entry has expired, positive one hasn't
+            with self.assertNumQueries(1):
+                self.cache.get('A', '1')
+                self.cache.get('A', '2')
+        with mock.patch('trello_webhooks.cache.time.time', lambda: 161):
+            with self.assertNumQueries(1):
+                self.cache.get('A', '1')
+
+    def test_lru(self):
+        self.cache.get('A', '1')
+        self.cache.get('A', '2')
+        self.cache.get('A', '1')
+        # evicts ('A', '2'), as ('A', '1') was used more recently
+        self.cache.get('A', '3')
+        self.assertEqual(len(self.cache), 2)
+        with self.assertNumQueries(0):
+            self.cache.get('A', '1')
+        with self.assertNumQueries(1):
+            self.cache.get('A', '2')
+
+    def test_disabled(self):
+        cache = WebhookCache(max_size=0)
+        with self.assertNumQueries(2):
+            cache.get('A', '1')
+            cache.get('A', '1')
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        self.cache.get('A', '1')
+        # the webhook has moved to a new key
+        self.webhook.trello_model_id = '2'
+        self.cache.invalidate(self.webhook)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_stats(self):
+        self.cache.get('A', '1')
+        self.cache.get('A', '1')
+        self.assertEqual(
+            self.cache.stats(),
+            {'hits': 1, 'misses': 1, 'size': 1, 'hit_rate': 0.5}
+        )
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['misses'], 0)
+
+
+class WebhookCacheSignalTests(TestCase):
+
+    def setUp(self):
+        webhook_cache.clear()
+
+    def test_post_save(self):
+        # cache the fact that it doesn't exist
+        self.assertIsNone(webhook_cache.get('A', '1'))
+        webhook = Webhook(auth_token='A', trello_model_id='1').save(sync=False)
+        self.assertEqual(webhook_cache.get('A', '1'), webhook)
+
+    def test_touch(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save(sync=False)
+        webhook_cache.get('A', '1')
+        webhook.touch()
+        self.assertEqual(len(webhook_cache), 1)
+
+    def test_post_delete(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save(sync=False)
+        webhook_cache.get('A', '1')
+        webhook.delete()
+        self.assertIsNone(webhook_cache.get('A', '1'))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import mock
+import trello
+
+from django.test import TestCase
+
+from trello_webhooks import client
+from trello_webhooks.models import Webhook
+from trello_webhooks.tests.fake_trello import FakeTrello
+
+
+class ClientTests(TestCase):
+
+    def setUp(self):
+        client.reset()
+
+    def tearDown(self):
+        client.reset()
+
+    def test_get_client(self):
+        c1 = client.get_client(token='A')
+        self.assertIsInstance(c1, client.PooledTrelloClient)
+        self.assertEqual(c1.resource_owner_key, 'A')
+        self.assertIs(client.get_client(token='A'), c1)
+        self.assertIsNot(client.get_client(token='B'), c1)
+        self.assertIs(Webhook(auth_token='A').get_client(), c1)
+
+    def test_get_client_threads(self):
+        clients = []
+
+        def get():
+            clients.append(client.get_client(token='A'))
+        threads = [threading.Thread(target=get) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(c) for c in clients)), 1)
+
+    def test_get_session(self):
+        session = client.get_session()
+        self.assertIs(client.get_session(), session)
+        self.assertEqual(
+            session.get_adapter('https://api.trello.com/')._pool_maxsize,
+            client.settings.HTTP_POOL_SIZE
+        )
+        client.reset()
+        self.assertIsNot(client.get_session(), session)
+
+    @mock.patch('trello_webhooks.settings.HTTP_TIMEOUT', 5)
+    def test_fetch_json(self):
+        with mock.patch.object(client.get_session(), 'request') as request:
+            request.return_value = mock.Mock(status_code=200, json=lambda: {'id': 'X'})  # noqa
+            response = client.get_client(token='A').fetch_json(
+                '/webhooks/X', http_method='PUT', post_args={'a': 1}
+            )
+            self.assertEqual(response, {'id': 'X'})
+            args, kwargs = request.call_args
+            self.assertEqual(args, ('PUT', 'https://api.trello.com/1/webhooks/X'))  # noqa
+            self.assertEqual(kwargs['timeout'], 5)
+            self.assertEqual(kwargs['data'], '{"a": 1}')
+
+            request.return_value = mock.Mock(status_code=401, text='')
+            self.assertRaises(trello.Unauthorized, client.get_client().fetch_json, '/X')  # noqa
+            request.return_value = mock.Mock(status_code=404, text='')
+            self.assertRaises(trello.ResourceUnavailable, client.get_client().fetch_json, '/X')  # noqa
+
+    def test_connections_reused(self):
+        with FakeTrello() as server:
+            with mock.patch('trello_webhooks.settings.TRELLO_API_URL', server.url):  # noqa
+                for i in range(10):
+                    Webhook(auth_token='A', trello_model_id=str(i)).save()
+                for i in range(10):
+                    Webhook(auth_token='B', trello_model_id=str(i)).save()
+                self.assertEqual(len(Webhook.remote_objects.list_hooks('A')), 10)  # noqa
+        self.assertEqual(len(server.requests), 21)
+        self.assertEqual(len(server.webhooks), 20)
+        self.assertEqual(server.connections, 1)
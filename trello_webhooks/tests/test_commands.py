@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+import mock
+import trello
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.tests import new_sample_data
+
+
+class BackfillCallbackEventsTests(TestCase):
+
+    def setUp(self):
+        webhook = Webhook().save(sync=False)
+        self.payloads = [new_sample_data('commentCard', 'json') for _ in range(2)]  # noqa
+        # mimic events saved before the columns existed (NB bulk_create
+        # doesn't call save, so the columns aren't set) - the last event
+        # is a redelivery of the first
+        CallbackEvent.objects.bulk_create([
+            CallbackEvent(
+                webhook=webhook,
+                timestamp=timezone.now(),
+                event_type='commentCard',
+                event_payload=payload
+            )
+            for payload in self.payloads + self.payloads[:1]
+        ])
+
+    def test_backfill(self):
+        timestamps = list(CallbackEvent.objects.values_list('timestamp', flat=True))  # noqa
+        call_command('backfill_callback_events', chunk_size=2)
+        events = CallbackEvent.objects.order_by('id')
+        # the redelivered event doesn't get the (duplicate) action id
+        self.assertEqual(
+            [event.trello_action_id for event in events],
+            [p['action']['id'] for p in self.payloads] + [None]
+        )
+        for event in events:
+            self.assertEqual(event.board_name, self.payloads[0]['action']['data']['board']['name'])  # noqa
+        # timestamps are not touched
+        self.assertEqual(
+            list(CallbackEvent.objects.values_list('timestamp', flat=True)),
+            timestamps
+        )
+
+    def test_backfill_skips_done(self):
+        event = CallbackEvent.objects.all()[0]
+        CallbackEvent.objects.filter(id=event.id).update(trello_action_id='X')
+        call_command('backfill_callback_events')
+        self.assertEqual(CallbackEvent.objects.get(id=event.id).board_name, None)
+        call_command('backfill_callback_events', all=True)
+        self.assertIsNotNone(CallbackEvent.objects.get(id=event.id).board_name)
+
+
+class PruneCallbackEventsTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook(trello_model_id='A').save(sync=False)
+        self.webhook2 = Webhook(trello_model_id='B').save(sync=False)
+        now = timezone.now()
+        for webhook in (self.webhook, self.webhook2):
+            for event_type in ('commentCard', 'createCard'):
+                for days in (1, 10, 100):
+                    event = CallbackEvent(
+                        webhook=webhook,
+                        event_type=event_type,
+                        event_payload={}
+                    ).save()
+                    CallbackEvent.objects.filter(id=event.id).update(
+                        timestamp=now - timedelta(days=days)
+                    )
+
+    def remaining(self, **kwargs):
+        return CallbackEvent.objects.filter(**kwargs).count()
+
+    def test_prune(self):
+        call_command('prune_callback_events', days=30, chunk_size=2)
+        self.assertEqual(self.remaining(), 8)
+        self.assertEqual(
+            self.remaining(timestamp__lt=timezone.now() - timedelta(days=30)), 0  # noqa
+        )
+        call_command('prune_callback_events', days=5)
+        self.assertEqual(self.remaining(), 4)
+        # nothing left to delete
+        call_command('prune_callback_events', days=5)
+        self.assertEqual(self.remaining(), 4)
+
+    def test_prune_webhook(self):
+        call_command('prune_callback_events', days=5, webhooks=[self.webhook.id])  # noqa
+        self.assertEqual(self.remaining(webhook=self.webhook), 2)
+        self.assertEqual(self.remaining(webhook=self.webhook2), 6)
+
+    def test_prune_event_type(self):
+        call_command('prune_callback_events', days=5, event_types=['createCard'])  # noqa
+        self.assertEqual(self.remaining(event_type='createCard'), 2)
+        self.assertEqual(self.remaining(event_type='commentCard'), 6)
+
+    def test_prune_chunks(self):
+        # one transaction (and SELECT + DELETE) per chunk
+        with mock.patch('trello_webhooks.management.commands.prune_callback_events.transaction') as tx:  # noqa
+            call_command('prune_callback_events', days=5, chunk_size=3)
+        # 8 events in chunks of 3, plus the final empty chunk
+        self.assertEqual(tx.atomic.call_count, 4)
+        self.assertEqual(self.remaining(), 4)
+
+    def test_prune_invalid(self):
+        self.assertRaises(CommandError, call_command, 'prune_callback_events')  # noqa
+        self.assertRaises(CommandError, call_command, 'prune_callback_events', days=1, chunk_size=0)  # noqa
+
+
+def mock_fetch_json(client, uri_path, http_method='GET', post_args=None, **kwargs):
+    """Fake Trello API response for Webhook._trello_sync."""
+    if post_args['idModel'] == 'BAD':
+        raise trello.ResourceUnavailable(u"Not found", mock.Mock(status=404))
+    return {'id': 'T_%s' % post_args['idModel'], 'active': True}
+
+
+def mock_list_hooks(token):
+    """Fake remote webhooks - two per token, one of which is local."""
+    return [
+        mock.Mock(id='T_%s1' % token, id_model='%s1' % token, desc='', token=token, active=True),  # noqa
+        mock.Mock(id='T_%s9' % token, id_model='%s9' % token, desc='', token=token, active=True),  # noqa
+    ]
+
+
+@mock.patch('trello_webhooks.client.PooledTrelloClient.fetch_json', mock_fetch_json)  # noqa
+@mock.patch.object(Webhook.remote_objects, 'list_hooks', mock_list_hooks)
+class SyncWebhooksTests(TestCase):
+
+    def setUp(self):
+        for token in ('A', 'B', 'C'):
+            for model_id in ('1', '2'):
+                Webhook(auth_token=token, trello_model_id=token + model_id).save(sync=False)  # noqa
+        Webhook(auth_token='C', trello_model_id='BAD').save(sync=False)
+
+    def state(self):
+        return list(
+            Webhook.objects
+            .order_by('auth_token', 'trello_model_id')
+            .values_list('auth_token', 'trello_model_id', 'trello_id', 'is_active')  # noqa
+        )
+
+    def test_sync_webhooks(self):
+        call_command('sync_webhooks', 'D')
+        state = self.state()
+        # local webhooks are synced, and saved
+        self.assertIn(('A', 'A2', 'T_A2', True), state)
+        self.assertIn(('C', 'BAD', '', False), state)
+        # missing remote webhooks are created, for all tokens
+        self.assertIn(('A', 'A9', 'T_A9', True), state)
+        self.assertIn(('D', 'D1', 'T_D1', True), state)
+        self.assertIn(('D', 'D9', 'T_D9', True), state)
+        self.assertEqual(len(state), 7 + 5)
+
+    def test_sync_webhooks_workers(self):
+        call_command('sync_webhooks', 'D')
+        serial = self.state()
+        Webhook.objects.update(trello_id='', is_active=None)
+        Webhook.objects.filter(trello_model_id__endswith='9').delete()
+        Webhook.objects.filter(auth_token='D').delete()
+        call_command('sync_webhooks', 'D', workers=4)
+        self.assertEqual(self.state(), serial)
+
+    def test_sync_webhooks_errors(self):
+        def list_hooks(token):
+            if token == 'B':
+                raise trello.Unauthorized(u"Unauthorized", mock.Mock())
+            return []
+        with mock.patch.object(Webhook.remote_objects, 'list_hooks', list_hooks):  # noqa
+            with mock.patch('trello_webhooks.management.commands.sync_webhooks.logger') as logger:  # noqa
+                call_command('sync_webhooks', workers=2)
+        summary = [
+            c[0][1] for c in logger.info.call_args_list
+            if len(c[0]) > 1 and isinstance(c[0][1], dict)
+        ][0]
+        self.assertEqual(summary['synced'], 7)
+        self.assertEqual(summary['active'], 6)
+        self.assertEqual(summary['tokens'], 3)
+        self.assertEqual(summary['token_errors'], 1)
+        self.assertEqual(summary['created'], 0)
+
+    def test_sync_webhooks_invalid_workers(self):
+        self.assertRaises(CommandError, call_command, 'sync_webhooks', workers=0)  # noqa
+
+    def test_sync_webhooks_orphans(self):
+        Webhook.objects.filter(trello_model_id='A2').update(trello_id='T_GONE')  # noqa
+        call_command('sync_webhooks')
+        # deleted on Trello, so deactivated locally, not re-registered
+        webhook = Webhook.objects.get(trello_model_id='A2')
+        self.assertEqual((webhook.trello_id, webhook.is_active), ('', False))
+
+    def test_sync_webhooks_orphans_reregister(self):
+        Webhook.objects.filter(trello_model_id='A2').update(trello_id='T_GONE')  # noqa
+        call_command('sync_webhooks', reregister=True)
+        webhook = Webhook.objects.get(trello_model_id='A2')
+        self.assertEqual((webhook.trello_id, webhook.is_active), ('T_A2', True))  # noqa
+
+    def test_sync_webhooks_dry_run(self):
+        state = self.state()
+        out = StringIO()
+        with mock.patch('trello_webhooks.client.PooledTrelloClient.fetch_json') as fetch_json:  # noqa
+            call_command('sync_webhooks', 'D', dry_run=True, stdout=out)
+            self.assertFalse(fetch_json.called)
+        self.assertEqual(self.state(), state)
+        self.assertIn(u"5 to create locally, 7 to sync to Trello", out.getvalue())  # noqa
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import mock
+
+from django.core.signals import request_finished
+from django.db import transaction
+from django.test import TestCase
+
+from trello_webhooks.dispatch import AsyncReceiver, async_receiver, dispatcher
+from trello_webhooks.models import CallbackEvent, Webhook
+from trello_webhooks.tests import get_sample_data
+
+# (thread name, event id) for each call to `recorder`
+calls = []
+# set to let `blocking` return
+gate = threading.Event()
+
+
+def recorder(sender, event, **kwargs):
+    calls.append((threading.current_thread().name, event.id))
+
+
+def blocking(sender, event, **kwargs):
+    gate.wait(5)
+    recorder(sender, event)
+
+
+def failing(sender, event, **kwargs):
+    raise Exception("Receiver error")
+
+
+class AsyncReceiverTests(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        gate.clear()
+        self.addCleanup(gate.set)
+        self.event = CallbackEvent(id=1)
+
+    def test_submit(self):
+        receiver = AsyncReceiver(recorder, workers=2)
+        self.assertTrue(receiver.submit(Webhook, self.event))
+        self.assertTrue(receiver.join(5))
+        self.assertEqual(len(calls), 1)
+        self.assertNotEqual(calls[0][0], threading.current_thread().name)
+        self.assertEqual(receiver.stats['completed'], 1)
+        self.assertEqual(receiver.in_flight, 0)
+
+    def test_queue_limit(self):
+        receiver = AsyncReceiver(blocking, max_queue=2)
+        self.assertTrue(receiver.submit(Webhook, self.event))
+        self.assertTrue(receiver.submit(Webhook, self.event))
+        self.assertFalse(receiver.submit(Webhook, self.event))
+        self.assertEqual(receiver.stats['dropped'], 1)
+        gate.set()
+        self.assertTrue(receiver.join(5))
+        self.assertEqual(len(calls), 2)
+        # and there's room again
+        self.assertTrue(receiver.submit(Webhook, self.event))
+        self.assertTrue(receiver.join(5))
+
+    def test_timeout(self):
+        receiver = AsyncReceiver(blocking, timeout=0.05)
+        receiver.submit(Webhook, self.event)
+        receiver.submit(Webhook, self.event)
+        # the worker gives up on both calls, without waiting for them
+        self.assertTrue(receiver.join(5))
+        self.assertEqual(receiver.stats['timed_out'], 2)
+        self.assertEqual(calls, [])
+        # abandoned calls still count towards the queue limit
+        self.assertEqual(receiver.in_flight, 2)
+        gate.set()
+        for _ in range(500):
+            if receiver.in_flight == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(receiver.in_flight, 0)
+        self.assertEqual(len(calls), 2)
+
+    def test_options(self):
+        with mock.patch('trello_webhooks.settings.ASYNC_RECEIVER_TIMEOUT', 30):  # noqa
+            self.assertEqual(AsyncReceiver(recorder).timeout, 30)
+            self.assertIsNone(AsyncReceiver(recorder, timeout=None).timeout)
+            self.assertEqual(AsyncReceiver(recorder, timeout=0).timeout, 0)
+
+    def test_kwargs(self):
+        receiver = AsyncReceiver(recorder)
+        with mock.patch.object(receiver, 'func') as func:
+            receiver.submit(Webhook, self.event, replay=True)
+            self.assertTrue(receiver.join(5))
+        self.assertEqual(func.call_args[1]['replay'], True)
+
+    def test_errors(self):
+        receiver = AsyncReceiver(failing)
+        receiver.submit(Webhook, self.event)
+        receiver.submit(Webhook, self.event)
+        self.assertTrue(receiver.join(5))
+        self.assertEqual(receiver.stats['failed'], 2)
+        self.assertEqual(receiver.in_flight, 0)
+
+
+class DispatcherTests(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        gate.clear()
+        self.addCleanup(gate.set)
+        self.webhook = Webhook(trello_model_id='A').save(sync=False)
+        self.text = get_sample_data('commentCard', 'text')
+        async_receiver(blocking, timeout=5)
+        async_receiver(failing)
+        self.addCleanup(dispatcher.unregister, blocking)
+        self.addCleanup(dispatcher.unregister, failing)
+
+    def receiver(self, func):
+        return dispatcher.receivers['%s.%s' % (func.__module__, func.__name__)]  # noqa
+
+    def test_add_callback(self):
+        with mock.patch('trello_webhooks.dispatch.connection', mock.Mock(in_atomic_block=False)):  # noqa
+            event = self.webhook.add_callback(self.text)
+        # the receiver is still running
+        self.assertEqual(calls, [])
+        self.assertEqual(self.receiver(blocking).stats['queued'], 1)
+        gate.set()
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual([event_id for _, event_id in calls], [event.id])
+        # one receiver failing doesn't affect the other
+        self.assertEqual(self.receiver(failing).stats['failed'], 1)
+        self.assertEqual(self.receiver(blocking).stats['completed'], 1)
+
+    def test_deferred_until_commit(self):
+        # NB the test itself runs in a transaction
+        gate.set()
+        event = self.webhook.add_callback(self.text)
+        self.assertEqual(self.receiver(blocking).stats['queued'], 0)
+        request_finished.send(sender=self.__class__)
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual([event_id for _, event_id in calls], [event.id])
+
+    def test_rolled_back(self):
+        gate.set()
+        try:
+            with transaction.atomic():
+                self.webhook.add_callback(self.text)
+                raise Exception("Rollback")
+        except Exception:
+            pass
+        dispatcher.flush()
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual(calls, [])
+        self.assertEqual(self.receiver(blocking).stats['queued'], 0)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import csv
+from datetime import datetime, timedelta
+import json
+
+import mock
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from trello_webhooks import export
+from trello_webhooks.admin import CallbackEventAdmin
+from trello_webhooks.models import CallbackEvent, Webhook
+from trello_webhooks.tests import new_sample_data
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook(trello_model_id='A').save(sync=False)
+        self.webhook2 = Webhook(trello_model_id='B').save(sync=False)
+        self.now = timezone.now()
+        self.events = []
+        for i, event_type in enumerate(('commentCard', 'createCard') * 3):
+            event = CallbackEvent(
+                webhook=self.webhook if i < 4 else self.webhook2,
+                event_type=event_type,
+                event_payload=new_sample_data('commentCard', 'json')
+            ).save()
+            CallbackEvent.objects.filter(id=event.id).update(
+                timestamp=self.now - timedelta(days=i)
+            )
+            self.events.append(event)
+
+    def export(self, **options):
+        out = StringIO()
+        call_command('export_callback_events', stdout=out, **options)
+        return out.getvalue()
+
+    def exported_ids(self, **options):
+        lines = self.export(**options).splitlines()
+        return [json.loads(line)['id'] for line in lines]
+
+    def test_export_jsonl(self):
+        lines = self.export(page_size=4).splitlines()
+        self.assertEqual(len(lines), 6)
+        record = json.loads(lines[0])
+        self.assertEqual(record['id'], self.events[0].id)
+        self.assertEqual(record['webhook_id'], self.webhook.id)
+        self.assertEqual(record['event_type'], 'commentCard')
+        self.assertEqual(record['event_payload'], self.events[0].event_payload)
+        self.assertEqual([json.loads(l)['id'] for l in lines], [e.id for e in self.events])  # noqa
+
+    def test_export_csv(self):
+        rows = list(csv.reader(StringIO(self.export(format='csv'))))
+        self.assertEqual(tuple(rows[0]), export.CSV_COLUMNS)
+        self.assertEqual(len(rows), 7)
+        row = dict(zip(rows[0], rows[1]))
+        self.assertEqual(int(row['id']), self.events[0].id)
+        self.assertEqual(json.loads(row['event_payload']), self.events[0].event_payload)  # noqa
+        self.assertEqual(row['trello_card_name'], self.events[0].card_name)
+
+    def test_export_filters(self):
+        self.assertEqual(
+            self.exported_ids(webhooks=[self.webhook2.id]),
+            [e.id for e in self.events[4:]]
+        )
+        self.assertEqual(
+            self.exported_ids(event_types=['createCard']),
+            [e.id for e in self.events[1::2]]
+        )
+        # events are 0, 1, 2... days old
+        since = (self.now - timedelta(days=3, hours=1)).isoformat()
+        until = (self.now - timedelta(days=1, hours=1)).isoformat()
+        self.assertEqual(
+            self.exported_ids(since=since, until=until),
+            [self.events[2].id, self.events[3].id]
+        )
+
+    def test_export_pages(self):
+        # one query per page, plus one to find there are no more
+        with CaptureQueriesContext(connection) as queries:
+            events = list(export.iter_events(CallbackEvent.objects.all(), page_size=2))  # noqa
+        self.assertEqual(len(events), 6)
+        self.assertEqual(len(queries), 4)
+
+    def test_export_output_file(self):
+        with mock.patch('trello_webhooks.management.commands.export_callback_events.open', create=True) as open_:  # noqa
+            call_command('export_callback_events', output='events.jsonl')
+        open_.assert_called_once_with('events.jsonl', 'wb')
+        self.assertEqual(open_.return_value.write.call_count, 6)
+        open_.return_value.close.assert_called_once_with()
+
+    def test_export_invalid(self):
+        self.assertRaises(CommandError, call_command, 'export_callback_events', since='X')  # noqa
+        self.assertRaises(CommandError, call_command, 'export_callback_events', page_size=0)  # noqa
+
+    def test_parse_time(self):
+        with self.settings(TIME_ZONE='UTC'):
+            self.assertEqual(
+                export.parse_time('2015-01-31'),
+                timezone.make_aware(datetime(2015, 1, 31), timezone.utc)
+            )
+            self.assertEqual(
+                export.parse_time('2015-01-31T12:30:00+01:00'),
+                timezone.make_aware(datetime(2015, 1, 31, 11, 30), timezone.utc)  # noqa
+            )
+        self.assertRaises(ValueError, export.parse_time, '31/01/2015')
+
+    def test_admin_export_view(self):
+        event_admin = CallbackEventAdmin(CallbackEvent, admin.site)
+        request = RequestFactory().get('/', {
+            'webhook': [self.webhook.id],
+            'event_type': 'createCard',
+            'format': 'jsonl',
+        })
+        request.user = mock.Mock()
+        response = event_admin.export_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(
+            [json.loads(l)['id'] for l in lines],
+            [self.events[1].id, self.events[3].id]
+        )
+
+    def test_admin_export_view_invalid(self):
+        event_admin = CallbackEventAdmin(CallbackEvent, admin.site)
+        for params in ({'format': 'xml'}, {'since': 'X'}, {'webhook': 'X'}):
+            request = RequestFactory().get('/', params)
+            request.user = mock.Mock()
+            self.assertEqual(event_admin.export_view(request).status_code, 400)  # noqa
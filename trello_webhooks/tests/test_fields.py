@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from trello_webhooks import codec, compression
+from trello_webhooks.fields import RawPayload
+from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.tests import get_sample_data, new_sample_data
+
+
+class CodecTests(TestCase):
+
+    def test_get_codec(self):
+        name, loads, dumps = codec.get_codec('json')
+        self.assertEqual(name, 'json')
+        self.assertEqual(loads(dumps({'a': [1, 2]})), {'a': [1, 2]})
+        self.assertRaises(ImproperlyConfigured, codec.get_codec, 'X')
+
+    def test_get_codec_auto(self):
+        name, _, _ = codec.get_codec('auto')
+        self.assertIn(name, codec.CODECS)
+
+    def test_loads_dumps(self):
+        payload = get_sample_data('updateCard', 'json')
+        text = codec.dumps(payload)
+        self.assertIsInstance(text, unicode)
+        self.assertEqual(codec.loads(text), payload)
+        self.assertEqual(codec.loads(text.encode('utf-8')), payload)
+
+    def test_dumps_pretty(self):
+        self.assertEqual(
+            codec.get_codec('json')[2]({'b': 1, 'a': 2}, pretty=True),
+            u'{\n    "a": 2,\n    "b": 1\n}'
+        )
+
+
+class PayloadFieldTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook().save(sync=False)
+        # deliberately odd formatting, so we can tell if it's re-serialised
+        self.text = u'{"action":  {"type": "commentCard", "id": "1"}}'
+
+    def raw_value(self, event):
+        return (
+            CallbackEvent.objects
+            .filter(id=event.id)
+            .values_list('event_payload', flat=True)[0]
+        )
+
+    def test_raw_payload_stored_verbatim(self):
+        event = CallbackEvent(
+            webhook=self.webhook,
+            event_payload=RawPayload(self.text, {'action': {}})
+        ).save()
+        self.assertEqual(self.raw_value(event), self.text)
+
+    def test_text_stored_verbatim(self):
+        event = CallbackEvent(webhook=self.webhook, event_payload=self.text)
+        self.assertEqual(event.event_payload['action']['type'], 'commentCard')
+        event.save()
+        self.assertEqual(self.raw_value(event), self.text)
+
+    def test_value_serialised(self):
+        event = CallbackEvent(
+            webhook=self.webhook,
+            event_payload={'action': {'type': 'X'}}
+        ).save()
+        self.assertEqual(
+            codec.loads(self.raw_value(event)),
+            {'action': {'type': 'X'}}
+        )
+
+    def test_default(self):
+        event = CallbackEvent(webhook=self.webhook).save()
+        self.assertEqual(event.event_payload, {})
+        self.assertEqual(CallbackEvent.objects.get().event_payload, {})
+
+    def test_lazy_decode(self):
+        CallbackEvent(webhook=self.webhook, event_payload=self.text).save()
+        event = CallbackEvent.objects.get()
+        self.assertNotIn('event_payload', event.__dict__)
+        self.assertEqual(event.event_payload['action']['id'], '1')
+        self.assertIn('event_payload', event.__dict__)
+
+    def test_add_callback(self):
+        text = get_sample_data('commentCard', 'text')
+        event = self.webhook.add_callback(text)
+        self.assertEqual(self.raw_value(event), text)
+
+
+class CompressionTests(TestCase):
+
+    def test_compress(self):
+        text = get_sample_data('updateCard', 'text').decode('utf-8')
+        data = compression.compress(text, 'zlib')
+        self.assertTrue(data.startswith(compression.TAGS['zlib']))
+        self.assertLess(len(data), len(text))
+        self.assertEqual(compression.decompress(data), text)
+        self.assertEqual(compression.decompress(buffer(data)), text)
+        self.assertEqual(compression.decompress(memoryview(data)), text)
+        self.assertRaises(ValueError, compression.decompress, b'?' + data[1:])
+
+    def test_get_compressor(self):
+        self.assertEqual(compression.get_compressor('zlib')[0], 'zlib')
+        self.assertIn(compression.get_compressor('auto')[0], compression.ALGORITHMS)  # noqa
+        self.assertRaises(ImproperlyConfigured, compression.get_compressor, 'X')  # noqa
+
+
+@mock.patch('trello_webhooks.compression.ALGORITHM', 'zlib')
+class CompressedPayloadFieldTests(TestCase):
+
+    def setUp(self):
+        self.webhook = Webhook().save(sync=False)
+        self.text = get_sample_data('commentCard', 'text')
+
+    def stored(self, event):
+        return (
+            CallbackEvent.objects
+            .filter(id=event.id)
+            .values_list('event_payload', 'event_payload_compressed')[0]
+        )
+
+    def test_compressed(self):
+        event = self.webhook.add_callback(self.text)
+        payload, compressed = self.stored(event)
+        self.assertEqual(payload, '')
+        self.assertEqual(compression.decompress(compressed), self.text)
+        event = CallbackEvent.objects.get()
+        self.assertEqual(event.event_payload, codec.loads(self.text))
+        field = CallbackEvent._meta.get_field('event_payload')
+        self.assertEqual(field.get_raw(event), self.text)
+
+    def test_lazy_decompress(self):
+        self.webhook.add_callback(self.text)
+        with mock.patch('trello_webhooks.fields.compression.decompress', wraps=compression.decompress) as decompress:  # noqa
+            event = CallbackEvent.objects.get()
+            self.assertFalse(decompress.called)
+            event.event_payload['action']
+            event.event_payload['action']
+            self.assertEqual(decompress.call_count, 1)
+
+    def test_assign_new_payload(self):
+        event = self.webhook.add_callback(self.text)
+        event = CallbackEvent.objects.get()
+        event.event_payload = {'action': {}}
+        event.save()
+        self.assertEqual(CallbackEvent.objects.get().event_payload, {'action': {}})  # noqa
+
+    def test_compression_disabled(self):
+        event = self.webhook.add_callback(self.text)
+        with mock.patch('trello_webhooks.compression.ALGORITHM', None):
+            # compressed payloads can still be read, and are decompressed
+            # if they're saved again
+            event = CallbackEvent.objects.get()
+            self.assertEqual(event.event_payload, codec.loads(self.text))
+            event.save()
+            self.assertEqual(self.stored(event), (self.text, None))
+
+    def test_convert_command(self):
+        with mock.patch('trello_webhooks.compression.ALGORITHM', None):
+            texts = [new_sample_data('commentCard', 'text') for _ in range(3)]
+            events = [self.webhook.add_callback(text) for text in texts]
+        self.assertEqual(self.stored(events[0]), (texts[0], None))
+        call_command('compress_callback_events', chunk_size=2)
+        for event, text in zip(events, texts):
+            payload, compressed = self.stored(event)
+            self.assertEqual(payload, '')
+            self.assertEqual(compression.decompress(compressed), text)
+        call_command('compress_callback_events', decompress=True)
+        for event, text in zip(events, texts):
+            self.assertEqual(self.stored(event), (text, None))
+
+    def test_convert_command_disabled(self):
+        with mock.patch('trello_webhooks.compression.ALGORITHM', None):
+            self.assertRaises(CommandError, call_command, 'compress_callback_events')  # noqa
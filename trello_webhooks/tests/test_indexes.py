@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# query plan regression tests - check that the hot queries use an index
+import datetime
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from trello_webhooks.models import Webhook, CallbackEvent, QueuedCallback
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are SQLite-specific.")
+class QueryPlanTests(TestCase):
+
+    def query_plan(self, queryset):
+        """Return the EXPLAIN QUERY PLAN output for a queryset as a string."""
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+        # the last column is the human-readable detail
+        return u"\n".join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, queryset):
+        plan = self.query_plan(queryset)
+        self.assertIn(u"USING", plan, plan)
+        self.assertIn(u"INDEX", plan, plan)
+
+    def test_webhook_lookup(self):
+        # the callback view lookup
+        self.assertUsesIndex(
+            Webhook.objects.filter(auth_token='A', trello_model_id='1')
+        )
+
+    def test_webhook_unique(self):
+        self.assertIn(
+            ['auth_token', 'trello_model_id'],
+            [list(u) for u in Webhook._meta.unique_together]
+        )
+
+    def test_events_by_webhook(self):
+        # latest events for a webhook
+        self.assertUsesIndex(
+            CallbackEvent.objects.filter(webhook_id=1).order_by('-timestamp')
+        )
+
+    def test_events_by_event_type(self):
+        # admin list_filter
+        self.assertUsesIndex(
+            CallbackEvent.objects.filter(event_type='commentCard')
+        )
+
+    def test_events_by_timestamp(self):
+        # admin list_filter
+        since = timezone.now() - datetime.timedelta(days=7)
+        self.assertUsesIndex(
+            CallbackEvent.objects.filter(timestamp__gte=since)
+        )
+
+    def test_queued_callbacks_by_lease(self):
+        # ingestion worker
+        self.assertUsesIndex(
+            QueuedCallback.objects.filter(lease_token='X')
+        )
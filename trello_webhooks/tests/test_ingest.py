@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import json
+import mock
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from trello_webhooks import ingest
+from trello_webhooks.cache import webhook_cache
+from trello_webhooks.models import Webhook, CallbackEvent, QueuedCallback
+from trello_webhooks.tests import get_sample_data
+
+
+class DatabaseQueueBackendTests(TestCase):
+
+    def setUp(self):
+        self.backend = ingest.DatabaseQueueBackend()
+        self.body = get_sample_data('commentCard', 'text')
+
+    def test_enqueue(self):
+        queued = self.backend.enqueue('A', '123', self.body)
+        self.assertEqual(QueuedCallback.objects.count(), 1)
+        self.assertEqual(queued.auth_token, 'A')
+        self.assertEqual(queued.trello_model_id, '123')
+        self.assertEqual(queued.body, self.body)
+        self.assertIsNotNone(queued.received_at)
+
+    def test_fetch_claims_items(self):
+        for _ in range(3):
+            self.backend.enqueue('A', '123', self.body)
+        items = self.backend.fetch(2)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0].body, self.body)
+        # the first two are leased, so a second worker only gets the third
+        self.assertEqual(len(self.backend.fetch(2)), 1)
+        self.assertEqual(len(self.backend.fetch(2)), 0)
+
+    def test_ack(self):
+        self.backend.enqueue('A', '123', self.body)
+        self.backend.ack(self.backend.fetch(1)[0])
+        self.assertEqual(QueuedCallback.objects.count(), 0)
+
+    @mock.patch('trello_webhooks.settings.INGESTION_MAX_ATTEMPTS', 2)
+    def test_fail(self):
+        self.backend.enqueue('A', '123', self.body)
+        self.backend.fail(self.backend.fetch(1)[0], Exception())
+        # released, so available again
+        item = self.backend.fetch(1)[0]
+        self.assertEqual(QueuedCallback.objects.get().attempts, 1)
+        # and now it's had its chances
+        self.backend.fail(item, Exception())
+        self.assertEqual(self.backend.fetch(1), [])
+        self.assertEqual(QueuedCallback.objects.get().attempts, 2)
+
+
+class ProcessBatchTests(TestCase):
+
+    def setUp(self):
+        webhook_cache.clear()
+        self.backend = ingest.DatabaseQueueBackend()
+        self.webhook = Webhook(auth_token='A', trello_model_id='123').save(sync=False)  # noqa
+        self.payload = get_sample_data('commentCard', 'json')
+
+    def test_process_batch(self):
+        self.backend.enqueue('A', '123', json.dumps(self.payload))
+        self.assertEqual(ingest.process_batch(self.backend), 1)
+        self.assertEqual(QueuedCallback.objects.count(), 0)
+        event = CallbackEvent.objects.get()
+        self.assertEqual(event.webhook, self.webhook)
+        self.assertEqual(event.event_payload, self.payload)
+
+    def test_process_batch_unknown_webhook(self):
+        self.backend.enqueue('X', '123', json.dumps(self.payload))
+        self.assertEqual(ingest.process_batch(self.backend), 1)
+        # dropped, not retried
+        self.assertEqual(QueuedCallback.objects.count(), 0)
+        self.assertEqual(CallbackEvent.objects.count(), 0)
+
+    def test_process_batch_error(self):
+        self.backend.enqueue('A', '123', "not json")
+        self.assertEqual(ingest.process_batch(self.backend), 1)
+        self.assertEqual(QueuedCallback.objects.get().attempts, 1)
+        self.assertEqual(CallbackEvent.objects.count(), 0)
+
+
+@mock.patch('trello_webhooks.settings.ASYNC_INGESTION', True)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        webhook_cache.clear()
+        self.url = reverse(
+            'trello_callback_url',
+            kwargs={'auth_token': 'A', 'trello_model_id': '123'}
+        )
+
+    def test_post_queues_callback(self):
+        Webhook(auth_token='A', trello_model_id='123').save(sync=False)
+        payload = get_sample_data('commentCard', 'text')
+        resp = self.client.post(
+            self.url,
+            data=payload,
+            content_type='application/json'
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(CallbackEvent.objects.count(), 0)
+        self.assertEqual(QueuedCallback.objects.get().body, payload)
+        ingest.process_batch()
+        self.assertEqual(CallbackEvent.objects.count(), 1)
+
+    def test_post_unknown_webhook(self):
+        # no lookup in the view, so no 404
+        resp = self.client.post(self.url, data={})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(QueuedCallback.objects.count(), 1)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import socket
+
+import mock
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from trello_webhooks import metrics
+from trello_webhooks.cache import webhook_cache
+from trello_webhooks.dispatch import dispatcher
+from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.signals import callback_received
+from trello_webhooks.tests import get_sample_data
+
+
+def receiver(sender, **kwargs):
+    pass
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        # wait for any async receivers (e.g. from the test app) to finish
+        dispatcher.join(5)
+        self.backend = metrics.MemoryBackend()
+        metrics.set_backend(self.backend)
+        self.addCleanup(metrics.set_backend, None)
+        self.addCleanup(dispatcher.join, 5)
+
+    def test_disabled(self):
+        metrics.set_backend(None)
+        self.assertIs(metrics.timer('x'), metrics.NULL_TIMER)
+        with mock.patch.object(callback_received, 'send') as send:
+            metrics.send(callback_received, 'x', sender=Webhook, event=None)
+        send.assert_called_once_with(sender=Webhook, event=None)
+
+    def test_get_backend(self):
+        with mock.patch('trello_webhooks.metrics._loaded', False):
+            with mock.patch('trello_webhooks.settings.METRICS_BACKEND', 'trello_webhooks.metrics.LoggingBackend'):  # noqa
+                self.assertIsInstance(metrics.get_backend(), metrics.LoggingBackend)  # noqa
+        with mock.patch('trello_webhooks.metrics._loaded', False):
+            with mock.patch('trello_webhooks.settings.METRICS_BACKEND', None):
+                self.assertIsNone(metrics.get_backend())
+        # a backend that can't be loaded turns metrics off
+        with mock.patch('trello_webhooks.metrics._loaded', False):
+            with mock.patch('trello_webhooks.settings.METRICS_BACKEND', 'trello_webhooks.metrics.X'):  # noqa
+                self.assertIsNone(metrics.get_backend())
+
+    def test_memory_backend(self):
+        for i in range(1, 101):
+            self.backend.timing('a', float(i))
+        summary = self.backend.summary()['a']
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['mean'], 50.5)
+        self.assertEqual((summary['min'], summary['max']), (1, 100))
+        self.assertEqual(summary['p50'], 51)
+        self.assertEqual(summary['p95'], 95)
+        # only the latest samples are kept, but everything is counted
+        backend = metrics.MemoryBackend(max_samples=10)
+        for i in range(100):
+            backend.timing('a', float(i))
+        self.assertEqual(backend.summary()['a']['count'], 100)
+        self.assertEqual(backend.summary()['a']['min'], 0)
+        self.assertEqual(backend.summary()['a']['p50'], 95)
+        backend.reset()
+        self.assertEqual(backend.summary(), {})
+
+    def test_statsd_backend(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        backend = metrics.StatsdBackend('127.0.0.1', server.getsockname()[1], 'tw')  # noqa
+        backend.timing('callback.insert', 1.5)
+        self.assertEqual(server.recv(1024), 'tw.callback.insert:1.500|ms')
+
+    def test_statsd_backend_unresolved(self):
+        backend = metrics.StatsdBackend('statsd.invalid', 8125, 'tw')
+        error = socket.gaierror("Name or service not known")
+        with mock.patch('socket.gethostbyname', side_effect=error) as lookup:
+            backend.timing('a', 1.0)
+            backend.timing('a', 1.0)
+        # the lookup isn't retried on every call
+        self.assertEqual(lookup.call_count, 1)
+        self.assertIsNone(backend.address)
+
+    def test_logging_backend(self):
+        with mock.patch('trello_webhooks.metrics.logger') as logger:
+            metrics.LoggingBackend().timing('a', 2.0)
+        logger.debug.assert_called_once_with(u"%s: %.3fms", 'a', 2.0)
+
+    def test_timer(self):
+        with mock.patch('trello_webhooks.metrics.clock', side_effect=[1.0, 1.25]):  # noqa
+            with metrics.timer('a'):
+                pass
+        self.assertEqual(self.backend.summary()['a']['max'], 250)
+
+    def test_callback_stages(self):
+        Webhook(auth_token='A', trello_model_id='M').save(sync=False)
+        webhook_cache.clear()
+        callback_received.connect(receiver, dispatch_uid='test_metrics')
+        self.addCleanup(callback_received.disconnect, dispatch_uid='test_metrics')  # noqa
+        self.client.post(
+            reverse('trello_callback_url', kwargs={'auth_token': 'A', 'trello_model_id': 'M'}),  # noqa
+            data=get_sample_data('commentCard', 'text'),
+            content_type='application/json'
+        )
+        self.assertEqual(CallbackEvent.objects.count(), 1)
+        summary = self.backend.summary()
+        for name in (
+            'callback.view',
+            'callback.lookup',
+            'callback.parse',
+            'callback.insert',
+            'callback.touch',
+            'callback.signal',
+            'callback.receiver.trello_webhooks.tests.test_metrics.receiver',
+            'callback.receiver.trello_webhooks.dispatch.on_callback_received',
+        ):
+            self.assertEqual(summary[name]['count'], 1, name)
+        # receivers are timed within the signal
+        self.assertTrue(
+            summary['callback.receiver.trello_webhooks.tests.test_metrics.receiver']['max'] <=  # noqa
+            summary['callback.signal']['max']
+        )
+
+    def test_render(self):
+        event = CallbackEvent(
+            webhook=Webhook().save(sync=False),
+            event_type='commentCard',
+            event_payload=get_sample_data('commentCard', 'json')
+        ).save()
+        event.render()
+        self.assertEqual(self.backend.summary()['render.template']['count'], 1)  # noqa
+        with mock.patch('trello_webhooks.settings.RENDER_CACHE', 'default'):
+            event.render()
+            event.render()
+        summary = self.backend.summary()
+        self.assertEqual(summary['render.cache']['count'], 2)
+        self.assertEqual(summary['render.template']['count'], 2)
+
+    def test_trello_sync(self):
+        webhook = Webhook(auth_token='A', trello_model_id='M')
+        with mock.patch('trello_webhooks.client.PooledTrelloClient.fetch_json', return_value={'id': 'T'}):  # noqa
+            webhook.sync()
+            webhook.sync()
+        summary = self.backend.summary()
+        self.assertEqual(summary['trello.sync.post']['count'], 1)
+        self.assertEqual(summary['trello.sync.put']['count'], 1)
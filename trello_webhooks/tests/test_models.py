@@ -4,6 +4,7 @@ import json
 import mock
 
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError
 from django.test import TestCase
 
 import trello
@@ -17,7 +18,7 @@ from trello_webhooks.settings import (
 from trello_webhooks.tests import get_sample_data
 
 
-def mock_trello_sync(webhook, verb):
+def mock_trello_sync(webhook, verb, fail_silently=True):
     """Fake version of the Webhook._trello_sync method.
 
     This mock requires no direct connection to Trello, and is deterministic,
@@ -39,7 +40,7 @@ def mock_trello_sync(webhook, verb):
     return webhook
 
 
-def mock_trello_sync_x(webhook, verb):
+def mock_trello_sync_x(webhook, verb, fail_silently=True):
     """Fake version of the Webhook._trello_sync method that mimics failure.
 
     This function mimics the result of _trello_sync if Trello responds with
@@ -251,8 +252,35 @@ class WebhookModelTests(TestCase):
         event = hook.add_callback(json.dumps(payload))
         self.assertEqual(event.webhook, hook)
         self.assertEqual(event.event_payload, payload)
+        self.assertEqual(event.trello_action_id, payload['action']['id'])
         # other CallbackEvent properties are tested in CallbackEvent tests
 
+    def test_add_callback_duplicate(self):
+        hook = Webhook().save(sync=False)
+        text = get_sample_data('commentCard', 'text')
+        event = hook.add_callback(text)
+        with mock.patch('trello_webhooks.signals.callback_received.send') as send:  # noqa
+            self.assertIsNone(hook.add_callback(text))
+        send.assert_not_called()
+        self.assertEqual(CallbackEvent.objects.get(), event)
+        # the same action can be received by another webhook
+        other = Webhook(trello_model_id='X').save(sync=False)
+        self.assertIsNotNone(other.add_callback(text))
+        # and a payload without an action id is never a duplicate
+        text = json.dumps({'action': {'type': 'commentCard'}})
+        self.assertIsNotNone(hook.add_callback(text))
+        self.assertIsNotNone(hook.add_callback(text))
+        self.assertEqual(CallbackEvent.objects.count(), 4)
+
+    def test_save_if_new_errors(self):
+        # errors other than duplicates are raised
+        event = Webhook().save(sync=False).build_callback(
+            get_sample_data('commentCard', 'text')
+        )
+        with mock.patch.object(CallbackEvent, 'save', side_effect=IntegrityError()):  # noqa
+            self.assertRaises(IntegrityError, event.save_if_new)
+        self.assertIsNone(event.id)
+
 
 class CallbackEventModelTest(TestCase):
 
@@ -296,22 +324,62 @@ class CallbackEventModelTest(TestCase):
         ce = CallbackEvent()
         self.assertEqual(ce.member_name, None)
         ce.event_payload = get_sample_data('createCard', 'text')
+        # the name is read from a column, set when the event is created
+        self.assertEqual(ce.member_name, None)
+        ce.update_trello_fields()
         self.assertEqual(ce.member_name, ce.event_payload['action']['memberCreator']['fullName'])  # noqa
 
     def test_board_name(self):
         ce = CallbackEvent()
         self.assertEqual(ce.board_name, None)
         ce.event_payload = get_sample_data('createCard', 'text')
+        # the name is read from a column, set when the event is created
+        self.assertEqual(ce.board_name, None)
+        ce.update_trello_fields()
         self.assertEqual(ce.board_name, ce.event_payload['action']['data']['board']['name'])  # noqa
 
     def test_list_name(self):
         ce = CallbackEvent()
         self.assertEqual(ce.list_name, None)
         ce.event_payload = get_sample_data('createCard', 'text')
+        # the name is read from a column, set when the event is created
+        self.assertEqual(ce.list_name, None)
+        ce.update_trello_fields()
         self.assertEqual(ce.list_name, ce.event_payload['action']['data']['list']['name'])  # noqa
 
+    def test_update_trello_fields(self):
+        ce = CallbackEvent()
+        ce.update_trello_fields()
+        self.assertIsNone(ce.trello_action_id)
+        self.assertEqual(ce.trello_board_id, '')
+        payload = get_sample_data('commentCard', 'json')
+        ce.event_payload = payload
+        ce.update_trello_fields()
+        action = payload['action']
+        self.assertEqual(ce.trello_action_id, action['id'])
+        self.assertEqual(ce.trello_member_id, action['memberCreator']['id'])
+        self.assertEqual(ce.trello_member_name, action['memberCreator']['fullName'])  # noqa
+        self.assertEqual(ce.trello_board_id, action['data']['board']['id'])
+        self.assertEqual(ce.trello_board_name, action['data']['board']['name'])
+        self.assertEqual(ce.trello_list_id, action['data']['list']['id'])
+        self.assertEqual(ce.trello_list_name, action['data']['list']['name'])
+        self.assertEqual(ce.trello_card_id, action['data']['card']['id'])
+        self.assertEqual(ce.trello_card_name, action['data']['card']['name'])
+
+    def test_save_updates_trello_fields(self):
+        webhook = Webhook().save(sync=False)
+        payload = get_sample_data('createCard', 'json')
+        ce = CallbackEvent(webhook=webhook, event_payload=payload).save()
+        self.assertEqual(
+            CallbackEvent.objects.get(trello_card_id=payload['action']['data']['card']['id']),  # noqa
+            ce
+        )
+
     def test_card_name(self):
         ce = CallbackEvent()
         self.assertEqual(ce.card_name, None)
         ce.event_payload = get_sample_data('createCard', 'text')
+        # the name is read from a column, set when the event is created
+        self.assertEqual(ce.card_name, None)
+        ce.update_trello_fields()
         self.assertEqual(ce.card_name, ce.event_payload['action']['data']['card']['name'])  # noqa
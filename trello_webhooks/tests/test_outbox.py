@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from trello_webhooks import client, outbox
+from trello_webhooks.models import Webhook, SyncIntent
+from trello_webhooks.tests.fake_trello import FakeTrello
+
+
+@mock.patch('trello_webhooks.settings.SYNC_MODE', 'outbox')
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        client.reset()
+        self.server = FakeTrello().__enter__()
+        patcher = mock.patch('trello_webhooks.settings.TRELLO_API_URL', self.server.url)  # noqa
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.__exit__()
+        client.reset()
+
+    def test_save_records_intent(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save()
+        self.assertEqual(self.server.requests, [])
+        intent = SyncIntent.objects.get()
+        self.assertEqual(intent.webhook, webhook)
+        self.assertEqual(intent.action, SyncIntent.SYNC)
+        # saving again collapses into the same intent
+        webhook.description = 'X'
+        webhook.save()
+        self.assertEqual(SyncIntent.objects.get().id, intent.id)
+        # as does a save without syncing
+        webhook.save(sync=False)
+        self.assertEqual(SyncIntent.objects.count(), 1)
+
+    def test_save_rolled_back(self):
+        try:
+            with transaction.atomic():
+                Webhook(auth_token='A', trello_model_id='1').save()
+                raise Exception()
+        except Exception:
+            pass
+        self.assertEqual(Webhook.objects.count(), 0)
+        self.assertEqual(SyncIntent.objects.count(), 0)
+
+    def test_drain(self):
+        for i in range(5):
+            Webhook(auth_token='A', trello_model_id=str(i)).save()
+        self.assertEqual(outbox.drain(batch_size=3), (3, 0))
+        self.assertEqual(outbox.drain(batch_size=3), (2, 0))
+        self.assertEqual(outbox.drain(batch_size=3), (0, 0))
+        self.assertEqual(SyncIntent.objects.count(), 0)
+        self.assertEqual(len(self.server.webhooks), 5)
+        for webhook in Webhook.objects.all():
+            self.assertTrue(webhook.is_active)
+            self.assertIn(webhook.trello_id, self.server.webhooks)
+
+    def test_delete(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save()
+        outbox.drain()
+        webhook = Webhook.objects.get()
+        trello_id = webhook.trello_id
+        webhook.save()
+        webhook.delete()
+        self.assertEqual(Webhook.objects.count(), 0)
+        intent = SyncIntent.objects.get()
+        self.assertEqual(intent.action, SyncIntent.DELETE)
+        self.assertEqual(intent.trello_id, trello_id)
+        self.assertIn(trello_id, self.server.webhooks)
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertNotIn(trello_id, self.server.webhooks)
+        self.assertEqual(SyncIntent.objects.count(), 0)
+
+    def test_delete_not_synced(self):
+        Webhook(auth_token='A', trello_model_id='1').save().delete()
+        self.assertEqual(SyncIntent.objects.count(), 0)
+
+    @mock.patch('trello_webhooks.settings.RATE_LIMIT_RETRIES', 0)
+    def test_retry(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save()
+        self.server.retry_after = [1]
+        self.assertEqual(outbox.drain(), (0, 1))
+        intent = SyncIntent.objects.get()
+        self.assertEqual(intent.attempts, 1)
+        self.assertTrue(intent.next_attempt_at > timezone.now())
+        self.assertIn(u"429", intent.last_error)
+        self.assertIsNone(Webhook.objects.get().is_active)
+        # not due yet
+        self.assertEqual(outbox.drain(), (0, 0))
+        SyncIntent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(), (1, 0))
+        self.assertTrue(Webhook.objects.get(id=webhook.id).is_active)
+
+    @mock.patch('trello_webhooks.settings.SYNC_MAX_ATTEMPTS', 1)
+    @mock.patch('trello_webhooks.settings.RATE_LIMIT_RETRIES', 0)
+    def test_give_up(self):
+        Webhook(auth_token='A', trello_model_id='1').save()
+        self.server.retry_after = [1]
+        self.assertEqual(outbox.drain(), (0, 1))
+        SyncIntent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(), (0, 0))
+        self.assertEqual(SyncIntent.objects.get().attempts, 1)
+
+    def test_saved_whilst_processing(self):
+        webhook = Webhook(auth_token='A', trello_model_id='1').save()
+        intent, ex = outbox.apply_intent(outbox.fetch_due(10)[0])
+        self.assertIsNone(ex)
+        webhook.description = 'X'
+        webhook.save()
+        outbox.complete(intent)
+        # the result is saved, but the intent remains, to sync the change
+        self.assertEqual(Webhook.objects.get().trello_id, intent.webhook.trello_id)  # noqa
+        self.assertEqual(SyncIntent.objects.count(), 1)
+
+    def test_deleted_whilst_processing(self):
+        Webhook(auth_token='A', trello_model_id='1').save()
+        intent, ex = outbox.apply_intent(outbox.fetch_due(10)[0])
+        Webhook.objects.get().delete()
+        outbox.complete(intent)
+        # the newly registered remote webhook is deleted in turn
+        intent = SyncIntent.objects.get()
+        self.assertEqual(intent.action, SyncIntent.DELETE)
+        outbox.drain()
+        self.assertEqual(self.server.webhooks, {})
+
+    def test_command(self):
+        for i in range(10):
+            Webhook(auth_token='ABC'[i % 3], trello_model_id=str(i)).save()
+        call_command('drain_sync_outbox', workers=4, batch_size=4)
+        self.assertEqual(SyncIntent.objects.count(), 0)
+        self.assertEqual(Webhook.objects.filter(is_active=True).count(), 10)
+        # connections are reused - at most one per worker (fewer if a
+        # worker happens not to be given any of the intents)
+        self.assertTrue(0 < self.server.connections <= 4)
+
+    def test_inline(self):
+        with mock.patch('trello_webhooks.settings.SYNC_MODE', 'inline'):
+            Webhook(auth_token='A', trello_model_id='1').save()
+        self.assertEqual(SyncIntent.objects.count(), 0)
+        self.assertEqual(len(self.server.requests), 1)
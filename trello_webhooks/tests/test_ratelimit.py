@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from trello_webhooks import client
+from trello_webhooks.models import Webhook
+from trello_webhooks.ratelimit import RateLimiter, TokenBucket
+from trello_webhooks.tests.fake_trello import FakeTrello
+
+
+class FakeClock(object):
+    """Stands in for the time module - sleeping just moves the clock on."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def max_in_window(times, interval):
+    """Return the most requests made in any `interval`."""
+    return max(
+        len([t for t in times if start <= t < start + interval])
+        for start in times
+    )
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('trello_webhooks.ratelimit.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100, 10)
+        self.assertEqual(bucket.burst, 10)
+        self.assertEqual(bucket.rate, 9)
+        self.assertRaises(AssertionError, TokenBucket, 1, 10)
+
+    def test_acquire(self):
+        limiter = RateLimiter((50, 10), (20, 10))
+        times = {}
+        for i in range(300):
+            token = 'ABC'[i % 3]
+            limiter.acquire(token)
+            times.setdefault(token, []).append(self.clock.now)
+        all_times = sorted(sum(times.values(), []))
+        self.assertTrue(45 <= max_in_window(all_times, 10) <= 50)
+        for token_times in times.values():
+            self.assertTrue(max_in_window(token_times, 10) <= 20)
+
+    def test_acquire_token_limit(self):
+        limiter = RateLimiter(None, (20, 10))
+        times = []
+        for i in range(100):
+            limiter.acquire('A')
+            times.append(self.clock.now)
+        self.assertTrue(18 <= max_in_window(times, 10) <= 20)
+        # other tokens aren't held up
+        now = self.clock.now
+        self.assertEqual(limiter.acquire('B'), 0)
+        self.assertEqual(self.clock.now, now)
+
+    def test_no_limits(self):
+        limiter = RateLimiter(None, None)
+        for i in range(100):
+            self.assertEqual(limiter.acquire('A'), 0)
+        self.assertEqual(self.clock.now, 1000.0)
+
+
+class BackoffTests(TestCase):
+
+    @mock.patch('trello_webhooks.settings.RATE_LIMIT_BACKOFF', 1.0)
+    def test_backoff(self):
+        for attempt in range(10):
+            delay = client.backoff(attempt)
+            expected = min(60, 2 ** attempt)
+            self.assertTrue(expected / 2.0 <= delay <= expected)
+        self.assertEqual(client.backoff(0, retry_after=30), 30)
+
+    def test_retry_after(self):
+        self.assertEqual(client.retry_after(mock.Mock(headers={'Retry-After': '5'})), 5)  # noqa
+        self.assertIsNone(client.retry_after(mock.Mock(headers={})))
+        self.assertIsNone(client.retry_after(mock.Mock(headers={'Retry-After': 'X'})))  # noqa
+
+
+class FakeTrelloRateLimitTests(TestCase):
+    """Run the API calls against a fake Trello that enforces rate limits."""
+
+    key_limit = (10, 0.5)
+    token_limit = (4, 0.5)
+
+    def setUp(self):
+        client.reset()
+        self.server = FakeTrello(self.key_limit, self.token_limit).__enter__()
+        for patcher in (
+            mock.patch('trello_webhooks.settings.TRELLO_API_URL', self.server.url),  # noqa
+            mock.patch('trello_webhooks.client.rate_limiter', RateLimiter(self.key_limit, self.token_limit)),  # noqa
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.__exit__()
+        client.reset()
+
+    def test_limits_never_exceeded(self):
+        for token in ('A', 'B', 'C'):
+            for i in range(4):
+                self.server.add_webhook(token, '%s%i' % (token, i))
+            for i in range(4, 8):
+                Webhook(auth_token=token, trello_model_id='%s%i' % (token, i)).save(sync=False)  # noqa
+        call_command('sync_webhooks', workers=4)
+
+        self.assertEqual(self.server.rate_limited, 0)
+        self.assertEqual(Webhook.objects.filter(is_active=True).count(), 24)
+        times = [r[3] for r in self.server.requests]
+        self.assertEqual(len(times), 3 + 12)
+        self.assertTrue(max_in_window(times, 0.5) <= 10)
+        for token in ('A', 'B', 'C'):
+            times = [r[3] for r in self.server.requests if r[2] == token]
+            self.assertTrue(max_in_window(times, 0.5) <= 4)
+
+    @mock.patch('trello_webhooks.client.sleep')
+    def test_retry_after(self, sleep):
+        self.server.retry_after = [2, 3]
+        webhook = Webhook(auth_token='A', trello_model_id='1').save()
+        self.assertTrue(webhook.is_active)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertTrue(sleep.call_args_list[0][0][0] >= 2)
+        self.assertTrue(sleep.call_args_list[1][0][0] >= 3)
+
+    @mock.patch('trello_webhooks.client.sleep')
+    @mock.patch('trello_webhooks.settings.RATE_LIMIT_RETRIES', 2)
+    def test_rate_limited(self, sleep):
+        trello_id = self.server.add_webhook('A', '1')
+        webhook = Webhook(
+            auth_token='A',
+            trello_model_id='1',
+            trello_id=trello_id,
+            is_active=True
+        ).save(sync=False)
+        self.server.retry_after = [1] * 3
+        self.assertRaises(
+            client.RateLimited,
+            webhook.get_client().fetch_json, webhook.trello_url
+        )
+        self.assertEqual(sleep.call_count, 2)
+        # a rate limited webhook is left as it is - not marked inactive
+        self.server.retry_after = [1] * 3
+        webhook.sync()
+        self.assertEqual(webhook.trello_id, trello_id)
+        self.assertTrue(webhook.is_active)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import mock
+
+from django.test import TestCase
+
+from trello_webhooks.models import Webhook
+from trello_webhooks.reconcile import build_plan
+
+
+def remote_hook(token, model_id, trello_id=None):
+    return mock.Mock(
+        id=trello_id or 'T_%s' % model_id,
+        id_model=model_id,
+        desc='',
+        token=token,
+        active=True
+    )
+
+
+class BuildPlanTests(TestCase):
+
+    def setUp(self):
+        self.local = [
+            # matched on trello_id
+            Webhook(auth_token='A', trello_model_id='1', trello_id='T_1').save(sync=False),  # noqa
+            # matched on (token, model) - adopted
+            Webhook(auth_token='A', trello_model_id='2').save(sync=False),
+            # not on Trello - orphaned
+            Webhook(auth_token='A', trello_model_id='3', trello_id='T_3').save(sync=False),  # noqa
+            # token not listed - must be synced
+            Webhook(auth_token='B', trello_model_id='4', trello_id='T_4').save(sync=False),  # noqa
+        ]
+        self.remote = {
+            'A': [
+                remote_hook('A', '1'),
+                remote_hook('A', '2'),
+                remote_hook('A', '5'),
+                # a second hook on the same model - ignored
+                remote_hook('A', '5', trello_id='T_5_2'),
+            ],
+            'C': [remote_hook('C', '6')],
+        }
+
+    def test_build_plan(self):
+        plan = build_plan(self.local, self.remote)
+        self.assertEqual(
+            [(w.auth_token, w.trello_model_id, w.trello_id) for w in plan.create],  # noqa
+            [('A', '5', 'T_5'), ('C', '6', 'T_6')]
+        )
+        self.assertEqual(plan.update, [self.local[0], self.local[1], self.local[3]])  # noqa
+        self.assertEqual(plan.adopt, {self.local[1].id: 'T_2'})
+        self.assertEqual(plan.orphans, [self.local[2]])
+        self.assertEqual(len(plan), 6)
+        self.assertEqual(
+            plan.summary(),
+            {'create': 2, 'update': 3, 'adopt': 1, 'orphans': 1}
+        )
+        self.assertEqual(len(plan.describe()), 7)
+
+    def test_build_plan_does_not_change_anything(self):
+        with self.assertNumQueries(0):
+            build_plan(self.local, self.remote)
+        self.assertEqual(self.local[1].trello_id, '')
+        self.assertEqual(self.local[2].trello_id, 'T_3')
+
+    def test_build_plan_nothing_listed(self):
+        plan = build_plan(self.local, {})
+        self.assertEqual(plan.create, [])
+        self.assertEqual(plan.orphans, [])
+        self.assertEqual(plan.update, self.local)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import mock
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.template import Template
+from django.test import TestCase
+
+from trello_webhooks import rendering
+from trello_webhooks.rendering import TemplateRegistry, template_registry
+from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.tests import get_sample_data
+
+
+class TemplateRegistryTests(TestCase):
+
+    def setUp(self):
+        self.registry = TemplateRegistry()
+
+    def test_template_name(self):
+        self.assertEqual(
+            rendering.template_name('commentCard'),
+            'trello_webhooks/commentCard.html'
+        )
+
+    def test_find_event_types(self):
+        event_types = rendering.find_event_types()
+        self.assertIn('commentCard', event_types)
+        self.assertIn('updateCard', event_types)
+
+    def test_get(self):
+        template = self.registry.get('commentCard')
+        self.assertIsInstance(template, Template)
+        # subsequent lookups don't go anywhere near the loaders
+        with mock.patch('trello_webhooks.rendering.get_template') as get_template:  # noqa
+            self.assertIs(self.registry.get('commentCard'), template)
+            self.assertFalse(get_template.called)
+
+    @mock.patch('trello_webhooks.rendering.logger')
+    def test_get_missing(self, logger):
+        self.assertIsNone(self.registry.get('X'))
+        self.assertIsNone(self.registry.get('X'))
+        self.assertFalse(self.registry.has_template('X'))
+        # only logged once
+        self.assertEqual(logger.warning.call_count, 1)
+
+    def test_preload(self):
+        self.registry.preload()
+        self.assertEqual(len(self.registry), len(rendering.find_event_types()))
+        self.registry.preload(['X'])
+        self.assertFalse(self.registry.has_template('X'))
+
+    def test_refresh(self):
+        self.registry.preload(['X'])
+        self.registry.refresh()
+        self.assertNotIn('X', self.registry._templates)
+        self.assertTrue(self.registry.has_template('commentCard'))
+
+    def test_version(self):
+        version = self.registry.version
+        self.assertEqual(len(version), 12)
+        self.assertEqual(self.registry.version, version)
+        with mock.patch('trello_webhooks.rendering.templates_version') as tv:
+            tv.return_value = 'changed'
+            # the version is only recalculated on refresh
+            self.assertEqual(self.registry.version, version)
+            self.registry.refresh()
+            self.assertEqual(self.registry.version, 'changed')
+
+    def test_templates_version_changes(self):
+        template_dir = tempfile.mkdtemp()
+        path = os.path.join(template_dir, 'commentCard.html')
+        try:
+            with mock.patch('trello_webhooks.rendering.template_dirs') as td:
+                td.return_value = [template_dir]
+                with open(path, 'w') as f:
+                    f.write('{{ action }}')
+                version = rendering.templates_version()
+                self.assertEqual(rendering.templates_version(), version)
+                with open(path, 'w') as f:
+                    f.write('{{ action.type }}')
+                self.assertNotEqual(rendering.templates_version(), version)
+        finally:
+            shutil.rmtree(template_dir)
+
+    def test_global_registry_loaded_at_startup(self):
+        self.assertTrue(len(template_registry) > 0)
+
+
+class CallbackEventRenderTests(TestCase):
+
+    def test_render(self):
+        event = CallbackEvent(
+            event_type='commentCard',
+            event_payload=get_sample_data('commentCard', 'json')
+        )
+        self.assertTrue(event.has_template)
+        self.assertIn(u"Test comment", event.render())
+
+    def test_render_missing(self):
+        event = CallbackEvent(event_type='X')
+        self.assertFalse(event.has_template)
+        self.assertIsNone(event.render())
+
+    def test_render_cache_disabled(self):
+        # TRELLO_WEBHOOKS_RENDER_CACHE is None in the test settings
+        event = CallbackEvent(
+            webhook=Webhook().save(sync=False),
+            event_type='commentCard',
+        ).save()
+        with mock.patch.object(Template, 'render') as render:
+            event.render()
+            event.render()
+            self.assertEqual(render.call_count, 2)
+
+
+@mock.patch('trello_webhooks.settings.RENDER_CACHE', 'default')
+class RenderCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.event = CallbackEvent(
+            webhook=Webhook().save(sync=False),
+            event_type='commentCard',
+            event_payload=get_sample_data('commentCard', 'json')
+        ).save()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_render_cached(self):
+        html = self.event.render()
+        with mock.patch.object(Template, 'render') as render:
+            self.assertEqual(self.event.render(), html)
+            self.assertEqual(CallbackEvent.objects.get().render(), html)
+            self.assertFalse(render.called)
+
+    def test_render_unsaved_not_cached(self):
+        event = CallbackEvent(event_type='commentCard', event_payload={})
+        with mock.patch.object(Template, 'render') as render:
+            event.render()
+            event.render()
+            self.assertEqual(render.call_count, 2)
+
+    def test_template_change_invalidates(self):
+        self.event.render()
+        with mock.patch.object(template_registry, '_version', 'changed'):
+            with mock.patch.object(Template, 'render') as render:
+                render.return_value = u"new"
+                self.assertEqual(self.event.render(), u"new")
+                self.assertEqual(render.call_count, 1)
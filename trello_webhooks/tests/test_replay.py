@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from multiprocessing import Pool
+import os
+import shutil
+import tempfile
+
+import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from trello_webhooks import replay
+from trello_webhooks.dispatch import async_receiver, dispatcher
+from trello_webhooks.models import CallbackEvent, Webhook
+from trello_webhooks.signals import callback_received
+
+# (receiver name, event id, replay) for each call
+calls = []
+
+
+class Interrupted(BaseException):
+    """Raised by a receiver to mimic the replay being killed."""
+    pass
+
+
+def recorder(sender, **kwargs):
+    calls.append(('recorder', kwargs['event'].id, kwargs.get('replay')))
+
+
+def other(sender, **kwargs):
+    calls.append(('other', kwargs['event'].id, kwargs.get('replay')))
+
+
+def async_recorder(sender, **kwargs):
+    calls.append(('async', kwargs['event'].id, kwargs.get('replay')))
+    if kwargs['event'].event_type == 'X':
+        raise Exception("Receiver error")
+
+
+def failing(sender, **kwargs):
+    if kwargs['event'].event_type == 'X':
+        raise Exception("Receiver error")
+
+
+def interrupting(sender, **kwargs):
+    if kwargs['event'].event_type == 'X':
+        raise Interrupted()
+    recorder(sender, **kwargs)
+
+
+class ReplayTests(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        callback_received.connect(recorder, dispatch_uid='test_replay_recorder')  # noqa
+        callback_received.connect(other, dispatch_uid='test_replay_other')
+        webhook = Webhook(trello_model_id='A').save(sync=False)
+        self.events = [
+            CallbackEvent(webhook=webhook, event_type=event_type).save()
+            for event_type in ('commentCard', 'createCard') * 3
+        ]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def tearDown(self):
+        callback_received.disconnect(dispatch_uid='test_replay_recorder')
+        callback_received.disconnect(dispatch_uid='test_replay_other')
+
+    def ids(self, name='recorder'):
+        return [event_id for n, event_id, _ in calls if n == name]
+
+    def test_replay_all_receivers(self):
+        call_command('replay_callback_events', page_size=4)
+        self.assertEqual(self.ids(), [e.id for e in self.events])
+        self.assertEqual(self.ids('other'), [e.id for e in self.events])
+        self.assertTrue(all(r for _, _, r in calls))
+
+    def test_replay_receiver(self):
+        call_command(
+            'replay_callback_events',
+            receiver='trello_webhooks.tests.test_replay.recorder',
+            event_types=['createCard']
+        )
+        self.assertEqual(self.ids(), [e.id for e in self.events[1::2]])
+        self.assertEqual(self.ids('other'), [])
+
+    def test_replay_threads(self):
+        call_command('replay_callback_events', workers=3, page_size=4)
+        self.assertEqual(sorted(self.ids()), [e.id for e in self.events])
+
+    def test_replay_processes(self):
+        CallbackEvent.objects.filter(id=self.events[0].id).update(event_type='X')  # noqa
+        pool = Pool(2)
+        try:
+            count, errors = replay.replay(
+                CallbackEvent.objects.all(),
+                receiver='trello_webhooks.tests.test_replay.failing',
+                pool=pool
+            )
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual((count, errors), (6, 1))
+
+    def test_replay_errors(self):
+        CallbackEvent.objects.filter(id=self.events[0].id).update(event_type='X')  # noqa
+        callback_received.connect(failing, dispatch_uid='test_replay_failing')  # noqa
+        try:
+            count, errors = replay.replay(CallbackEvent.objects.all())
+        finally:
+            callback_received.disconnect(dispatch_uid='test_replay_failing')
+        # one receiver failing doesn't stop the others, or the replay
+        self.assertEqual((count, errors), (6, 1))
+        self.assertEqual(len(self.ids()), 6)
+
+    def test_replay_checkpoint(self):
+        checkpoint = os.path.join(self.tmp_dir, 'replay.json')
+        CallbackEvent.objects.filter(id=self.events[3].id).update(event_type='X')  # noqa
+        receiver = 'trello_webhooks.tests.test_replay.interrupting'
+        self.assertRaises(
+            Interrupted,
+            call_command, 'replay_callback_events',
+            receiver=receiver, page_size=2, checkpoint=checkpoint
+        )
+        self.assertEqual(replay.read_checkpoint(checkpoint), self.events[1].id)
+        CallbackEvent.objects.filter(id=self.events[3].id).update(event_type='createCard')  # noqa
+        call_command(
+            'replay_callback_events',
+            receiver=receiver, page_size=2, checkpoint=checkpoint
+        )
+        # the interrupted page is replayed again, the first page isn't
+        self.assertEqual(
+            self.ids(),
+            [e.id for e in self.events[:3]] + [e.id for e in self.events[2:]]
+        )
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_replay_async_receiver(self):
+        CallbackEvent.objects.filter(id=self.events[0].id).update(event_type='X')  # noqa
+        async_receiver(async_recorder, max_queue=1)
+        self.addCleanup(dispatcher.unregister, async_recorder)
+        checkpoint = os.path.join(self.tmp_dir, 'replay.json')
+        with mock.patch('trello_webhooks.replay.write_checkpoint') as write:
+            count, errors = replay.replay(
+                CallbackEvent.objects.all(), page_size=4, checkpoint=checkpoint
+            )
+        # every event is handled (not queued) before the checkpoint moves on
+        self.assertEqual(write.call_args_list[0][0][1:], (self.events[3].id, 4))  # noqa
+        self.assertEqual(self.ids('async'), [e.id for e in self.events])
+        self.assertTrue(all(r for _, _, r in calls))
+        self.assertEqual((count, errors), (6, 1))
+        # and none were queued (or dropped, with max_queue=1)
+        stats = dispatcher.stats()['trello_webhooks.tests.test_replay.async_recorder']  # noqa
+        self.assertEqual((stats['queued'], stats['dropped']), (0, 0))
+
+    def test_replay_invalid(self):
+        self.assertRaises(CommandError, call_command, 'replay_callback_events', receiver='trello_webhooks.tests.X')  # noqa
+        self.assertRaises(CommandError, call_command, 'replay_callback_events', workers=0)  # noqa
+        self.assertRaises(CommandError, call_command, 'replay_callback_events', until='X')  # noqa
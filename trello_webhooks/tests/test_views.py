@@ -4,7 +4,9 @@ import json
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from trello_webhooks.cache import webhook_cache
 from trello_webhooks.models import Webhook, CallbackEvent
+from trello_webhooks.signals import callback_received
 from trello_webhooks.tests import get_sample_data
 
 
@@ -12,6 +14,7 @@ class WebhookViewTests(TestCase):
     pass
 
     def setUp(self):
+        webhook_cache.clear()
         self.payload = {'auth_token': 'A', 'trello_model_id': '123'}
         self.url = reverse('trello_callback_url', kwargs=self.payload)
 
@@ -42,6 +45,27 @@ class WebhookViewTests(TestCase):
             test_payload
         )
 
+    def test_post_duplicate(self):
+        Webhook(
+            auth_token=self.payload['auth_token'],
+            trello_model_id=self.payload['trello_model_id']
+        ).save(sync=False)
+        received = []
+
+        def receiver(sender, event, **kwargs):
+            received.append(event.id)
+
+        callback_received.connect(receiver, dispatch_uid='test_post_duplicate')
+        self.addCleanup(callback_received.disconnect, dispatch_uid='test_post_duplicate')  # noqa
+        body = get_sample_data('commentCard', 'text')
+        for _ in range(2):
+            resp = self.client.post(
+                self.url, data=body, content_type='application/json'
+            )
+            # Trello is told that the redelivery was received
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(received, [CallbackEvent.objects.get().id])
+
     def test_get_405(self):
         resp = self.client.get(self.url)
         self.assertEqual(resp.status_code, 405)
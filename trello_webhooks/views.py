@@ -1,15 +1,19 @@
 # # -*- coding: utf-8 -*-
 import logging
 
+from django.db import transaction
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseNotAllowed
 from django.views.decorators.csrf import csrf_exempt
 
-from trello_webhooks.models import Webhook
+from trello_webhooks import ingest, metrics, settings
+from trello_webhooks.cache import webhook_cache
 
 logger = logging.getLogger(__name__)
 
 
 @csrf_exempt
+@transaction.non_atomic_requests
+@metrics.timed('callback.view')
 def api_callback(request, auth_token, trello_model_id):
     """Handle the callback from Trello.
 
@@ -23,7 +27,17 @@ def api_callback(request, auth_token, trello_model_id):
 
     NB This is all happening synchronously whilst Trello is waiting for a
     response from the view, so don't have long-running processes handling
-    the signal.
+    the signal - register slow receivers with dispatch.async_receiver, so
+    that they run in the background, once the event has been committed
+    (which is why this view is excluded from ATOMIC_REQUESTS).
+
+    If the TRELLO_WEBHOOKS_ASYNC_INGESTION setting is True, then the
+    request body is handed straight to the ingestion backend, and the rest
+    of the work is done by the `process_callbacks` command - see the
+    trello_webhooks.ingest module for details. (NB in this mode callbacks
+    for unknown webhooks still get a 200, and are dropped by the worker.)
+
+    Each stage of the view is timed - see trello_webhooks.metrics.
 
     Args:
         auth_token: string, the user token against which the webhook was
@@ -41,15 +55,16 @@ def api_callback(request, auth_token, trello_model_id):
 
     if request.method == 'POST':
         logger.info(u"Trello event callback received for '%s'", trello_model_id)
-        try:
-            (
-                Webhook.objects
-                .get(auth_token=auth_token, trello_model_id=trello_model_id)
-                .add_callback(request.body)
-            )
+        if settings.ASYNC_INGESTION:
+            ingest.get_backend().enqueue(auth_token, trello_model_id, request.body)
             return HttpResponse("Message received")
-        except Webhook.DoesNotExist:
+        # webhooks rarely change, so the lookup is cached - see cache.py
+        with metrics.timer('callback.lookup'):
+            webhook = webhook_cache.get(auth_token, trello_model_id)
+        if webhook is None:
             logger.warning(u"No webhook found for %s:%s", trello_model_id, trello_model_id)  # noqa
             return HttpResponseNotFound()
+        webhook.add_callback(request.body)
+        return HttpResponse("Message received")
 
     return HttpResponseNotAllowed(['HEAD', 'POST'])